@@ -0,0 +1,399 @@
+import numpy as np
+import pandas as pd
+
+COST_COLUMNS = ['BASE_ENCOUNTER_COST', 'TOTAL_CLAIM_COST', 'PAYER_COVERAGE']
+
+
+def _counts(df, columns):
+    """
+    Counts the rows per combination of columns, as a Series with a sorted MultiIndex.
+    """
+    counts = df.groupby(columns, observed=True, sort=False).size()
+    return counts[counts > 0].sort_index()
+
+
+def _merge(current, new):
+    """
+    Adds the aggregates of new rows to existing ones.
+    """
+    if current is None or current.empty:
+        return new.sort_index()
+    if new.empty:
+        return current
+    return current.add(new, fill_value=0).astype(current.dtype).sort_index()
+
+
+def _months(values):
+    """
+    Truncates datetime-like values to their month (datetime64[M]).
+    """
+    return pd.to_datetime(values).to_numpy().astype('datetime64[M]')
+
+
+class AggregateCube:
+    """
+    Small precomputed tables behind the Visualizations page charts.
+    
+    - population demographics: patients per GENDER and per RACE
+    - per patient: encounters per month, encounters per ENCOUNTERCLASS, procedures per DESCRIPTION
+    - per patient: totals of the encounter cost columns
+    
+    Per-patient aggregates are Series sorted by patient, so one patient's values are a
+    binary search away. New rows are folded in with refresh() instead of a rebuild.
+    
+    Parameters:
+    patients (pd.DataFrame): The patients table.
+    encounters (pd.DataFrame): The encounters table.
+    procedures (pd.DataFrame): The procedures table.
+    """
+
+    def __init__(self, patients, encounters, procedures):
+        self.gender = None
+        self.race = None
+        self.monthly = None
+        self.encounter_classes = None
+        self.procedure_types = None
+        self.costs = None
+        self.refresh(patients=patients, encounters=encounters, procedures=procedures)
+
+    def refresh(self, patients=None, encounters=None, procedures=None):
+        """
+        Adds the aggregates of new rows. Each argument holds only rows not seen before.
+        
+        Parameters:
+        patients (pd.DataFrame, optional): New patients.
+        encounters (pd.DataFrame, optional): New encounters.
+        procedures (pd.DataFrame, optional): New procedures.
+        """
+        if patients is not None:
+            self.gender = _merge(self.gender, patients['GENDER'].value_counts().sort_index())
+            self.race = _merge(self.race, patients['RACE'].value_counts().sort_index())
+
+        if encounters is not None:
+            months = pd.DataFrame({'PATIENT': encounters['PATIENT'].to_numpy(), 'MONTH': _months(encounters['START'])})
+            self.monthly = _merge(self.monthly, _counts(months, ['PATIENT', 'MONTH']))
+            self.encounter_classes = _merge(self.encounter_classes, _counts(encounters, ['PATIENT', 'ENCOUNTERCLASS']))
+            cost_columns = [column for column in COST_COLUMNS if column in encounters.columns]
+            costs = encounters.groupby('PATIENT', observed=True)[cost_columns].sum()
+            costs['ENCOUNTERS'] = encounters.groupby('PATIENT', observed=True).size()
+            self.costs = costs if self.costs is None else self.costs.add(costs, fill_value=0).sort_index()
+
+        if procedures is not None:
+            self.procedure_types = _merge(self.procedure_types, _counts(procedures, ['PATIENT', 'DESCRIPTION']))
+
+    def _patient_values(self, aggregate, patient_id):
+        if aggregate is None:
+            return pd.Series(dtype=int)
+        try:
+            # The index is sorted, so this is a binary search
+            return aggregate.xs(patient_id, level=0)
+        except KeyError:
+            return aggregate.iloc[:0].droplevel(0)
+
+    def gender_distribution(self):
+        return self.gender.rename_axis('Gender').reset_index(name='Count')
+
+    def race_distribution(self):
+        return self.race.rename_axis('Race').reset_index(name='Count')
+
+    def patient_monthly_encounters(self, patient_id):
+        """
+        Returns the encounters per month of a patient, with months as 'YYYY-MM' strings.
+        """
+        counts = self._patient_values(self.monthly, patient_id)
+        months = np.asarray(counts.index.to_numpy(), dtype='datetime64[M]').astype(str)
+        return pd.DataFrame({'START': months, 'count': counts.to_numpy()})
+
+    def patient_encounter_classes(self, patient_id):
+        counts = self._patient_values(self.encounter_classes, patient_id).sort_values(ascending=False, kind='stable')
+        return pd.DataFrame({'Encounter Class': counts.index.astype(str), 'Count': counts.to_numpy()})
+
+    def patient_procedure_types(self, patient_id):
+        counts = self._patient_values(self.procedure_types, patient_id).sort_values(ascending=False, kind='stable')
+        return pd.DataFrame({'Procedure Type': counts.index.astype(str), 'Count': counts.to_numpy()})
+
+    def patient_costs(self, patient_id):
+        """
+        Returns the encounter count and cost totals of a patient as a Series (empty if unknown).
+        """
+        if self.costs is None or patient_id not in self.costs.index:
+            return pd.Series(dtype=float)
+        return self.costs.loc[patient_id]
+
+
+KPI_DIMENSIONS = ['PAYER', 'ORGANIZATION', 'ENCOUNTERCLASS', 'MONTH']
+KPI_MEASURES = COST_COLUMNS + ['LENGTH_OF_STAY']
+KPI_PERCENTILES = (0.5, 0.9)
+# Quantile sketches: estimates are within 1% of the true value; values up to SKETCH_MIN_VALUE count as 0
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MIN_VALUE = 1e-4
+SKETCH_MAX_VALUE = 1e12
+# Largest (groups x buckets) count matrix built at once when estimating quantiles
+SKETCH_DENSE_CELLS = 4_000_000
+
+
+def _sum_by_key(keys, columns, n_keys):
+    """
+    Sums columns per key, with a bincount when the keys are few enough, else with a hash group-by.
+    
+    Parameters:
+    keys (np.ndarray): Non-negative int64 keys below n_keys.
+    columns (dict): Column name -> np.ndarray of values to sum.
+    n_keys (int): The number of possible keys.
+    
+    Returns:
+    tuple: The sorted keys present (np.ndarray) and a dict of column name -> sums per key present.
+    """
+    if n_keys <= max(2 * len(keys), SKETCH_DENSE_CELLS):
+        present = np.flatnonzero(np.bincount(keys, minlength=n_keys))
+        return present, {name: np.bincount(keys, weights=values, minlength=n_keys)[present].astype(values.dtype)
+                         for name, values in columns.items()}
+    sums = pd.DataFrame(columns).groupby(keys).sum()
+    return sums.index.to_numpy(), {name: sums[name].to_numpy() for name in columns}
+
+
+class QuantileSketch:
+    """
+    Log-bucketed histogram for quantile estimates with a bounded relative error (as in DDSketch).
+    
+    A positive value x falls in bucket ceil(log(x) / log(gamma)) with gamma = (1 + a) / (1 - a);
+    every value of a bucket is within a relative accuracy a of the bucket's value. Bucket 0 holds
+    values up to min_value (including zeros and negative values). Sketches of disjoint rows merge
+    by adding their bucket counts, which is what makes them precomputable per rollup cell.
+    
+    Parameters:
+    relative_accuracy (float): The relative error bound a of the estimates.
+    min_value (float): The largest value counted as 0.
+    max_value (float): The largest value kept apart, larger values share the last bucket.
+    """
+
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY, min_value=SKETCH_MIN_VALUE, max_value=SKETCH_MAX_VALUE):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.min_index = int(np.ceil(np.log(min_value) / self.log_gamma))
+        self.min_value = min_value
+        self.n_buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.min_index + 2
+
+    def buckets(self, values):
+        """
+        Returns the bucket of each value (an int64 array, values must not be NaN).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        positive = values > self.min_value
+        indexes = np.ceil(np.log(np.where(positive, values, 1.0)) / self.log_gamma).astype(np.int64)
+        return np.where(positive, np.clip(indexes - self.min_index + 1, 1, self.n_buckets - 1), 0)
+
+    def bucket_values(self, buckets):
+        """
+        Returns the value a bucket stands for, 0 for bucket 0.
+        """
+        indexes = np.asarray(buckets, dtype=np.int64) + self.min_index - 1
+        return np.where(np.asarray(buckets) > 0, 2 * self.gamma ** indexes / (self.gamma + 1), 0.0)
+
+    def quantiles(self, groups, buckets, counts, n_groups, percentiles):
+        """
+        Estimates quantiles per group from bucket counts, in one vectorized pass.
+        
+        Parameters:
+        groups (np.ndarray): The group (0 to n_groups - 1) of each bucket count.
+        buckets (np.ndarray): The bucket of each count, in any order. A group can have several counts of the same bucket.
+        counts (np.ndarray): The counts.
+        n_groups (int): The number of groups.
+        percentiles (tuple): The quantiles to estimate, between 0 and 1.
+        
+        Returns:
+        np.ndarray: An (n_groups, len(percentiles)) array, NaN for groups without values.
+        """
+        result = np.full((n_groups, len(percentiles)), np.nan)
+        block = max(SKETCH_DENSE_CELLS // self.n_buckets, 1)
+        for first in range(0, n_groups, block):
+            # Counts per (group, bucket) of a block of groups, summed with one bincount instead of a sort
+            rows = slice(None) if n_groups <= block else (groups >= first) & (groups < first + block)
+            n_block = min(block, n_groups - first)
+            cells = (groups[rows] - first) * self.n_buckets + buckets[rows]
+            cumulative = np.bincount(cells, weights=counts[rows], minlength=n_block * self.n_buckets)
+            cumulative = cumulative.reshape(n_block, self.n_buckets).cumsum(axis=1)
+            totals = cumulative[:, -1]
+            for i, percentile in enumerate(percentiles):
+                # The value of rank floor(q * (n - 1)) is in the first bucket whose cumulative count exceeds it
+                ranks = np.floor(percentile * (totals - 1))
+                found = (cumulative > ranks[:, None]).argmax(axis=1)
+                result[first:first + n_block, i] = np.where(totals > 0, self.bucket_values(found), np.nan)
+        return result
+
+
+class KpiCube:
+    """
+    Precomputed cost and length of stay KPIs of the encounters, for any filter on PAYER,
+    ORGANIZATION, ENCOUNTERCLASS and MONTH (of START) and any grouping by one of them.
+    
+    Every dimension is coded as integers once. For each of the 16 subsets of dimensions, a rollup
+    holds per combination of codes the number of encounters, the sum and count of each measure
+    and a quantile sketch of each measure. Rollups are built from the finest one by summing, and
+    a query only looks up the rollup cells of the selected values, so its cost does not depend on
+    the number of encounters. Totals and averages are exact; percentiles come from the sketches.
+    
+    Measures are BASE_ENCOUNTER_COST, TOTAL_CLAIM_COST, PAYER_COVERAGE and LENGTH_OF_STAY (STOP - START, in hours).
+    
+    Parameters:
+    encounters (pd.DataFrame): The encounters table.
+    relative_accuracy (float): The relative error bound of the percentiles.
+    """
+
+    def __init__(self, encounters, relative_accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.sketch = QuantileSketch(relative_accuracy)
+        starts = pd.to_datetime(encounters['START'])
+        columns = {
+            'PAYER': encounters['PAYER'],
+            'ORGANIZATION': encounters['ORGANIZATION'],
+            'ENCOUNTERCLASS': encounters['ENCOUNTERCLASS'],
+            'MONTH': pd.Series(_months(starts)),
+        }
+        codes = {}
+        self.values = {}
+        for dimension in KPI_DIMENSIONS:
+            dimension_codes, values = pd.factorize(columns[dimension], use_na_sentinel=False)
+            codes[dimension] = dimension_codes.astype(np.int64)
+            self.values[dimension] = pd.Index(values)
+        self.radix = {dimension: max(len(values), 1) for dimension, values in self.values.items()}
+
+        measures = {column: pd.to_numeric(encounters[column], errors='coerce').to_numpy(dtype=np.float64)
+                    for column in COST_COLUMNS}
+        stays = pd.to_datetime(encounters['STOP']) - starts
+        measures['LENGTH_OF_STAY'] = (stays / pd.Timedelta(hours=1)).to_numpy(dtype=np.float64, na_value=np.nan)
+
+        # The finest rollup, from the rows
+        dimensions = tuple(KPI_DIMENSIONS)
+        keys = self._encode(dimensions, codes)
+        rows = {'ENCOUNTERS': np.ones(len(keys), dtype=np.int64)}
+        sketches = {}
+        for measure, values in measures.items():
+            valid = ~np.isnan(values)
+            rows[f'{measure}_SUM'] = np.where(valid, values, 0.0)
+            rows[f'{measure}_COUNT'] = valid.astype(np.int64)
+            cells, counts = np.unique(keys[valid] * self.sketch.n_buckets + self.sketch.buckets(values[valid]),
+                                      return_counts=True)
+            sketches[measure] = (cells, counts)
+        totals = pd.DataFrame(rows).groupby(keys).sum()
+        self.rollups = {dimensions: (totals, sketches)}
+
+        # Coarser rollups, each from its smallest finer rollup
+        for size in range(len(KPI_DIMENSIONS) - 1, -1, -1):
+            for dimensions in self._subsets(size):
+                parents = [parent for parent in self.rollups if len(parent) == size + 1 and set(dimensions) <= set(parent)]
+                parent = min(parents, key=lambda parent: len(self.rollups[parent][0]))
+                self.rollups[dimensions] = self._roll_up(parent, dimensions)
+
+    def _subsets(self, size):
+        """
+        Returns the subsets of KPI_DIMENSIONS of a size, each in KPI_DIMENSIONS order.
+        """
+        subsets = [()]
+        for dimension in KPI_DIMENSIONS:
+            subsets += [subset + (dimension,) for subset in subsets if len(subset) < size]
+        return [subset for subset in subsets if len(subset) == size]
+
+    def _encode(self, dimensions, codes):
+        keys = np.zeros(len(next(iter(codes.values()))) if codes else 1, dtype=np.int64)
+        for dimension in dimensions:
+            keys = keys * self.radix[dimension] + codes[dimension]
+        return keys
+
+    def _decode(self, dimensions, keys):
+        codes = {}
+        for dimension in reversed(dimensions):
+            keys, codes[dimension] = np.divmod(keys, self.radix[dimension])
+        return codes
+
+    def _roll_up(self, parent, dimensions):
+        totals, sketches = self.rollups[parent]
+        n_keys = int(np.prod([self.radix[dimension] for dimension in dimensions]))
+        keys = self._encode(dimensions, self._decode(parent, totals.index.to_numpy()))
+        present, sums = _sum_by_key(keys, {column: totals[column].to_numpy() for column in totals.columns}, n_keys)
+        rolled_totals = pd.DataFrame(sums, index=present)
+        rolled_sketches = {}
+        for measure, (cells, counts) in sketches.items():
+            parent_keys, buckets = np.divmod(cells, self.sketch.n_buckets)
+            keys = self._encode(dimensions, self._decode(parent, parent_keys))
+            present, sums = _sum_by_key(keys * self.sketch.n_buckets + buckets, {'count': counts}, n_keys * self.sketch.n_buckets)
+            rolled_sketches[measure] = (present, sums['count'])
+        return rolled_totals, rolled_sketches
+
+    def _codes(self, dimension, values):
+        """
+        Returns the codes of the given values of a dimension, unknown values are left out.
+        """
+        if np.ndim(values) == 0:
+            values = [values]
+        codes = self.values[dimension].get_indexer(values)
+        return np.unique(codes[codes >= 0])
+
+    def breakdown(self, dimension=None, filters=None, percentiles=KPI_PERCENTILES):
+        """
+        Computes the KPIs of the encounters matching the filters, per value of a dimension.
+        
+        Parameters:
+        dimension (str, optional): The dimension to group by (one of KPI_DIMENSIONS). None gives one row for all.
+        filters (dict, optional): Dimension -> value or list of values. Dimensions not given are not filtered.
+        percentiles (tuple): The percentiles to estimate, between 0 and 1.
+        
+        Returns:
+        pd.DataFrame: One row per value with encounters (the values without any are left out) and, per
+            measure, the _TOTAL, _AVERAGE and _P<percentile> columns.
+        """
+        filters = filters or {}
+        dimensions = tuple(name for name in KPI_DIMENSIONS if name in filters or name == dimension)
+        selected = {name: self._codes(name, filters[name]) if name in filters else np.arange(len(self.values[name]))
+                    for name in dimensions}
+        totals, sketches = self.rollups[dimensions]
+
+        # Every combination of the selected codes is one rollup cell, grouped by the code of the dimension
+        grids = np.meshgrid(*[selected[name] for name in dimensions], indexing='ij') if dimensions else []
+        codes = {name: grid.ravel() for name, grid in zip(dimensions, grids)}
+        keys = self._encode(dimensions, codes)
+        if dimension is None:
+            group_values = pd.Index(['All'])
+            groups = np.zeros(len(keys), dtype=np.int64)
+        else:
+            group_values = self.values[dimension][selected[dimension]]
+            groups = np.searchsorted(selected[dimension], codes[dimension])
+        n_groups = len(group_values)
+
+        cells = totals.reindex(keys, fill_value=0)
+        sums = {column: np.bincount(groups, weights=cells[column].to_numpy(), minlength=n_groups) for column in cells.columns}
+        result = pd.DataFrame({'ENCOUNTERS': sums['ENCOUNTERS'].astype(np.int64)}, index=group_values)
+        labels = [f'P{percentile * 100:g}' for percentile in percentiles]
+        for measure, (measure_cells, counts) in sketches.items():
+            count = sums[f'{measure}_COUNT']
+            result[f'{measure}_TOTAL'] = sums[f'{measure}_SUM']
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[f'{measure}_AVERAGE'] = np.where(count > 0, sums[f'{measure}_SUM'] / count, np.nan)
+
+            # The sketch counts of a cell are one contiguous slice of the sorted cell ids
+            starts = np.searchsorted(measure_cells, keys * self.sketch.n_buckets, side='left')
+            stops = np.searchsorted(measure_cells, (keys + 1) * self.sketch.n_buckets, side='left')
+            lengths = stops - starts
+            positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+            estimates = self.sketch.quantiles(np.repeat(groups, lengths), measure_cells[positions] % self.sketch.n_buckets,
+                                              counts[positions], n_groups, percentiles)
+            for i, label in enumerate(labels):
+                result[f'{measure}_{label}'] = estimates[:, i]
+        result.index.name = dimension
+        return result[result['ENCOUNTERS'] > 0]
+
+    def kpis(self, filters=None, percentiles=KPI_PERCENTILES):
+        """
+        Returns the KPIs of the encounters matching the filters, as a table with one row per measure.
+        
+        Parameters:
+        filters (dict, optional): Dimension -> value or list of values.
+        percentiles (tuple): The percentiles to estimate, between 0 and 1.
+        
+        Returns:
+        tuple: The number of encounters (int) and a pd.DataFrame indexed by measure with TOTAL, AVERAGE and P<percentile>.
+        """
+        row = self.breakdown(None, filters, percentiles)
+        stats = ['TOTAL', 'AVERAGE'] + [f'P{percentile * 100:g}' for percentile in percentiles]
+        table = pd.DataFrame([[row[f'{measure}_{stat}'].iloc[0] if not row.empty else np.nan for stat in stats]
+                              for measure in KPI_MEASURES], index=KPI_MEASURES, columns=stats)
+        return int(row['ENCOUNTERS'].sum()), table
@@ -1,25 +1,257 @@
+import os
+import json
+import math
+import tempfile
+import numpy as np
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-
-# Function to load data
+import data_processing as dp
+from data_index import TableIndexes, PatientDirectory, FilterEngine
+from aggregates import AggregateCube, KpiCube, KPI_DIMENSIONS, KPI_MEASURES
+from sql_store import SqlStore
+from reports import ReportService, render_report, report_values
+from spatial_index import FacilityIndex
+from instrumentation import instrument, TRACER
+
+# Set APP_COMPACT_TABLES=1 to keep the tables with integer keys and categoricals
+COMPACT_TABLES = os.environ.get('APP_COMPACT_TABLES', '0') == '1'
+# Set APP_SQL_STORE to a database built by sql_store.py to query it instead of loading the tables
+SQL_STORE = os.environ.get('APP_SQL_STORE')
+
+# Set APP_REPORT_CACHE to a directory to keep rendered reports on disk across restarts
+REPORT_CACHE_DIR = os.environ.get('APP_REPORT_CACHE')
+REPORT_EXPORT_PATH = 'patient_reports.csv'
+
+MAP_CELL_SIZES_KM = [1, 2, 5, 10, 25, 50]
+MAP_RADIUS_KM = 10
+
+PAGE_SIZES = [25, 50, 100, 500]
+EXPORT_CHUNK_ROWS = 100_000
+
+# Function to load data (the Parquet version of a table is used when it exists)
 @st.cache_data
 def load_data():
-    encounters = pd.read_csv('encounters_cleaned.csv')
-    payers = pd.read_csv('payers_cleaned.csv')
-    organizations = pd.read_csv('organizations_cleaned.csv')
-    patients = pd.read_csv('patients_cleaned.csv')
-    procedures = pd.read_csv('procedures_cleaned.csv')
+    encounters = dp.load_cleaned_table('encounters_cleaned.csv')
+    payers = dp.load_cleaned_table('payers_cleaned.csv')
+    organizations = dp.load_cleaned_table('organizations_cleaned.csv')
+    patients = dp.load_cleaned_table('patients_cleaned.csv')
+    procedures = dp.load_cleaned_table('procedures_cleaned.csv')
     return encounters, payers, organizations, patients, procedures
 
-# Function to display visualizations for a selected patient
-def patient_visualizations(patient_id, encounters, payers, organizations, patients, procedures):
-    st.title(f"Visualizations for Patient ID: {patient_id}")
+# Function to load compact data: integer surrogate keys, categoricals and a memory report
+@st.cache_data
+def load_compact_data():
+    encounters, payers, organizations, patients, procedures = load_data()
+    tables, keys, memory = dp.compact_tables({
+        'encounters': encounters, 'payers': payers, 'organizations': organizations,
+        'patients': patients, 'procedures': procedures,
+    })
+    return (tables['encounters'], tables['payers'], tables['organizations'], tables['patients'],
+            tables['procedures'], keys, memory)
+
+# Function to build the row indexes once per process, shared by all sessions
+@st.cache_resource
+def load_indexes(compact=False):
+    if compact:
+        encounters, payers, organizations, patients, procedures = load_compact_data()[:5]
+    else:
+        encounters, payers, organizations, patients, procedures = load_data()
+    return TableIndexes({
+        'encounters': encounters, 'payers': payers, 'organizations': organizations,
+        'patients': patients, 'procedures': procedures,
+    })
+
+# Function to build the patient directory (labels and name search) once per process
+@st.cache_resource
+def load_directory(compact=False):
+    if compact:
+        data = load_compact_data()
+        patients, keys = data[3], data[5]
+        return PatientDirectory(patients, keys.decode('patient', patients['Id'].to_numpy()))
+    patients = load_data()[3]
+    return PatientDirectory(patients)
+
+# Function to build the aggregates behind the Visualizations page once per process
+@st.cache_resource
+def load_cube(compact=False):
+    if compact:
+        encounters, payers, organizations, patients, procedures = load_compact_data()[:5]
+    else:
+        encounters, payers, organizations, patients, procedures = load_data()
+    return AggregateCube(patients, encounters, procedures)
+
+# Function to build the KPI rollups of the encounters once per process
+@st.cache_resource
+def load_kpis(compact=False):
+    if compact:
+        encounters, payers, organizations, patients, procedures = load_compact_data()[:5]
+    else:
+        encounters, payers, organizations, patients, procedures = load_data()
+    return KpiCube(encounters), dict(zip(payers['Id'], payers['NAME'])), dict(zip(organizations['Id'], organizations['NAME']))
+
+# Function to build the report service once per process, its report caches are shared by all sessions
+@st.cache_resource
+def load_reports(compact=False):
+    if compact:
+        encounters, payers, organizations, patients, procedures = load_compact_data()[:5]
+    else:
+        encounters, payers, organizations, patients, procedures = load_data()
+    return ReportService.from_tables(patients, encounters, procedures, cache_dir=REPORT_CACHE_DIR)
+
+# Function to build the spatial indexes of the patients and organizations once per process
+@st.cache_resource
+def load_spatial(compact=False):
+    if compact:
+        encounters, payers, organizations, patients, procedures = load_compact_data()[:5]
+    else:
+        encounters, payers, organizations, patients, procedures = load_data()
+    return FacilityIndex(patients, organizations)
+
+# Function to open the SQL store once per process, its connections are shared by all sessions
+@st.cache_resource
+def load_store(db_path):
+    return SqlStore(db_path)
+
+# Function to build the patient directory from the SQL store once per process
+@st.cache_resource
+def load_store_directory(db_path):
+    return PatientDirectory(load_store(db_path).table('patients', ['Id', 'FIRST', 'LAST']))
+
+# Function to build the report service from the SQL store once per process
+@st.cache_resource
+def load_store_reports(db_path):
+    return ReportService.from_store(load_store(db_path), cache_dir=REPORT_CACHE_DIR)
+
+# Function to build the KPI rollups from the SQL store once per process, only the rollups are kept
+@st.cache_resource
+def load_store_kpis(db_path):
+    store = load_store(db_path)
+    encounters = store.table('encounters', KPI_DIMENSIONS[:-1] + ['START', 'STOP'] + KPI_MEASURES[:-1])
+    payers = store.table('payers', ['Id', 'NAME'])
+    organizations = store.table('organizations', ['Id', 'NAME'])
+    return KpiCube(encounters), dict(zip(payers['Id'], payers['NAME'])), dict(zip(organizations['Id'], organizations['NAME']))
+
+# Function to build the spatial indexes from the coordinates in the SQL store once per process
+@st.cache_resource
+def load_store_spatial(db_path):
+    store = load_store(db_path)
+    organization_columns = [column for column in ['Id', 'NAME', 'CITY', 'LAT', 'LON'] if column in store.columns('organizations')]
+    return FacilityIndex(store.table('patients', ['Id', 'LAT', 'LON']), store.table('organizations', organization_columns))
+
+# Function to pick a patient in the sidebar through the directory search
+def select_patient(directory, allow_all=False):
+    query = st.sidebar.text_input("Search Patient", help="Start of the name, or any part of it")
+    options = directory.search(query)
+    if allow_all:
+        options = ["All"] + options
+    return st.sidebar.selectbox("Select Patient", options,
+                                format_func=lambda patient_id: patient_id if patient_id == "All" else directory.label(patient_id))
+
+# Function to get the patient row, encounters and procedures of one patient
+def patient_slices(patient_id, encounters, patients, procedures, indexes=None):
+    if indexes is not None:
+        return indexes.patient_slices(patient_id)
+    return (patients[patients['Id'] == patient_id],
+            encounters[encounters['PATIENT'] == patient_id],
+            procedures[procedures['PATIENT'] == patient_id])
+
+# Function to show a table with its original keys when the data is compact
+def display_table(df, table_name, keys=None):
+    if keys is not None:
+        df = keys.decode_frame(df, table_name)
+    st.write(df)
+
+# Function to order row positions by a column, sorting only the rows being shown
+def sort_positions(df, rows, column, ascending=True):
+    values = df[column] if rows is None else df[column].iloc[rows]
+    order = values.reset_index(drop=True).sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+    return order if rows is None else rows[order]
+
+# Function to write the selected rows to a CSV file chunk by chunk, for the download button
+def export_csv(df, rows, columns, table_name, keys=None):
+    n_rows = len(df) if rows is None else len(rows)
+    export = tempfile.TemporaryFile(mode='w+b')
+    for start in range(0, max(n_rows, 1), EXPORT_CHUNK_ROWS):
+        chunk_rows = np.arange(start, min(start + EXPORT_CHUNK_ROWS, n_rows)) if rows is None else rows[start:start + EXPORT_CHUNK_ROWS]
+        chunk = df.iloc[chunk_rows][columns]
+        if keys is not None:
+            chunk = keys.decode_frame(chunk, table_name)
+        export.write(chunk.to_csv(index=False, header=start == 0).encode('utf-8'))
+    export.seek(0)
+    return export
+
+# Function to show the column, sort and page controls of a table
+def table_controls(table_name, all_columns, total):
+    columns = st.multiselect("Columns", all_columns, default=all_columns, key=f"{table_name}_columns")
+    sort_col, order_col, size_col, page_col = st.columns(4)
+    sort_column = sort_col.selectbox("Sort by", ["(none)"] + all_columns, key=f"{table_name}_sort")
+    ascending = order_col.checkbox("Ascending", value=True, key=f"{table_name}_ascending")
+    page_size = size_col.selectbox("Rows per page", PAGE_SIZES, key=f"{table_name}_page_size")
+    n_pages = max(1, math.ceil(total / page_size))
+    page = page_col.number_input("Page", min_value=1, max_value=n_pages, value=1, key=f"{table_name}_page")
+    return columns, None if sort_column == "(none)" else sort_column, ascending, page, page_size
+
+# Function to show one page of a table, only that page is sent to the browser
+def paginated_table(df, table_name, rows=None, keys=None):
+    total = len(df) if rows is None else len(rows)
+    st.caption(f"{total:,} rows")
+    if total == 0:
+        return
+
+    columns, sort_column, ascending, page, page_size = table_controls(table_name, list(df.columns), total)
+    if sort_column is not None:
+        rows = sort_positions(df, rows, sort_column, ascending)
+    start = (page - 1) * page_size
+    page_rows = np.arange(start, min(start + page_size, total)) if rows is None else rows[start:start + page_size]
+    display_table(df.iloc[page_rows][columns], table_name, keys)
+
+    st.download_button(f"Download all {total:,} rows as CSV", data=lambda: export_csv(df, rows, columns, table_name, keys),
+                       file_name=f"{table_name}.csv", mime="text/csv", key=f"{table_name}_download")
+
+# Function to write the rows of a store query to a CSV file chunk by chunk, for the download button
+def export_store_csv(store, table_name, where, columns, sort_column, ascending):
+    export = tempfile.TemporaryFile(mode='w+b')
+    for i, chunk in enumerate(store.iter_rows(table_name, where, columns, sort_column, ascending, chunksize=EXPORT_CHUNK_ROWS)):
+        export.write(chunk.to_csv(index=False, header=i == 0).encode('utf-8'))
+    export.seek(0)
+    return export
+
+# Function to show one page of a store table, the count, sort and page window run in SQL
+def store_table(store, table_name, where=None):
+    total = store.count(table_name, where)
+    st.caption(f"{total:,} rows")
+    if total == 0:
+        return
+
+    columns, sort_column, ascending, page, page_size = table_controls(table_name, store.columns(table_name), total)
+    st.write(store.page(table_name, where, columns, sort_column, ascending, limit=page_size, offset=(page - 1) * page_size))
+
+    st.download_button(f"Download all {total:,} rows as CSV",
+                       data=lambda: export_store_csv(store, table_name, where, columns, sort_column, ascending),
+                       file_name=f"{table_name}.csv", mime="text/csv", key=f"{table_name}_download")
+
+# Function to label a key in a selectbox when the data is compact
+def key_label(keys, domain):
+    def label(value):
+        if keys is None or value == "All":
+            return str(value)
+        return str(keys.decode(domain, [value])[0])
+    return label
 
-    # Filter data for the selected patient
-    patient_data = patients[patients['Id'] == patient_id]
-    patient_encounters = encounters[encounters['PATIENT'] == patient_id]
-    patient_procedures = procedures[procedures['PATIENT'] == patient_id]
+# Function to display visualizations for a selected patient
+@instrument(category='page')
+def patient_visualizations(patient_id, encounters, payers, organizations, patients, procedures, keys=None, indexes=None, cube=None):
+    st.title(f"Visualizations for Patient ID: {key_label(keys, 'patient')(patient_id)}")
+
+    # Filter data for the selected patient, the charts come from the precomputed aggregates
+    if cube is None:
+        patient_data, patient_encounters, patient_procedures = patient_slices(patient_id, encounters, patients, procedures, indexes)
+        cube = AggregateCube(patients, patient_encounters, patient_procedures)
+    elif indexes is not None:
+        patient_data = indexes.rows('patients', 'Id', patient_id)
+    else:
+        patient_data = patients[patients['Id'] == patient_id]
 
     # Display personal information
     st.subheader("Personal Information")
@@ -27,192 +259,345 @@ def patient_visualizations(patient_id, encounters, payers, organizations, patien
 
     # Chart: Number of Encounters Over Time
     st.subheader("Number of Encounters Over Time")
-    if not patient_encounters.empty:
-        patient_encounters['START'] = pd.to_datetime(patient_encounters['START'])
-        encounters_over_time = patient_encounters.groupby(patient_encounters['START'].dt.to_period('M')).size().reset_index(name='count')
-        encounters_over_time['START'] = encounters_over_time['START'].astype(str)  # Convert Period to string
+    encounters_over_time = cube.patient_monthly_encounters(patient_id)
+    if not encounters_over_time.empty:
         fig = px.line(encounters_over_time, x='START', y='count', title='Number of Encounters Over Time')
         st.plotly_chart(fig)
 
     # Chart: Distribution of Encounter Classes
     st.subheader("Distribution of Encounter Classes")
-    if not patient_encounters.empty:
-        encounter_class_dist = patient_encounters['ENCOUNTERCLASS'].value_counts().reset_index()
-        encounter_class_dist.columns = ['Encounter Class', 'Count']
+    encounter_class_dist = cube.patient_encounter_classes(patient_id)
+    if not encounter_class_dist.empty:
         fig = px.bar(encounter_class_dist, x='Encounter Class', y='Count', title='Distribution of Encounter Classes')
         st.plotly_chart(fig)
 
     # Chart: Number of Procedures by Type
     st.subheader("Number of Procedures by Type")
-    if not patient_procedures.empty:
-        procedure_type_dist = patient_procedures['DESCRIPTION'].value_counts().reset_index()
-        procedure_type_dist.columns = ['Procedure Type', 'Count']
+    procedure_type_dist = cube.patient_procedure_types(patient_id)
+    if not procedure_type_dist.empty:
         fig = px.bar(procedure_type_dist, x='Procedure Type', y='Count', title='Number of Procedures by Type')
         st.plotly_chart(fig)
 
+    # Encounter cost totals
+    patient_costs = cube.patient_costs(patient_id)
+    if not patient_costs.empty:
+        st.subheader("Encounter Costs")
+        st.write(patient_costs)
+
     # Patient Demographics
     st.subheader("Patient Demographics")
-    if not patients.empty:
-        patient_gender_dist = patients['GENDER'].value_counts().reset_index()
-        patient_gender_dist.columns = ['Gender', 'Count']
-        fig = px.pie(patient_gender_dist, names='Gender', values='Count', title='Patient Gender Distribution')
+    gender_distribution = cube.gender_distribution()
+    if not gender_distribution.empty:
+        fig = px.pie(gender_distribution, names='Gender', values='Count', title='Patient Gender Distribution')
         st.plotly_chart(fig)
 
-        patient_race_dist = patients['RACE'].value_counts().reset_index()
-        patient_race_dist.columns = ['Race', 'Count']
-        fig = px.pie(patient_race_dist, names='Race', values='Count', title='Patient Race Distribution')
+        fig = px.pie(cube.race_distribution(), names='Race', values='Count', title='Patient Race Distribution')
         st.plotly_chart(fig)
 
 # Function to generate a report for the selected patient
-def patient_report(patient_id, encounters, patients, procedures):
-    report_text = ""
-
+@instrument(category='page')
+def patient_report(patient_id, encounters, patients, procedures, indexes=None):
     # Filter data for the selected patient
-    patient_data = patients[patients['Id'] == patient_id]
-    patient_encounters = encounters[encounters['PATIENT'] == patient_id]
-    patient_procedures = procedures[procedures['PATIENT'] == patient_id]
-
-    # Generate report content
-    if not patient_data.empty:
-        report_text += f"**Personal Information**:\n\n"
-        report_text += f"Name: {patient_data['FIRST'].values[0]} {patient_data['LAST'].values[0]}\n\n"
-        report_text += f"Gender: {patient_data['GENDER'].values[0]}\n\n"
-        report_text += f"Date of Birth: {patient_data['BIRTHDATE'].values[0]}\n\n"
-        report_text += f"Race: {patient_data['RACE'].values[0]}\n\n"
-        report_text += f"Ethnicity: {patient_data['ETHNICITY'].values[0]}\n\n"
-        report_text += f"Marital Status: {patient_data['MARITAL'].values[0]}\n\n"
-        report_text += f"Address: {patient_data['ADDRESS'].values[0]}, {patient_data['CITY'].values[0]}, {patient_data['STATE'].values[0]} {patient_data['ZIP'].values[0]}\n\n"
-
-    if not patient_encounters.empty:
-        report_text += f"**Encounters**:\n"
-        report_text += f"Total Encounters: {len(patient_encounters)}\n\n"
-
-    if not patient_procedures.empty:
-        report_text += f"**Procedures**:\n"
-        report_text += f"Total Procedures: {len(patient_procedures)}\n\n"
-
-    return report_text
+    patient_data, patient_encounters, patient_procedures = patient_slices(patient_id, encounters, patients, procedures, indexes)
+
+    patient = None if patient_data.empty else {column: values[0] for column, values in report_values(patient_data).items()}
+    return render_report(patient, len(patient_encounters), len(patient_procedures))
+
+# Function to display the report of the selected patient from the report service, and the bulk export
+@instrument(category='page')
+def report_page(directory, reports):
+    st.sidebar.header("Generate Patient Report")
+    patient_id = select_patient(directory)
+
+    if patient_id is not None:
+        st.subheader(f"Patient Report for {directory.label(patient_id)}")
+        st.write(reports.get(patient_id))
+
+    # The export runs in a background thread, the page only shows its progress
+    st.sidebar.header("Export All Reports")
+    export = reports.export
+    if st.sidebar.button("Export all reports", disabled=export is not None and export.running):
+        export = reports.start_export(REPORT_EXPORT_PATH)
+    if export is None:
+        return
+    if export.running:
+        st.sidebar.progress(export.progress, text=f"{export.written} of {export.total} reports written")
+        st.sidebar.button("Refresh export status")
+    elif export.error is not None:
+        st.sidebar.error(f"The export failed: {export.error}")
+    elif export.done:
+        with open(export.file_path, 'rb') as f:
+            st.sidebar.download_button("Download all reports", f, file_name=os.path.basename(export.file_path), mime="text/csv")
 
 # Function to display patient information
-def patient_info_page(encounters, payers, organizations, patients, procedures):
+@instrument(category='page')
+def patient_info_page(encounters, payers, organizations, patients, procedures, keys=None, indexes=None, directory=None, store=None):
     st.title("Patient Health Information")
 
     # Sidebar for filtering
     st.sidebar.header("Filters")
+    if indexes is None and store is None:
+        indexes = TableIndexes({'encounters': encounters, 'payers': payers, 'organizations': organizations,
+                                'patients': patients, 'procedures': procedures})
 
-    # Patient name filter
-    patient_list = patients['FIRST'] + " " + patients['LAST']
-    selected_patient_name = st.sidebar.selectbox("Select Patient", ["All"] + list(patient_list))
+    # Distinct values of a column, in order of appearance, read from its index or the store
+    def options(table, column):
+        if store is not None:
+            return ["All"] + store.distinct(table, column)
+        return ["All"] + indexes.indexes[(table, column)].keys.tolist()
 
-    # Get the patient ID based on the selected patient name
-    if selected_patient_name != "All":
-        patient_id = patients[patient_list == selected_patient_name]['Id'].values[0]
-    else:
-        patient_id = "All"
+    # Patient name filter
+    if directory is None:
+        directory = PatientDirectory(patients)
+    patient_id = select_patient(directory, allow_all=True)
 
     # Encounter class filter
-    encounter_class = st.sidebar.selectbox("Select Encounter Class", ["All"] + list(encounters['ENCOUNTERCLASS'].unique()))
+    encounter_class = st.sidebar.selectbox("Select Encounter Class", options('encounters', 'ENCOUNTERCLASS'))
 
     # Procedure code filter
-    procedure_code = st.sidebar.selectbox("Select Procedure Code", ["All"] + list(procedures['CODE'].unique()))
+    procedure_code = st.sidebar.selectbox("Select Procedure Code", options('procedures', 'CODE'))
 
     # Payer filter
-    payer_id = st.sidebar.selectbox("Select Payer ID", ["All"] + list(payers['Id'].unique()))
+    payer_id = st.sidebar.selectbox("Select Payer ID", options('payers', 'Id'), format_func=key_label(keys, 'payer'))
 
     # Payer name filter
-    payer_name = st.sidebar.selectbox("Select Payer Name", ["All"] + list(payers['NAME'].unique()))
+    payer_name = st.sidebar.selectbox("Select Payer Name", options('payers', 'NAME'))
 
     # Organization filter
-    organization_id = st.sidebar.selectbox("Select Organization ID", ["All"] + list(organizations['Id'].unique()))
+    organization_id = st.sidebar.selectbox("Select Organization ID", options('organizations', 'Id'), format_func=key_label(keys, 'organization'))
 
     # City filter
-    city = st.sidebar.selectbox("Select City", ["All"] + list(patients['CITY'].unique()))
+    city = st.sidebar.selectbox("Select City", options('patients', 'CITY'))
 
     # State filter
-    state = st.sidebar.selectbox("Select State", ["All"] + list(patients['STATE'].unique()))
+    state = st.sidebar.selectbox("Select State", options('patients', 'STATE'))
 
     # Race filter
-    race = st.sidebar.selectbox("Select Race", ["All"] + list(patients['RACE'].unique()))
-
-    # Filter data for the selected patient
-    if patient_id != "All":
-        patient_data = patients[patients['Id'] == patient_id]
-    else:
-        patient_data = patients
-
-    patient_encounters = encounters[encounters['PATIENT'] == patient_id] if patient_id != "All" else encounters
-    patient_procedures = procedures[procedures['PATIENT'] == patient_id] if patient_id != "All" else procedures
-
-    # Apply additional filters
-    if encounter_class != "All":
-        patient_encounters = patient_encounters[patient_encounters['ENCOUNTERCLASS'] == encounter_class]
-
-    if procedure_code != "All":
-        patient_procedures = patient_procedures[patient_procedures['CODE'] == procedure_code]
-
-    if payer_id != "All":
-        patient_encounters = patient_encounters[patient_encounters['PAYER'] == payer_id]
-
-    if payer_name != "All":
-        patient_encounters = patient_encounters[patient_encounters['PAYER'].isin(payers[payers['NAME'] == payer_name]['Id'])]
-
-    if organization_id != "All":
-        patient_encounters = patient_encounters[patient_encounters['ORGANIZATION'] == organization_id]
-
-    if city != "All":
-        patient_data = patient_data[patient_data['CITY'] == city]
-
-    if state != "All":
-        patient_data = patient_data[patient_data['STATE'] == state]
-
-    if race != "All":
-        patient_data = patient_data[patient_data['RACE'] == race]
+    race = st.sidebar.selectbox("Select Race", options('patients', 'RACE'))
+
+    # Filter the tables: patient filters also restrict encounters and procedures,
+    # encounter filters also restrict procedures
+    selection = {
+        'patients': {'Id': patient_id, 'CITY': city, 'STATE': state, 'RACE': race},
+        'encounters': {'ENCOUNTERCLASS': encounter_class, 'PAYER': payer_id, 'ORGANIZATION': organization_id},
+        'procedures': {'CODE': procedure_code},
+        'payers': {'NAME': payer_name},
+    }
+    predicates = {
+        table: {column: value for column, value in columns.items() if value != "All"}
+        for table, columns in selection.items()
+    }
+    if store is not None:
+        where = store.where(predicates)
+
+        st.subheader("Patient Information")
+        store_table(store, 'patients', where['patients'])
+        st.subheader("Encounters")
+        store_table(store, 'encounters', where['encounters'])
+        st.subheader("Procedures")
+        store_table(store, 'procedures', where['procedures'])
+        return
+
+    positions = FilterEngine(indexes).run(predicates)
 
     # Display patient information
     st.subheader("Patient Information")
-    st.write(patient_data)
+    paginated_table(patients, 'patients', positions['patients'], keys)
 
     # Display encounters
     st.subheader("Encounters")
-    st.write(patient_encounters)
+    paginated_table(encounters, 'encounters', positions['encounters'], keys)
 
     # Display procedures
     st.subheader("Procedures")
-    st.write(patient_procedures)
+    paginated_table(procedures, 'procedures', positions['procedures'], keys)
+
+# Function to display the cost and length of stay KPIs of the encounters matching the filters, from the rollups
+@instrument(category='page')
+def kpi_page(kpis, payer_names, organization_names):
+    st.title("Encounter KPIs")
+    names = {'PAYER': payer_names, 'ORGANIZATION': organization_names}
+    titles = {'PAYER': "Payer", 'ORGANIZATION': "Organization", 'ENCOUNTERCLASS': "Encounter Class", 'MONTH': "Month"}
+
+    # Label of a dimension value: payer and organization names, months as YYYY-MM
+    def label(dimension):
+        def format_value(value):
+            if dimension == 'MONTH':
+                return "Unknown" if pd.isna(value) else pd.Timestamp(value).strftime('%Y-%m')
+            return str(names.get(dimension, {}).get(value, value))
+        return format_value
+
+    # Sidebar filters, an empty selection keeps every value
+    st.sidebar.header("KPI Filters")
+    filters = {}
+    for dimension in ['PAYER', 'ORGANIZATION', 'ENCOUNTERCLASS']:
+        selected = st.sidebar.multiselect(titles[dimension], kpis.values[dimension].tolist(), format_func=label(dimension))
+        if selected:
+            filters[dimension] = selected
+    months = kpis.values['MONTH'].dropna().sort_values()
+    if len(months) > 1:
+        first, last = st.sidebar.select_slider("Months", options=list(months), value=(months[0], months[-1]),
+                                               format_func=label('MONTH'))
+        if first != months[0] or last != months[-1]:
+            filters['MONTH'] = months[(months >= first) & (months <= last)]
+
+    # Headline figures, as on the Power BI dashboard
+    n_encounters, table = kpis.kpis(filters)
+    encounters_col, cost_col, stay_col = st.columns(3)
+    encounters_col.metric("Encounters", f"{n_encounters:,}")
+    cost_col.metric("Average Cost per Visit", f"{table.loc['TOTAL_CLAIM_COST', 'AVERAGE']:,.2f}")
+    stay_col.metric("Average Length of Stay (hours)", f"{table.loc['LENGTH_OF_STAY', 'AVERAGE']:,.1f}")
+    st.caption("Totals and averages are exact, percentiles are estimated within 1%.")
+    st.dataframe(table)
+
+    # KPIs per value of one dimension
+    dimension = st.selectbox("Group by", KPI_DIMENSIONS, format_func=titles.get)
+    breakdown = kpis.breakdown(dimension, filters)
+    breakdown.insert(0, titles[dimension], [label(dimension)(value) for value in breakdown.index])
+    if dimension == 'MONTH':
+        breakdown = breakdown.sort_index()
+    measure = st.selectbox("Measure", [f'{measure}_{stat}' for measure in KPI_MEASURES for stat in ['AVERAGE', 'TOTAL', 'P50', 'P90']])
+    if not breakdown.empty:
+        fig = px.bar(breakdown, x=titles[dimension], y=measure, title=f'{measure} per {titles[dimension]}')
+        st.plotly_chart(fig)
+    st.dataframe(breakdown.reset_index(drop=True))
+
+# Function to display patient density and the patients near an organization, from the spatial indexes
+@instrument(category='page')
+def map_page(spatial, directory, keys=None):
+    st.title("Patient Map")
+
+    # Patients are drawn as counts per grid cell, never one marker per patient
+    st.sidebar.header("Map")
+    cell_km = st.sidebar.select_slider("Cell size (km)", MAP_CELL_SIZES_KM, value=5)
+    density = spatial.density(cell_km)
+    st.caption(f"{int(density['COUNT'].sum()):,} patients in {len(density):,} cells of {cell_km} km")
+    if not density.empty:
+        fig = px.scatter_map(density, lat='LAT', lon='LON', size='COUNT', color='COUNT', zoom=6,
+                             title='Patients per Cell')
+        st.plotly_chart(fig)
+
+    # Patients within a radius of an organization
+    organizations = spatial.organization_rows
+    if organizations.empty:
+        return
+    names = dict(zip(organizations['Id'], organizations['NAME'] if 'NAME' in organizations.columns else organizations['Id']))
+    st.sidebar.header("Organization Catchment")
+    organization_id = st.sidebar.selectbox("Select Organization", list(names), format_func=lambda value: str(names[value]))
+    radius_km = st.sidebar.number_input("Radius (km)", min_value=1, max_value=500, value=MAP_RADIUS_KM)
+
+    nearby = spatial.patients_within(organization_id, radius_km)
+    nearby.insert(1, 'NAME', directory.labels[directory.positions.get_indexer(nearby['PATIENT'])] if len(nearby) else [])
+    if keys is not None:
+        nearby['PATIENT'] = keys.decode('patient', nearby['PATIENT'].to_numpy())
+    st.subheader(f"Patients within {radius_km} km of {names[organization_id]}")
+    paginated_table(nearby, 'nearby_patients')
+
+    # Patients per nearest organization
+    st.subheader("Patients per Nearest Organization")
+    catchments = spatial.catchments()
+    if keys is not None:
+        catchments['Id'] = keys.decode('organization', catchments['Id'].to_numpy())
+    paginated_table(catchments, 'catchments')
+
+# Function to list the pages, the Performance page only shows when instrumentation is on (APP_INSTRUMENT)
+def page_names():
+    pages = ["Patient Info", "Visualizations", "Patient Report", "KPIs", "Map"]
+    if TRACER.enabled:
+        pages.append("Performance")
+    return pages
+
+# Function to display the time, rows and memory recorded per function and page in this process
+def performance_page():
+    st.title("Performance")
+    summary = TRACER.summary()
+    if summary.empty:
+        st.write("No calls recorded yet.")
+        return
+
+    st.subheader("Per function and page")
+    st.dataframe(summary)
+
+    st.subheader("Latest calls")
+    st.dataframe(TRACER.to_frame().tail(200).iloc[::-1])
+
+    st.download_button("Download Chrome trace", data=lambda: json.dumps(TRACER.chrome_trace()),
+                       file_name="trace.json", mime="application/json")
+    if st.button("Clear"):
+        TRACER.clear()
+        st.rerun()
+
+# Function to run the pages on the SQL store, no table is loaded in the process
+def store_page(db_path):
+    store = load_store(db_path)
+    directory = load_store_directory(db_path)
+
+    # Sidebar for navigation
+    st.sidebar.header("Navigation")
+
+    # Buttons for changing pages
+    page = st.sidebar.radio("Go to", page_names())
+
+    if page == "Patient Info":
+        patient_info_page(None, None, None, None, None, directory=directory, store=store)
+    elif page == "Visualizations":
+        st.sidebar.header("Select Patient for Visualizations")
+        patient_id = select_patient(directory)
+
+        if patient_id is not None:
+            patient_visualizations(patient_id, None, None, None, None, None, indexes=store, cube=store)
+    elif page == "Patient Report":
+        report_page(directory, load_store_reports(db_path))
+    elif page == "KPIs":
+        kpi_page(*load_store_kpis(db_path))
+    elif page == "Map":
+        map_page(load_store_spatial(db_path), directory)
+    elif page == "Performance":
+        performance_page()
 
 # Main function to run the Streamlit app
 def main():
     st.title("Patient Health Information System")
 
+    # Query the SQL store instead of loading the tables
+    if SQL_STORE:
+        store_page(SQL_STORE)
+        return
+
     # Load data
-    encounters, payers, organizations, patients, procedures = load_data()
+    if COMPACT_TABLES:
+        encounters, payers, organizations, patients, procedures, keys, memory = load_compact_data()
+        with st.sidebar.expander("Memory usage (bytes)"):
+            st.write(memory)
+    else:
+        encounters, payers, organizations, patients, procedures = load_data()
+        keys = None
+    indexes = load_indexes(COMPACT_TABLES)
+    directory = load_directory(COMPACT_TABLES)
 
     # Sidebar for navigation
     st.sidebar.header("Navigation")
 
     # Buttons for changing pages
-    page = st.sidebar.radio("Go to", ["Patient Info", "Visualizations", "Patient Report"])
+    page = st.sidebar.radio("Go to", page_names())
 
     if page == "Patient Info":
-        patient_info_page(encounters, payers, organizations, patients, procedures)
+        patient_info_page(encounters, payers, organizations, patients, procedures, keys, indexes, directory)
     elif page == "Visualizations":
         st.sidebar.header("Select Patient for Visualizations")
-        patient_list = patients['FIRST'] + " " + patients['LAST']
-        selected_patient_name = st.sidebar.selectbox("Select Patient", patient_list)
+        patient_id = select_patient(directory)
 
-        if selected_patient_name:
-            patient_id = patients[patient_list == selected_patient_name]['Id'].values[0]
-            patient_visualizations(patient_id, encounters, payers, organizations, patients, procedures)
+        if patient_id is not None:
+            patient_visualizations(patient_id, encounters, payers, organizations, patients, procedures, keys, indexes,
+                                   load_cube(COMPACT_TABLES))
     elif page == "Patient Report":
-        st.sidebar.header("Generate Patient Report")
-        patient_list = patients['FIRST'] + " " + patients['LAST']
-        selected_patient_name = st.sidebar.selectbox("Select Patient", patient_list)
-
-        if selected_patient_name:
-            patient_id = patients[patient_list == selected_patient_name]['Id'].values[0]
-            report = patient_report(patient_id, encounters, patients, procedures)
-            st.subheader(f"Patient Report for {selected_patient_name}")
-            st.write(report)
+        report_page(directory, load_reports(COMPACT_TABLES))
+    elif page == "KPIs":
+        kpi_page(*load_kpis(COMPACT_TABLES))
+    elif page == "Map":
+        map_page(load_spatial(COMPACT_TABLES), directory, keys)
+    elif page == "Performance":
+        performance_page()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,784 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import data_processing as dp
+from data_index import TableIndexes, FilterEngine
+
+
+############################################ LEGACY IMPLEMENTATIONS ###############################################
+# Per-row versions of the date helpers as they were before vectorization, kept as the baseline.
+
+def legacy_convert_date_format(df, column_name, table_name, logs):
+    def convert_string_to_date(date_str):
+        try:
+            parts = date_str.split('|')
+            month_day = parts[1].split('-')
+            dp.log_issue(logs, table_name, column_name, 'should be converted to datetime format')
+            return f'{parts[0]}-{month_day[0]}-{month_day[1]}'
+        except Exception as e:
+            dp.log_issue(logs, table_name, column_name, f'Error converting date string {date_str}: {str(e)}')
+            return pd.NaT
+
+    df[column_name] = df[column_name].apply(convert_string_to_date)
+    return df
+
+
+def legacy_modify_value(value):
+    if value.startswith('943|'):
+        return '1943|' + value[4:]
+    return value
+
+
+def legacy_convert_column_to_date(df, column_name, table_name, logs):
+    def convert_string_to_date(date_str):
+        return datetime.strptime(date_str.replace('|', '-'), '%Y-%m-%dT%H:%M:%SZ')
+
+    df[column_name] = df[column_name].apply(convert_string_to_date)
+    dp.log_issue(logs, table_name, column_name, 'Object type should be Converted to datetime')
+    return df
+
+
+############################################ DATA ###############################################
+
+def make_birthdates(n_rows, seed=0):
+    """
+    Generates BIRTHDATE values shaped like patients.csv: 'YYYY|MM-DD', with a few '943|' century errors.
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.to_datetime('1920-01-01') + pd.to_timedelta(rng.integers(0, 365 * 100, n_rows), unit='D')
+    values = pd.Series(days.strftime('%Y|%m-%d'))
+    broken = rng.random(n_rows) < 0.001
+    values[broken] = '943|' + values[broken].str[5:]
+    return values
+
+
+def make_timestamps(n_rows, seed=0):
+    """
+    Generates START values shaped like encounters.csv, with 1% pipe-delimited values.
+    """
+    rng = np.random.default_rng(seed)
+    stamps = pd.to_datetime('2010-01-01') + pd.to_timedelta(rng.integers(0, 10 * 365 * 86400, n_rows), unit='s')
+    values = pd.Series(stamps.strftime('%Y-%m-%dT%H:%M:%SZ'))
+    piped = rng.random(n_rows) < 0.01
+    values[piped] = values[piped].str.replace('-', '|', n=1, regex=False)
+    return values
+
+
+def make_encounters(n_rows, n_patients=None, seed=0):
+    """
+    Generates a cleaned encounters table (typed columns, uppercase strings).
+    """
+    rng = np.random.default_rng(seed)
+    n_patients = n_patients or max(n_rows // 50, 1)
+    patients = np.array([f'{i:08X}-0000-0000-0000-{i:012X}' for i in range(n_patients)])
+    classes = np.array(['AMBULATORY', 'WELLNESS', 'OUTPATIENT', 'INPATIENT', 'EMERGENCY', 'URGENTCARE'])
+    start = pd.to_datetime('2010-01-01') + pd.to_timedelta(rng.integers(0, 10 * 365 * 86400, n_rows), unit='s')
+    base_cost = rng.gamma(2.0, 60.0, n_rows).round(2)
+    return pd.DataFrame({
+        'Id': [f'{i:08X}-1111-1111-1111-{i:012X}' for i in range(n_rows)],
+        'START': start,
+        'STOP': start + pd.to_timedelta(rng.integers(900, 86400 * 3, n_rows), unit='s'),
+        'PATIENT': patients[rng.integers(0, n_patients, n_rows)],
+        'ENCOUNTERCLASS': classes[rng.integers(0, len(classes), n_rows)],
+        'CODE': rng.integers(100000, 999999, n_rows),
+        'BASE_ENCOUNTER_COST': base_cost,
+        'TOTAL_CLAIM_COST': (base_cost * rng.uniform(1, 3, n_rows)).round(2),
+        'PAYER_COVERAGE': (base_cost * rng.uniform(0, 1, n_rows)).round(2),
+        'REASONDESCRIPTION': np.where(rng.random(n_rows) < 0.7, 'VALUE NOT PROVIDED', 'ACUTE BRONCHITIS'),
+    })
+
+
+def make_raw_encounters(n_rows, seed=0):
+    """
+    Generates an encounters table shaped like encounters.csv before cleaning: string timestamps
+    (some pipe-delimited), lowercase classes, 'NAN' sentinels and 2% duplicated rows.
+    """
+    df = make_encounters(n_rows, seed=seed)
+    df['START'] = make_timestamps(n_rows, seed=seed).to_numpy()
+    df['STOP'] = df['STOP'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    df['ENCOUNTERCLASS'] = df['ENCOUNTERCLASS'].str.lower()
+    df['REASONCODE'] = np.where(np.random.default_rng(seed).random(n_rows) < 0.7, 'NAN', '10509002')
+    return pd.concat([df, df.iloc[::50]], ignore_index=True).sample(frac=1, random_state=seed)
+
+
+def make_app_tables(n_encounters, seed=0):
+    """
+    Generates the patients, encounters and procedures tables the app pages read, with matching keys.
+    """
+    rng = np.random.default_rng(seed)
+    encounters = make_encounters(n_encounters, seed=seed)
+    patient_ids = encounters['PATIENT'].unique()
+    patients = pd.DataFrame({
+        'Id': patient_ids,
+        'FIRST': [f'FIRST{i}' for i in range(len(patient_ids))],
+        'LAST': [f'LAST{i % 1000}' for i in range(len(patient_ids))],
+        'GENDER': rng.choice(['M', 'F'], len(patient_ids)),
+        'BIRTHDATE': pd.to_datetime('1930-01-01') + pd.to_timedelta(rng.integers(0, 365 * 90, len(patient_ids)), unit='D'),
+        'RACE': rng.choice(['WHITE', 'BLACK', 'ASIAN', 'HISPANIC', 'OTHER'], len(patient_ids)),
+        'ETHNICITY': rng.choice(['NONHISPANIC', 'HISPANIC'], len(patient_ids)),
+        'MARITAL': rng.choice(['M', 'S'], len(patient_ids)),
+        'ADDRESS': '1 MAIN STREET',
+        'CITY': rng.choice(['BOSTON', 'QUINCY', 'WORCESTER'], len(patient_ids)),
+        'STATE': 'MASSACHUSETTS',
+        'ZIP': 2186.0,
+    })
+    procedures = encounters.sample(n_encounters // 2, random_state=seed)[['START', 'STOP', 'PATIENT', 'Id']]
+    procedures = procedures.rename(columns={'Id': 'ENCOUNTER'}).reset_index(drop=True)
+    procedures['CODE'] = rng.integers(1, 200, len(procedures))
+    procedures['DESCRIPTION'] = 'PROCEDURE ' + procedures['CODE'].astype(str)
+    return patients, encounters, procedures
+
+
+# Separator and BOM of each generated file, like the files in Dataset/
+SYNTHEA_FORMATS = {
+    'patients': (':', False),
+    'encounters': (',', True),
+    'procedures': (',', False),
+    'payers': (',', True),
+    'organizations': (',', True),
+}
+
+
+def make_uuids(n_rows, rng):
+    """
+    Generates lowercase UUID-shaped ids.
+    """
+    digits = rng.bytes(16 * n_rows).hex()
+    return [f'{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}'
+            for i in range(0, 32 * n_rows, 32)]
+
+
+def make_synthea_tables(n_encounters, seed=0):
+    """
+    Generates the five raw tables with the columns of Dataset/data_dictionary.csv and the quirks of
+    the real extract: 'YYYY|MM-DD' birthdates with 0.1% '943|' century errors, 1% pipe-delimited
+    timestamps, whitespace-padded first names, lowercase categories and empty optional fields.
+    There is one patient per 50 encounters and one procedure per 2 encounters. The output only
+    depends on n_encounters and seed.
+
+    Returns:
+    dict: Table name -> raw pd.DataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    n_patients = max(n_encounters // 50, 1)
+    n_procedures = max(n_encounters // 2, 1)
+    n_organizations = max(n_encounters // 10_000, 1)
+
+    payer_names = ['Medicare', 'Medicaid', 'Dual Eligible', 'Blue Cross Blue Shield', 'Aetna', 'Cigna Health',
+                   'UnitedHealthcare', 'Humana', 'Anthem', 'NO_INSURANCE']
+    payers = pd.DataFrame({
+        'Id': make_uuids(len(payer_names), rng),
+        'NAME': payer_names,
+        'ADDRESS': [f'{i * 100 + 7} Security Blvd' for i in range(len(payer_names) - 1)] + [np.nan],
+        'CITY': ['Baltimore'] * (len(payer_names) - 1) + [np.nan],
+        'STATE_HEADQUARTERED': ['MD'] * (len(payer_names) - 1) + [np.nan],
+        'ZIP': [21244 + i for i in range(len(payer_names) - 1)] + [np.nan],
+        'PHONE': [f'1-800-{i:03d}-{i * 7 % 10000:04d}' for i in range(len(payer_names) - 1)] + [np.nan],
+    })
+
+    cities = np.array(['Boston', 'Quincy', 'Worcester', 'Springfield', 'Cambridge', 'Lowell', 'Brockton'])
+    organizations = pd.DataFrame({
+        'Id': make_uuids(n_organizations, rng),
+        'NAME': [f'HOSPITAL {i}' for i in range(n_organizations)],
+        'ADDRESS': [f'{i + 1} FRUIT STREET' for i in range(n_organizations)],
+        'CITY': np.char.upper(cities[rng.integers(0, len(cities), n_organizations)]),
+        'STATE': 'MA',
+        'ZIP': [f'{2100 + i % 900:05d}' for i in range(n_organizations)],
+        'LAT': (42.0 + rng.random(n_organizations)).round(6),
+        'LON': (-71.5 + rng.random(n_organizations)).round(6),
+    })
+
+    birthdates = make_birthdates(n_patients, seed=seed)
+    dead = rng.random(n_patients) < 0.15
+    deathdates = pd.Series(np.nan, index=range(n_patients), dtype=object)
+    deathdates[dead] = (pd.to_datetime('2000-01-01')
+                        + pd.to_timedelta(rng.integers(0, 365 * 20, int(dead.sum())), unit='D')).strftime('%Y-%m-%d')
+    gender = rng.choice(['M', 'F'], n_patients)
+    patients = pd.DataFrame({
+        'Id': make_uuids(n_patients, rng),
+        'BIRTHDATE': birthdates.to_numpy(),
+        'DEATHDATE': deathdates.to_numpy(),
+        'PREFIX': np.where(gender == 'M', 'Mr.', 'Mrs.'),
+        'FIRST': [f'   First{i % 1000} ' for i in range(n_patients)],
+        'LAST': [f'Last{i % 977}' for i in range(n_patients)],
+        'SUFFIX': np.where(rng.random(n_patients) < 0.01, 'PhD', None),
+        'MAIDEN': np.where((gender == 'F') & (rng.random(n_patients) < 0.5), 'Maiden', None),
+        'MARITAL': rng.choice(['M', 'S', ''], n_patients, p=[0.5, 0.3, 0.2]),
+        'RACE': rng.choice(['white', 'black', 'asian', 'hispanic', 'native', 'other'], n_patients,
+                           p=[0.7, 0.1, 0.08, 0.07, 0.02, 0.03]),
+        'ETHNICITY': rng.choice(['nonhispanic', 'hispanic'], n_patients, p=[0.9, 0.1]),
+        'GENDER': np.where(rng.random(n_patients) < 0.005, None, gender),
+        'BIRTHPLACE': np.char.add(cities[rng.integers(0, len(cities), n_patients)], '  Massachusetts  US'),
+        'ADDRESS': [f'{i % 997} Little Station Unit {i % 89}' for i in range(n_patients)],
+        'CITY': cities[rng.integers(0, len(cities), n_patients)],
+        'STATE': 'Massachusetts',
+        'COUNTY': 'Norfolk County',
+        'ZIP': np.where(rng.random(n_patients) < 0.3, np.nan, 2186.0),
+        'LAT': 42.0 + rng.random(n_patients),
+        'LON': -71.5 + rng.random(n_patients),
+    })
+
+    encounter_ids = make_uuids(n_encounters, rng)
+    start = pd.Series(make_timestamps(n_encounters, seed=seed).to_numpy())
+    stop = (pd.to_datetime(start.str.replace('|', '-', regex=False), format='%Y-%m-%dT%H:%M:%SZ')
+            + pd.to_timedelta(rng.integers(900, 86400, n_encounters), unit='s')).dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    base_cost = rng.gamma(2.0, 60.0, n_encounters).round(2)
+    has_reason = rng.random(n_encounters) < 0.3
+    encounter_patients = rng.integers(0, n_patients, n_encounters)
+    encounters = pd.DataFrame({
+        'Id': encounter_ids,
+        'START': start.to_numpy(),
+        'STOP': stop.to_numpy(),
+        'PATIENT': np.asarray(patients['Id'])[encounter_patients],
+        'ORGANIZATION': np.asarray(organizations['Id'])[rng.integers(0, n_organizations, n_encounters)],
+        'PAYER': np.asarray(payers['Id'])[rng.integers(0, len(payers), n_encounters)],
+        'ENCOUNTERCLASS': rng.choice(['ambulatory', 'wellness', 'outpatient', 'inpatient', 'emergency', 'urgentcare'],
+                                     n_encounters),
+        'CODE': rng.choice([185345009, 162673000, 410620009, 185347001, 50849002], n_encounters),
+        'DESCRIPTION': rng.choice(['Encounter for symptom', 'General examination of patient (procedure)',
+                                   'Well child visit (procedure)'], n_encounters),
+        'BASE_ENCOUNTER_COST': base_cost,
+        'TOTAL_CLAIM_COST': (base_cost * rng.uniform(1, 3, n_encounters)).round(2),
+        'PAYER_COVERAGE': (base_cost * rng.uniform(0, 1, n_encounters)).round(2),
+        'REASONCODE': np.where(has_reason, 10509002.0, np.nan),
+        'REASONDESCRIPTION': np.where(has_reason, 'Acute bronchitis (disorder)', None),
+    })
+
+    procedure_encounters = rng.integers(0, n_encounters, n_procedures)
+    has_reason = rng.random(n_procedures) < 0.2
+    procedure_codes = rng.choice([430193006, 710824005, 171207006, 428191000124101], n_procedures)
+    procedures = pd.DataFrame({
+        'START': encounters['START'].to_numpy()[procedure_encounters],
+        'STOP': encounters['STOP'].to_numpy()[procedure_encounters],
+        'PATIENT': encounters['PATIENT'].to_numpy()[procedure_encounters],
+        'ENCOUNTER': encounters['Id'].to_numpy()[procedure_encounters],
+        'CODE': procedure_codes,
+        'DESCRIPTION': np.char.add('Procedure ', procedure_codes.astype(str)),
+        'BASE_COST': rng.integers(100, 2000, n_procedures),
+        'REASONCODE': np.where(has_reason, 72892002.0, np.nan),
+        'REASONDESCRIPTION': np.where(has_reason, 'Normal pregnancy', None),
+    })
+    return {'encounters': encounters, 'payers': payers, 'organizations': organizations,
+            'patients': patients, 'procedures': procedures}
+
+
+def write_synthea_csvs(tables, directory):
+    """
+    Writes generated tables to <table>.csv files with the separators and BOMs of SYNTHEA_FORMATS.
+
+    Returns:
+    dict: Table name -> file path.
+    """
+    paths = {}
+    for table_name, df in tables.items():
+        separator, bom = SYNTHEA_FORMATS[table_name]
+        paths[table_name] = os.path.join(directory, f'{table_name}.csv')
+        df.to_csv(paths[table_name], sep=separator, index=False, encoding='utf-8-sig' if bom else 'utf-8', lineterminator='\r\n')
+    return paths
+
+
+############################################ BENCHMARKS ###############################################
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+# Arrow memory pools whose buffers outlived their measurement, they must not be freed
+_live_pools = []
+
+
+def measure_peak(func, setup=None):
+    """
+    Runs func once and returns the peak memory it allocated, in bytes. setup() runs first, untracked,
+    and its result is passed to func.
+
+    The peak is the tracemalloc peak (Python objects and numpy arrays) plus the peak of a fresh Arrow
+    memory pool (Arrow buffers, which tracemalloc does not see). It is an upper bound of the true
+    peak, as the two peaks may not happen at the same time.
+    """
+    args = () if setup is None else (setup(),)
+    gc.collect()
+    previous_pool = pa.default_memory_pool()
+    pool = pa.proxy_memory_pool(previous_pool)
+    pa.set_memory_pool(pool)
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        python_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(previous_pool)
+    del result, args
+    gc.collect()
+    if pool.bytes_allocated():
+        _live_pools.append(pool)
+    return python_peak + pool.max_memory()
+
+
+def bench_dates(n_rows):
+    """
+    Times the legacy per-row date paths against the vectorized ones.
+
+    Returns:
+    list: (benchmark, implementation, rows, seconds) tuples.
+    """
+    results = []
+    birthdates = make_birthdates(n_rows)
+    timestamps = make_timestamps(n_rows)
+
+    def legacy_birthdate(values):
+        df = pd.DataFrame({'BIRTHDATE': values.apply(legacy_modify_value)})
+        df = legacy_convert_date_format(df, 'BIRTHDATE', 'patients', [])
+        return dp.convert_to_date(df, 'BIRTHDATE', 'patients', [])
+
+    def vectorized_birthdate(values):
+        df = pd.DataFrame({'BIRTHDATE': values})
+        return dp.normalize_date_column(df, 'BIRTHDATE', 'patients', [], date_format='%Y-%m-%d', century_prefix='1')
+
+    results.append(('birthdate', 'legacy', n_rows, timed(legacy_birthdate, birthdates)))
+    results.append(('birthdate', 'vectorized', n_rows, timed(vectorized_birthdate, birthdates)))
+
+    results.append(('start', 'legacy', n_rows,
+                    timed(lambda v: legacy_convert_column_to_date(pd.DataFrame({'START': v}), 'START', 'encounters', []), timestamps)))
+    results.append(('start', 'vectorized', n_rows,
+                    timed(lambda v: dp.convert_column_to_date(pd.DataFrame({'START': v}), 'START', 'encounters', []), timestamps)))
+    return results
+
+
+def bench_storage(n_rows):
+    """
+    Times the CSV round-trip of a cleaned encounters table against the Parquet one,
+    including a projected and filtered Parquet read, and reports the file sizes.
+
+    Returns:
+    list: (benchmark, implementation, rows, seconds) tuples and a list of (format, bytes) tuples.
+    """
+    df = make_encounters(n_rows)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'encounters_cleaned.csv')
+        parquet_path = os.path.join(tmp, 'encounters_cleaned.parquet')
+        results.append(('write', 'csv', n_rows, timed(lambda: df.to_csv(csv_path, index=False))))
+        results.append(('write', 'parquet', n_rows, timed(lambda: dp.save_df_to_parquet(df, parquet_path, sort_by='START'))))
+        results.append(('load', 'csv', n_rows,
+                        timed(lambda: pd.read_csv(csv_path, parse_dates=['START', 'STOP']))))
+        results.append(('load', 'parquet', n_rows, timed(dp.load_parquet_file, parquet_path)))
+        results.append(('load_projected_filtered', 'parquet', n_rows,
+                        timed(dp.load_parquet_file, parquet_path, ['PATIENT', 'START', 'TOTAL_CLAIM_COST'],
+                              [('START', '>=', pd.Timestamp('2019-01-01'))])))
+        sizes = [('csv', os.path.getsize(csv_path)), ('parquet', os.path.getsize(parquet_path))]
+    return results, sizes
+
+
+def bench_cleaning_memory(n_rows):
+    """
+    Compares the cleaning sequence of the notebook (preprocess_columns, replace_value_with_nan on the
+    'NAN' sentinels, replace_nan_with_value) and the spec engine with their null-preserving Arrow
+    modes, in time and peak memory. Each runs on the encounters strings as read by pandas 3 (Arrow)
+    and by older pandas (object).
+
+    Returns:
+    tuple: (benchmark, implementation, rows, seconds) tuples and (benchmark, implementation, peak bytes) tuples.
+    """
+    raw = make_synthea_tables(n_rows)['encounters']
+    inputs = {
+        'arrow': raw.astype({column: dp.ARROW_STRING_DTYPE for column in raw.columns if raw[column].dtype == object
+                             or isinstance(raw[column].dtype, pd.StringDtype)}),
+        'object': raw.astype({column: object for column in raw.columns if isinstance(raw[column].dtype, pd.StringDtype)}),
+    }
+    spec = dp.CLEANING_SPECS['encounters']
+    null_preserving_spec = dp.null_preserving_specs()['encounters']
+    sentinel_columns = [column for column, column_spec in spec['columns'].items() if column_spec.get('nan_values')]
+    fill_columns = [column for column, column_spec in spec['columns'].items() if 'fill' in column_spec]
+
+    def current_sequence(df):
+        df = dp.preprocess_columns(df)
+        for column in sentinel_columns:
+            dp.replace_value_with_nan(df, column, dp.NAN_SENTINEL)
+        return dp.replace_nan_with_value(df, fill_columns, 'encounters', [])
+
+    def null_preserving_sequence(df):
+        df = dp.preprocess_columns(df, keep_nulls=True)
+        return dp.replace_nan_with_value(df, fill_columns, 'encounters', [])
+
+    variants = [
+        ('preprocess_sequence', 'current', current_sequence),
+        ('preprocess_sequence', 'keep_nulls', null_preserving_sequence),
+        ('run_cleaning_spec', 'current', lambda df: dp.run_cleaning_spec(df, spec, 'encounters', [])),
+        ('run_cleaning_spec', 'keep_nulls', lambda df: dp.run_cleaning_spec(df, null_preserving_spec, 'encounters', [])),
+    ]
+    results, peaks = [], []
+    for input_name, df in inputs.items():
+        for benchmark, implementation, func in variants:
+            implementation = f'{implementation}[{input_name}]'
+            results.append((benchmark, implementation, n_rows, time_call(func, setup=df.copy)))
+            peaks.append((benchmark, implementation, measure_peak(func, setup=df.copy)))
+    return results, peaks
+
+
+def bench_patient_pages(n_encounters, n_lookups=50):
+    """
+    Times the per-patient work of one page interaction (slicing the patient's rows and
+    building the report) with full-table scans and with the prebuilt indexes.
+
+    Returns:
+    list: (benchmark, implementation, rows, seconds per interaction) tuples.
+    """
+    import app
+
+    patients, encounters, procedures = make_app_tables(n_encounters)
+    patient_ids = patients['Id'].sample(n_lookups, random_state=0).tolist()
+    started = time.perf_counter()
+    indexes = TableIndexes({'patients': patients, 'encounters': encounters, 'procedures': procedures})
+    results = [('build_indexes', 'indexed', n_encounters, time.perf_counter() - started)]
+
+    for implementation, page_indexes in [('scan', None), ('indexed', indexes)]:
+        started = time.perf_counter()
+        for patient_id in patient_ids:
+            app.patient_slices(patient_id, encounters, patients, procedures, page_indexes)
+        results.append(('patient_slices', implementation, n_encounters, (time.perf_counter() - started) / n_lookups))
+
+        started = time.perf_counter()
+        for patient_id in patient_ids:
+            app.patient_report(patient_id, encounters, patients, procedures, page_indexes)
+        results.append(('patient_report', implementation, n_encounters, (time.perf_counter() - started) / n_lookups))
+    return results
+
+
+def legacy_filter(selection, encounters, payers, patients, procedures):
+    """
+    The sequential boolean-mask filtering patient_info_page used before the FilterEngine.
+    Patient filters only restrict the patients table there.
+    """
+    patient_data, patient_encounters, patient_procedures = patients, encounters, procedures
+    if 'Id' in selection.get('patients', {}):
+        patient_id = selection['patients']['Id']
+        patient_data = patients[patients['Id'] == patient_id]
+        patient_encounters = encounters[encounters['PATIENT'] == patient_id]
+        patient_procedures = procedures[procedures['PATIENT'] == patient_id]
+    for column, value in selection.get('encounters', {}).items():
+        patient_encounters = patient_encounters[patient_encounters[column] == value]
+    for column, value in selection.get('procedures', {}).items():
+        patient_procedures = patient_procedures[patient_procedures[column] == value]
+    if 'NAME' in selection.get('payers', {}):
+        payer_ids = payers[payers['NAME'] == selection['payers']['NAME']]['Id']
+        patient_encounters = patient_encounters[patient_encounters['PAYER'].isin(payer_ids)]
+    for column, value in selection.get('patients', {}).items():
+        if column != 'Id':
+            patient_data = patient_data[patient_data[column] == value]
+    return patient_data, patient_encounters, patient_procedures
+
+
+def bench_filters(n_encounters, repeats=5):
+    """
+    Times combined sidebar filters with the legacy mask chain and with the FilterEngine.
+
+    Returns:
+    list: (benchmark, implementation, rows, seconds per query) tuples.
+    """
+    patients, encounters, procedures = make_app_tables(n_encounters)
+    payers = pd.DataFrame({'Id': ['P1', 'P2', 'P3'], 'NAME': ['MEDICARE', 'MEDICAID', 'MEDICARE']})
+    encounters['PAYER'] = np.random.default_rng(0).choice(payers['Id'], n_encounters)
+    engine = FilterEngine(TableIndexes({'patients': patients, 'encounters': encounters,
+                                        'procedures': procedures, 'payers': payers}))
+    selections = {
+        'city': {'patients': {'CITY': 'BOSTON'}},
+        'class_payer': {'encounters': {'ENCOUNTERCLASS': 'WELLNESS'}, 'payers': {'NAME': 'MEDICARE'}},
+        'city_race_class_payer': {'patients': {'CITY': 'BOSTON', 'RACE': 'ASIAN'},
+                                  'encounters': {'ENCOUNTERCLASS': 'WELLNESS'}, 'payers': {'NAME': 'MEDICARE'}},
+        'patient_code': {'patients': {'Id': patients['Id'].iloc[7]}, 'procedures': {'CODE': 5}},
+    }
+    results = []
+    for name, selection in selections.items():
+        started = time.perf_counter()
+        for _ in range(repeats):
+            legacy_filter(selection, encounters, payers, patients, procedures)
+        results.append((f'filter_{name}', 'legacy', n_encounters, (time.perf_counter() - started) / repeats))
+
+        started = time.perf_counter()
+        for _ in range(repeats):
+            positions = engine.run(selection)
+        results.append((f'filter_{name}', 'engine', n_encounters, (time.perf_counter() - started) / repeats))
+
+        # Building the filtered frames, which the legacy timing includes
+        started = time.perf_counter()
+        for _ in range(repeats):
+            [df if positions[table] is None else df.iloc[positions[table]]
+             for table, df in [('patients', patients), ('encounters', encounters), ('procedures', procedures)]]
+        results.append((f'filter_{name}', 'engine_materialize', n_encounters, (time.perf_counter() - started) / repeats))
+    return results
+
+
+def bench_incremental(n_rows, delta=0.01):
+    """
+    Times a nightly run after delta * n_rows encounters were appended to the extract: a full
+    clean_table run against clean_table_incremental resuming from the previous watermark.
+
+    Returns:
+    list: (benchmark, implementation, rows, seconds) tuples.
+    """
+    lines = make_raw_encounters(n_rows).to_csv(index=False).splitlines(keepends=True)
+    n_old = int(len(lines) * (1 - delta))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'encounters.csv')
+        output = os.path.join(tmp, 'encounters_cleaned.csv')
+        with open(source, 'w') as f:
+            f.writelines(lines[:n_old])
+        results.append(('incremental_first_run', 'incremental', n_old,
+                        timed(dp.clean_table_incremental, source, output, 'encounters', [])))
+        with open(source, 'a') as f:
+            f.writelines(lines[n_old:])
+
+        def full_run():
+            df, _ = dp.clean_table(source, 'encounters', [])
+            df.to_csv(os.path.join(tmp, 'full.csv'), index=False)
+
+        results.append(('nightly_append', 'full', len(lines), timed(full_run)))
+        results.append(('nightly_append', 'incremental', len(lines),
+                        timed(dp.clean_table_incremental, source, output, 'encounters', [])))
+    return results
+
+
+############################################ SUITE ###############################################
+
+SUITE_SIZES = [10_000, 1_000_000, 10_000_000]
+# A function is reported as a regression when it is this much slower than the baseline
+REGRESSION_TOLERANCE = 0.25
+# Timings below this many seconds are too noisy to compare
+REGRESSION_MIN_SECONDS = 0.01
+
+
+def time_call(func, setup=None, repeats=1):
+    """
+    Returns the best time of func over repeats runs. setup() runs before each run, untimed,
+    and its result is passed to func (e.g. a fresh copy of a table the function modifies).
+    """
+    best = None
+    for _ in range(repeats):
+        args = () if setup is None else (setup(),)
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def suite_metadata():
+    """
+    Describes the code and environment a suite run measured.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run_suite(n_encounters, repeats=1, seed=0):
+    """
+    Times the public data_processing functions and the app filter and report paths on generated
+    Synthea-shaped files of n_encounters encounters.
+
+    Returns:
+    list: Dicts with 'size', 'function', 'table', 'rows' and 'seconds'.
+    """
+    import app
+    from aggregates import AggregateCube, KpiCube
+    from data_index import PatientDirectory
+    from reports import ReportService
+    from spatial_index import FacilityIndex
+
+    results = []
+
+    def record(function, table_name, rows, func, setup=None, n_repeats=repeats):
+        seconds = time_call(func, setup, n_repeats)
+        results.append({'size': n_encounters, 'function': function, 'table': table_name, 'rows': rows, 'seconds': seconds})
+
+    tables = make_synthea_tables(n_encounters, seed=seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_synthea_csvs(tables, tmp)
+        raw = {}
+        for table_name, path in paths.items():
+            record('load_csv_file', table_name, len(tables[table_name]),
+                   lambda: raw.__setitem__(table_name, dp.load_csv_file(path, interactive=False)))
+
+        patients, encounters = raw['patients'], raw['encounters']
+        for table_name in ['patients', 'encounters']:
+            df = raw[table_name]
+            record('preprocess_columns', table_name, len(df), dp.preprocess_columns, setup=df.copy)
+        record('convert_date_format', 'patients', len(patients),
+               lambda df: dp.convert_date_format(df, 'BIRTHDATE', 'patients', []), setup=patients.copy)
+        record('normalize_date_column', 'patients', len(patients),
+               lambda df: dp.normalize_date_column(df, 'BIRTHDATE', 'patients', [], century_prefix='1'), setup=patients.copy)
+        record('convert_to_date', 'patients', len(patients),
+               lambda df: dp.convert_to_date(df, 'DEATHDATE', 'patients', []), setup=patients.copy)
+        record('convert_column_to_date', 'encounters', len(encounters),
+               lambda df: dp.convert_column_to_date(df, 'START', 'encounters', []), setup=encounters.copy)
+        record('convert_columns_to_int', 'encounters', len(encounters),
+               lambda df: dp.convert_columns_to_int(df, ['CODE'], 'encounters', []), setup=encounters.copy)
+        record('convert_column_to_float', 'encounters', len(encounters),
+               lambda df: dp.convert_column_to_float(df, 'TOTAL_CLAIM_COST', 'encounters', []), setup=encounters.copy)
+        record('replace_value_with_nan', 'encounters', len(encounters),
+               lambda df: dp.replace_value_with_nan(df, 'ENCOUNTERCLASS', 'urgentcare'), setup=encounters.copy)
+        record('replace_nan_with_value', 'encounters', len(encounters),
+               lambda df: dp.replace_nan_with_value(df, ['REASONDESCRIPTION'], 'encounters', []), setup=encounters.copy)
+        record('replace_nan_in_numeric_columns', 'encounters', len(encounters),
+               lambda df: dp.replace_nan_in_numeric_columns(df, 'encounters', []), setup=encounters.copy)
+        record('profile_df', 'encounters', len(encounters), lambda: dp.profile_df(encounters))
+        record('profile_df[approximate]', 'encounters', len(encounters),
+               lambda: dp.profile_df(encounters, approximate=True))
+        record('profile_df[sample]', 'encounters', len(encounters),
+               lambda: dp.profile_df(encounters, sample_size=100_000))
+
+        cleaned = {}
+        for table_name, path in paths.items():
+            record('clean_table', table_name, len(tables[table_name]),
+                   lambda: cleaned.__setitem__(table_name, dp.clean_table(path, table_name, [])[0]))
+
+        csv_path = os.path.join(tmp, 'encounters_cleaned.csv')
+        parquet_path = os.path.join(tmp, 'encounters_cleaned.parquet')
+        record('save_df_to_csv', 'encounters', len(cleaned['encounters']),
+               lambda: dp.save_df_to_csv(cleaned['encounters'], csv_path))
+        record('save_df_to_parquet', 'encounters', len(cleaned['encounters']),
+               lambda: dp.save_df_to_parquet(cleaned['encounters'], parquet_path))
+        record('load_cleaned_table', 'encounters', len(cleaned['encounters']), lambda: dp.load_cleaned_table(csv_path))
+
+    # App paths, on the cleaned tables
+    holder = {}
+    record('TableIndexes', 'all', n_encounters, lambda: holder.__setitem__('indexes', TableIndexes(cleaned)), n_repeats=1)
+    record('AggregateCube', 'all', n_encounters,
+           lambda: AggregateCube(cleaned['patients'], cleaned['encounters'], cleaned['procedures']), n_repeats=1)
+    record('PatientDirectory', 'patients', len(cleaned['patients']),
+           lambda: holder.__setitem__('directory', PatientDirectory(cleaned['patients'])), n_repeats=1)
+    indexes, directory = holder['indexes'], holder['directory']
+
+    record('PatientDirectory.search', 'patients', len(cleaned['patients']), lambda: directory.search('first1'))
+    engine = FilterEngine(indexes)
+    patient_id = cleaned['patients']['Id'].iloc[len(cleaned['patients']) // 2]
+    selections = {
+        'city': {'patients': {'CITY': 'BOSTON'}},
+        'class_payer': {'encounters': {'ENCOUNTERCLASS': 'WELLNESS'}, 'payers': {'NAME': 'MEDICARE'}},
+        'patient_code': {'patients': {'Id': patient_id}, 'procedures': {'CODE': 430193006}},
+    }
+    for name, selection in selections.items():
+        record(f'FilterEngine.run[{name}]', 'all', n_encounters, lambda: engine.run(selection))
+    record('patient_report', 'all', n_encounters,
+           lambda: app.patient_report(patient_id, cleaned['encounters'], cleaned['patients'], cleaned['procedures'], indexes))
+    record('patient_report[scan]', 'all', n_encounters,
+           lambda: app.patient_report(patient_id, cleaned['encounters'], cleaned['patients'], cleaned['procedures']))
+    record('ReportService', 'all', n_encounters,
+           lambda: holder.__setitem__('reports', ReportService.from_tables(cleaned['patients'], cleaned['encounters'],
+                                                                           cleaned['procedures'])), n_repeats=1)
+    record('ReportService.render_all', 'patients', len(cleaned['patients']), lambda: list(holder['reports'].render_all()))
+    record('KpiCube', 'encounters', len(cleaned['encounters']),
+           lambda: holder.__setitem__('kpis', KpiCube(cleaned['encounters'])), n_repeats=1)
+    months = holder['kpis'].values['MONTH'].dropna().sort_values()
+    kpi_filters = {'ENCOUNTERCLASS': ['WELLNESS', 'AMBULATORY'], 'MONTH': months[len(months) // 2:]}
+    record('KpiCube.kpis', 'encounters', len(cleaned['encounters']), lambda: holder['kpis'].kpis(kpi_filters))
+    record('KpiCube.breakdown[ORGANIZATION]', 'encounters', len(cleaned['encounters']),
+           lambda: holder['kpis'].breakdown('ORGANIZATION', kpi_filters))
+    record('FacilityIndex', 'patients', len(cleaned['patients']),
+           lambda: holder.__setitem__('spatial', FacilityIndex(cleaned['patients'], cleaned['organizations'])), n_repeats=1)
+    organization_id = cleaned['organizations']['Id'].iloc[0]
+    record('FacilityIndex.patients_within', 'patients', len(cleaned['patients']),
+           lambda: holder['spatial'].patients_within(organization_id, 10))
+    record('FacilityIndex.nearest_organizations', 'patients', len(cleaned['patients']),
+           lambda: holder['spatial'].organizations.nearest(holder['spatial'].patients.lats, holder['spatial'].patients.lons))
+    record('density_grid', 'patients', len(cleaned['patients']), lambda: holder['spatial'].patients.density(5))
+    return results
+
+
+def save_suite_results(results, file_path, metadata=None):
+    """
+    Writes suite results with their metadata to a JSON file.
+    """
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump({'metadata': metadata or suite_metadata(), 'results': results}, f, indent=1)
+    print(f"Benchmark results saved to {file_path}")
+
+
+def compare_results(baseline_path, results, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compares suite results with a saved baseline run.
+
+    Parameters:
+    baseline_path (str): A JSON file written by save_suite_results.
+    results (list): The current results.
+    tolerance (float): The allowed slowdown, 0.25 for 25%.
+
+    Returns:
+    pd.DataFrame: The functions timed in both runs with their 'baseline' and 'seconds' times and the
+        'ratio', and a 'regression' flag.
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = pd.DataFrame(json.load(f)['results'])
+    keys = ['size', 'function', 'table']
+    comparison = baseline[keys + ['seconds']].rename(columns={'seconds': 'baseline'}).merge(
+        pd.DataFrame(results)[keys + ['seconds']], on=keys)
+    comparison['ratio'] = comparison['seconds'] / comparison['baseline']
+    comparison['regression'] = ((comparison['ratio'] > 1 + tolerance)
+                                & (comparison['seconds'] > REGRESSION_MIN_SECONDS))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for data_processing")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--suite', help="Run the suite on generated extracts of these encounter counts, "
+                                        f"e.g. {','.join(str(size) for size in SUITE_SIZES)}")
+    parser.add_argument('--repeats', type=int, default=1, help="Runs per function in the suite, the best is kept")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where the suite writes its results")
+    parser.add_argument('--baseline', help="Suite results of an earlier version to compare with")
+    args = parser.parse_args()
+
+    if args.suite:
+        results = []
+        for size in [int(size) for size in args.suite.split(',')]:
+            results.extend(run_suite(size, repeats=args.repeats))
+        print(pd.DataFrame(results).to_string(index=False))
+        save_suite_results(results, args.output)
+        if args.baseline:
+            comparison = compare_results(args.baseline, results)
+            print(comparison.to_string(index=False))
+            if comparison['regression'].any():
+                print(f"{int(comparison['regression'].sum())} regressions against {args.baseline}")
+                sys.exit(1)
+        return
+
+    storage_results, sizes = bench_storage(args.rows)
+    cleaning_results, peaks = bench_cleaning_memory(args.rows)
+    results = pd.DataFrame(bench_dates(args.rows) + storage_results + cleaning_results + bench_patient_pages(args.rows)
+                           + bench_filters(args.rows) + bench_incremental(args.rows),
+                           columns=['benchmark', 'implementation', 'rows', 'seconds'])
+    print(results.to_string(index=False))
+    print(pd.DataFrame(sizes, columns=['format', 'bytes']).to_string(index=False))
+    print(pd.DataFrame(peaks, columns=['benchmark', 'implementation', 'peak_bytes']).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
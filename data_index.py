@@ -0,0 +1,315 @@
+import numpy as np
+import pandas as pd
+
+# Columns indexed per table, used by the app pages for per-patient slices and by the FilterEngine
+INDEXED_COLUMNS = {
+    'patients': ['Id', 'CITY', 'STATE', 'RACE'],
+    'encounters': ['Id', 'PATIENT', 'PAYER', 'ORGANIZATION', 'ENCOUNTERCLASS'],
+    'procedures': ['PATIENT', 'ENCOUNTER', 'CODE'],
+    'payers': ['Id', 'NAME'],
+    'organizations': ['Id'],
+}
+
+# (parent table, key column, child table, foreign key column), parents listed before their children
+JOINS = [
+    ('payers', 'Id', 'encounters', 'PAYER'),
+    ('organizations', 'Id', 'encounters', 'ORGANIZATION'),
+    ('patients', 'Id', 'encounters', 'PATIENT'),
+    ('patients', 'Id', 'procedures', 'PATIENT'),
+    ('encounters', 'Id', 'procedures', 'ENCOUNTER'),
+]
+TABLE_ORDER = ['payers', 'organizations', 'patients', 'encounters', 'procedures']
+# A predicate whose posting list is this many times larger than the rows left is checked on those rows instead
+PROBE_RATIO = 8
+
+
+class TableIndex:
+    """
+    Row positions of a table grouped by the values of one column.
+    
+    The rows are sorted by key once (stable, so each group keeps the table order) and
+    the start offset of every key is stored. Looking up a key is a hash lookup plus a
+    slice, O(k) in the number of matching rows instead of a scan of the whole column.
+    """
+
+    def __init__(self, df, column):
+        codes, uniques = pd.factorize(df[column])
+        order = np.argsort(codes, kind='stable')
+        n_missing = int((codes == -1).sum())
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+
+        self.column = column
+        self.keys = pd.Index(uniques)
+        self.order = order[n_missing:].astype(np.int32 if len(df) < 2**31 else np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(counts)])
+        # Build the key hash table now rather than on the first lookup
+        self.keys.get_indexer(self.keys[:1])
+
+    def positions(self, key):
+        """
+        Returns the row positions (in table order) whose column equals key.
+        """
+        loc = self.keys.get_indexer([key])[0]
+        if loc == -1:
+            return self.order[:0]
+        return self.order[self.starts[loc]:self.starts[loc + 1]]
+
+    def locate(self, keys):
+        """
+        Returns the group numbers of the keys present in the index.
+        """
+        locs = self.keys.get_indexer(pd.unique(np.asarray(keys)))
+        return locs[locs >= 0]
+
+    def positions_many(self, keys):
+        """
+        Returns the sorted row positions whose column equals any of keys.
+        """
+        return self.group_positions(self.locate(keys))
+
+    def group_positions(self, locs):
+        """
+        Returns the sorted row positions of the groups returned by locate().
+        """
+        starts, ends = self.starts[locs], self.starts[locs + 1]
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            return self.order[:0]
+        # Concatenate the ranges order[start:end] of every key without a Python loop
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.sort(self.order[offsets + np.arange(lengths.sum())])
+
+    def count(self, key):
+        """
+        Returns the number of rows whose column equals key, without touching the rows.
+        """
+        loc = self.keys.get_indexer([key])[0]
+        return 0 if loc == -1 else int(self.starts[loc + 1] - self.starts[loc])
+
+    def group_count(self, locs):
+        """
+        Returns the number of rows of the groups returned by locate(), without touching the rows.
+        """
+        return int((self.starts[locs + 1] - self.starts[locs]).sum())
+
+
+class TableIndexes:
+    """
+    The TableIndex of every column of INDEXED_COLUMNS, built once when the tables are loaded.
+    
+    Parameters:
+    tables (dict): Table name -> DataFrame.
+    indexed_columns (dict, optional): Table name -> columns to index. Defaults to INDEXED_COLUMNS.
+    """
+
+    def __init__(self, tables, indexed_columns=None):
+        indexed_columns = indexed_columns or INDEXED_COLUMNS
+        self.tables = tables
+        self.indexes = {
+            (table, column): TableIndex(tables[table], column)
+            for table, columns in indexed_columns.items() if table in tables
+            for column in columns if column in tables[table].columns
+        }
+        # For every child row of a join, the row position of its parent (len(parent) if there is none)
+        self.join_rows = {}
+        for parent, key_column, child, foreign_key in JOINS:
+            if parent in tables and child in tables and foreign_key in tables[child].columns:
+                parent_rows = pd.Index(tables[parent][key_column]).get_indexer(tables[child][foreign_key])
+                parent_rows[parent_rows == -1] = len(tables[parent])
+                self.join_rows[(parent, child)] = parent_rows.astype(np.int32 if len(tables[parent]) < 2**31 else np.int64)
+
+    def positions(self, table, column, key):
+        return self.indexes[(table, column)].positions(key)
+
+    def rows(self, table, column, key):
+        """
+        Returns the rows of a table whose column equals key, e.g. rows('encounters', 'PATIENT', patient_id).
+        """
+        return self.tables[table].iloc[self.positions(table, column, key)]
+
+    def patient_slices(self, patient_id):
+        """
+        Returns the patient row, encounters and procedures of one patient.
+        """
+        return (self.rows('patients', 'Id', patient_id),
+                self.rows('encounters', 'PATIENT', patient_id),
+                self.rows('procedures', 'PATIENT', patient_id))
+
+
+class PatientDirectory:
+    """
+    Maps patient ids to display names, built once from the patients table.
+    
+    The label of a patient is "FIRST LAST"; patients sharing a name get their id appended
+    ("FIRST LAST (5605b66b)"), so every label selects exactly one patient.
+    
+    Parameters:
+    patients (pd.DataFrame): The patients table with 'Id', 'FIRST' and 'LAST' columns.
+    display_ids (array-like, optional): The ids to show in labels, if 'Id' holds surrogate keys.
+    """
+
+    def __init__(self, patients, display_ids=None):
+        ids = patients['Id'].to_numpy()
+        names = (patients['FIRST'].astype(str) + " " + patients['LAST'].astype(str)).to_numpy(dtype=object)
+        display_ids = pd.Series(ids if display_ids is None else display_ids).astype(str)
+
+        labels = pd.Series(names)
+        duplicated = labels.duplicated(keep=False).to_numpy()
+        labels[duplicated] = labels[duplicated] + " (" + display_ids[duplicated].str[:8] + ")"
+        # Ids sharing their first characters fall back to the full id
+        duplicated = labels.duplicated(keep=False).to_numpy()
+        labels[duplicated] = pd.Series(names)[duplicated] + " (" + display_ids[duplicated] + ")"
+
+        self.ids = ids
+        self.labels = labels.to_numpy(dtype=object)
+        self.positions = pd.Index(ids)
+        # Lower-cased labels sorted once, for prefix search with a binary search
+        lowered = labels.str.lower().to_numpy(dtype=object)
+        self.lowered = lowered
+        self.sorted_order = np.argsort(lowered, kind='stable')
+        self.sorted_lowered = lowered[self.sorted_order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def label(self, patient_id):
+        """
+        Returns the display label of a patient id.
+        """
+        loc = self.positions.get_indexer([patient_id])[0]
+        return None if loc == -1 else self.labels[loc]
+
+    def search(self, query, limit=50):
+        """
+        Returns up to limit patient ids whose label matches query (case-insensitive).
+        Labels starting with query come first, in alphabetical order, then labels containing it.
+        With an empty query, the first labels in alphabetical order are returned.
+        
+        Parameters:
+        query (str): The text to search for.
+        limit (int): The maximum number of ids to return.
+        
+        Returns:
+        list: Patient ids.
+        """
+        query = (query or "").strip().lower()
+        if not query:
+            return self.ids[self.sorted_order[:limit]].tolist()
+
+        start = np.searchsorted(self.sorted_lowered, query, side='left')
+        end = np.searchsorted(self.sorted_lowered, query + '\uffff', side='left')
+        matches = list(self.sorted_order[start:min(end, start + limit)])
+
+        if len(matches) < limit:
+            contains = pd.Series(self.lowered).str.contains(query, regex=False).to_numpy(dtype=bool, copy=True)
+            contains[self.sorted_order[start:end]] = False
+            positions = np.flatnonzero(contains)
+            positions = positions[np.argsort(self.lowered[positions], kind='stable')]
+            matches.extend(positions[:limit - len(matches)])
+        return self.ids[np.asarray(matches, dtype=np.int64)].tolist()
+
+
+class FilterEngine:
+    """
+    Applies a set of equality predicates on the app tables and returns row positions.
+    
+    Every predicate is answered by a posting list (the sorted row positions of a value in a
+    TableIndex). The posting lists of a table are intersected smallest first; once few rows are
+    left, the remaining predicates are checked on those rows directly. The rows kept in a
+    parent table restrict its children through JOINS (patients -> encounters -> procedures,
+    payers/organizations -> encounters), using the posting lists of the parent keys when
+    there are few of them and a bitmap of the parent rows otherwise. No intermediate
+    DataFrame is built.
+    
+    Parameters:
+    indexes (TableIndexes): The indexes of the tables, with the columns used by predicates and joins.
+    """
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    @staticmethod
+    def _is_many(value):
+        return isinstance(value, (list, tuple, set, np.ndarray, pd.Index))
+
+    def _plan(self, table, predicates, positions, sources):
+        """
+        Lists the steps restricting one table with their estimated number of rows, smallest first.
+        A step is ('column', column, value, locs) or ('join', parent, parent_mask, locs).
+        """
+        n_rows = len(self.indexes.tables[table])
+        steps = []
+        for column, value in predicates.get(table, {}).items():
+            index = self.indexes.indexes[(table, column)]
+            locs = index.locate(list(value) if self._is_many(value) else [value])
+            steps.append((index.group_count(locs), 'column', column, value, locs))
+
+        joins = [join for join in JOINS if join[2] == table and positions.get(join[0]) is not None
+                 and (join[0], table) in self.indexes.join_rows]
+        # Parents restricted by more sources (then with fewer rows) first, so redundant joins can be skipped
+        joins.sort(key=lambda join: (-len(sources[join[0]]), len(positions[join[0]])))
+        for parent, key_column, _, foreign_key in joins:
+            if sources[parent] <= sources[table]:
+                # e.g. encounters restricted only by patients, procedures already joined to patients
+                continue
+            sources[table] |= sources[parent]
+            parent_positions = positions[parent]
+            n_parent = len(self.indexes.tables[parent])
+            parent_mask = np.zeros(n_parent + 1, dtype=bool)
+            parent_mask[parent_positions] = True
+            locs = None
+            if len(parent_positions) * PROBE_RATIO < n_rows and (table, foreign_key) in self.indexes.indexes:
+                # Few parents: exact count from the posting lists of their keys
+                index = self.indexes.indexes[(table, foreign_key)]
+                locs = index.locate(self.indexes.tables[parent][key_column].iloc[parent_positions].to_numpy())
+                estimate = index.group_count(locs)
+            else:
+                estimate = n_rows * len(parent_positions) / max(n_parent, 1)
+            steps.append((estimate, 'join', parent, parent_mask, locs))
+        steps.sort(key=lambda step: step[0])
+        return steps
+
+    def _rows(self, table, step):
+        _, kind, name, value, locs = step
+        if kind == 'join' and locs is None:
+            return np.flatnonzero(value[self.indexes.join_rows[(name, table)]])
+        column = name if kind == 'column' else [join[3] for join in JOINS if join[0] == name and join[2] == table][0]
+        return self.indexes.indexes[(table, column)].group_positions(locs)
+
+    def _probe(self, table, step, rows):
+        _, kind, name, value, _ = step
+        if kind == 'join':
+            return rows[value[self.indexes.join_rows[(name, table)][rows]]]
+        values = self.indexes.tables[table][name].iloc[rows]
+        matches = values.isin(list(value)) if self._is_many(value) else values == value
+        return rows[matches.to_numpy(dtype=bool)]
+
+    def run(self, predicates):
+        """
+        Finds the rows of every table matching the predicates.
+        
+        Parameters:
+        predicates (dict): Table name -> {column: value or list of values}, e.g.
+            {'patients': {'CITY': 'BOSTON'}, 'encounters': {'ENCOUNTERCLASS': 'WELLNESS'}, 'payers': {'NAME': 'MEDICARE'}}.
+        
+        Returns:
+        dict: Table name -> sorted row positions, or None when no predicate restricts the table.
+        """
+        positions = {}
+        # The tables whose predicates restrict each table, directly or through joins
+        sources = {}
+        for table in TABLE_ORDER:
+            if table not in self.indexes.tables:
+                continue
+            sources[table] = {table} if predicates.get(table) else set()
+            result = None
+            for step in self._plan(table, predicates, positions, sources):
+                if result is not None and step[0] > PROBE_RATIO * len(result):
+                    result = self._probe(table, step, result)
+                else:
+                    rows = self._rows(table, step)
+                    result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+                if len(result) == 0:
+                    break
+            positions[table] = result
+        return positions
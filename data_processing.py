@@ -1,54 +1,215 @@
 
 import pandas as pd
+import numpy as np
+
+import os
+import io
+import copy
+import json
+import math
+import time
+import codecs
+import hashlib
+import threading
+from datetime import datetime
+from instrumentation import instrument
+
+SNIFF_BYTES = 64 * 1024
+DEFAULT_SEPARATORS = [',', ';', '\t', '|', ':']
+
+# Sniffed (encoding, separator) per file, keyed by (path, size, mtime)
+_format_cache = {}
+
+# Helpers run per file, chunk or table by the pipeline steps, left out of instrument_module so
+# the trace only holds the pipeline steps
+INSTRUMENT_EXCLUDE = ['detect_encoding', 'detect_separator', 'sniff_csv_format', 'memory_usage', 'hash_rows',
+                      'summarize_timings', 'load_incremental_state', 'save_incremental_state']
+
+
+def _count_outside_quotes(line, sep, quotechar='"'):
+    """
+    Counts occurrences of a separator in a line, ignoring quoted sections.
+    """
+    count = 0
+    in_quotes = False
+    for char in line:
+        if char == quotechar:
+            in_quotes = not in_quotes
+        elif char == sep and not in_quotes:
+            count += 1
+    return count
 
-def load_csv_file(file_path, separator=None):
+
+def detect_encoding(sample):
     """
-    Reads a single CSV file with handling for different encodings and separators.
+    Detects the text encoding of a byte sample taken from the start of a file.
     
     Parameters:
-    file_path (str): The path to the CSV file.
-    separator (str, optional): The separator used in the CSV file. If not provided, will prompt the user.
+    sample (bytes): The first bytes of the file.
     
     Returns:
-    pd.DataFrame: The DataFrame containing the CSV data.
+    str: 'utf-8-sig' if the sample starts with a UTF-8 BOM, 'utf-8' if it decodes as UTF-8, otherwise 'latin1'.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        # The sample may cut a multi-byte character in half at its very end
+        if e.reason == 'unexpected end of data' and e.start >= len(sample) - 3:
+            return 'utf-8'
+    # latin1 (ISO-8859-1) maps every byte, so it always decodes
+    return 'latin1'
+
+
+def detect_separator(text, separators=None, truncated=False):
     """
-    encodings = ['utf-8', 'latin1', 'ISO-8859-1']
-    default_separators = [',', ';', '\t', '|', ':']
-    separators = [separator] if separator else default_separators
+    Detects the column separator of a CSV sample.
     
-    for encoding in encodings:
-        for sep in separators:
-            try:
-                df = pd.read_csv(file_path, encoding=encoding, sep=sep)
-                print(f"Successfully read the file with encoding {encoding} and separator '{sep}'")
-                return df
-            except UnicodeDecodeError:
-                continue
-            except pd.errors.ParserError:
-                continue
+    A candidate is scored by how many data lines contain the same number of
+    (unquoted) separators as the header line. The best-scoring candidate wins,
+    ties are broken by the order of the candidates.
     
-    if not separator:
-        # If none of the default combinations work, prompt the user for a separator
-        user_sep = input(f"Could not read the file with common separators. Please provide the separator used in {file_path}: ")
-        
-        for encoding in encodings:
-            try:
-                df = pd.read_csv(file_path, encoding=encoding, sep=user_sep)
-                print(f"Successfully read the file with encoding {encoding} and user-provided separator '{user_sep}'")
-                return df
-            except UnicodeDecodeError:
-                continue
-            except pd.errors.ParserError:
-                continue
+    Parameters:
+    text (str): The decoded sample.
+    separators (list, optional): Candidate separators. Defaults to DEFAULT_SEPARATORS.
+    truncated (bool): Whether the sample was cut before the end of the file (the last line is then dropped).
     
-    # If none of the user-provided combinations work, raise an error
-    raise ValueError(f"Could not read the file {file_path} with provided encodings and separator.")
+    Returns:
+    str or None: The detected separator, or None if no candidate fits the sample.
+    """
+    separators = separators or DEFAULT_SEPARATORS
+    lines = text.splitlines()
+    if truncated and len(lines) > 1:
+        lines = lines[:-1]
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return None
+
+    header, rows = lines[0], lines[1:]
+    best_sep, best_score = None, 0.0
+    for sep in separators:
+        expected = _count_outside_quotes(header, sep)
+        if expected == 0:
+            continue
+        if rows:
+            matching = sum(1 for row in rows if _count_outside_quotes(row, sep) == expected)
+            score = matching / len(rows)
+        else:
+            score = 1.0
+        if score > best_score:
+            best_sep, best_score = sep, score
 
+    if best_sep is None and not any(sep in text for sep in separators):
+        # Single-column file, any separator parses it
+        return ','
+    if best_score < 0.5:
+        return None
+    return best_sep
+
+
+def sniff_csv_format(file_path, sample_bytes=SNIFF_BYTES):
+    """
+    Detects the encoding and separator of a CSV file from a bounded prefix of its bytes.
+    Results are cached per file and invalidated when the file size or modification time changes.
+    
+    Parameters:
+    file_path (str): The path to the CSV file.
+    sample_bytes (int): The maximum number of bytes to read.
+    
+    Returns:
+    tuple: (encoding, separator). The separator is None if it could not be detected.
+    """
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if key in _format_cache:
+        return _format_cache[key]
+
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    encoding = detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+    separator = detect_separator(text, truncated=len(sample) < stat.st_size)
+
+    _format_cache[key] = (encoding, separator)
+    return encoding, separator
+
+
+def _format_cache_update(file_path, encoding, separator):
+    stat = os.stat(file_path)
+    _format_cache[(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)] = (encoding, separator)
+
+
+def _read_csv_chunks(file_path, encoding, sep, detected_sep, chunksize, dtype):
+    """
+    Yields the chunks of a CSV file. Decoding happens while iterating, so non UTF-8 bytes past the
+    sampled prefix fail after earlier chunks were yielded: the file is then reopened as latin1 and
+    read on from the first row not yielded yet. Rows already yielded keep their UTF-8 decoding.
+    """
+    rows = 0
+    try:
+        for chunk in pd.read_csv(file_path, encoding=encoding, sep=sep, chunksize=chunksize, dtype=dtype):
+            rows += len(chunk)
+            yield chunk
+    except UnicodeDecodeError:
+        if encoding == 'latin1':
+            raise
+        print(f"The file {file_path} is not {encoding} past row {rows}, reading the rest with encoding latin1")
+        _format_cache_update(file_path, 'latin1', detected_sep)
+        yield from pd.read_csv(file_path, encoding='latin1', sep=sep, chunksize=chunksize, dtype=dtype,
+                               skiprows=range(1, rows + 1))
+
+
+@instrument
+def load_csv_file(file_path, separator=None, interactive=True, chunksize=None, dtype=None):
+    """
+    Reads a single CSV file, detecting its encoding and separator from a sample of the file.
+    The file itself is parsed only once.
+    
+    Parameters:
+    file_path (str): The path to the CSV file.
+    separator (str, optional): The separator used in the CSV file. If not provided, it is detected.
+    interactive (bool): If True, prompt the user for a separator when it cannot be detected. If False, raise instead.
+    chunksize (int, optional): If given, return an iterator of DataFrames with at most this many rows each.
+    dtype (type or dict, optional): The dtypes to read the columns as, passed to pd.read_csv. Inferred by default.
+    
+    Returns:
+    pd.DataFrame: The DataFrame containing the CSV data (or a chunk iterator if chunksize is given).
+    """
+    encoding, detected_sep = sniff_csv_format(file_path)
+    sep = separator or detected_sep
+
+    if sep is None:
+        if not interactive:
+            raise ValueError(f"Could not detect the separator of the file {file_path}.")
+        sep = input(f"Could not detect the separator. Please provide the separator used in {file_path}: ")
+
+    if chunksize:
+        print(f"Streaming the file with encoding {encoding} and separator '{sep}' in chunks of {chunksize} rows")
+        return _read_csv_chunks(file_path, encoding, sep, detected_sep, chunksize, dtype)
+
+    try:
+        df = pd.read_csv(file_path, encoding=encoding, sep=sep, dtype=dtype)
+    except UnicodeDecodeError:
+        if encoding == 'latin1':
+            raise
+        # Non UTF-8 bytes past the sampled prefix, latin1 always decodes
+        encoding = 'latin1'
+        df = pd.read_csv(file_path, encoding=encoding, sep=sep, dtype=dtype)
+        _format_cache_update(file_path, encoding, detected_sep)
+    except pd.errors.ParserError as e:
+        raise ValueError(f"Could not read the file {file_path} with encoding {encoding} and separator '{sep}': {e}")
+
+    print(f"Successfully read the file with encoding {encoding} and separator '{sep}'")
+    return df
 
 
 
 
 
+
+@instrument
 def display_df_insights(df):
     """
     Displays various insights about a DataFrame.
@@ -56,39 +217,563 @@ def display_df_insights(df):
     Parameters:
     df (pd.DataFrame): The DataFrame to analyze.
     """
+    # One null scan, the other null outputs are derived from its counts
+    null_counts = df.isnull().sum()
     print("Data Types of Columns:\n", df.dtypes)
-    print("\nCount of Null Values in Each Column:\n", df.isnull().sum())
+    print("\nCount of Null Values in Each Column:\n", null_counts)
     print("\nDataFrame Info:")
-    df.info()
-    print("\nAny Null Values in DataFrame: ", df.isnull().values.any())
+    df.info(show_counts=False)
+    print("\nAny Null Values in DataFrame: ", bool(null_counts.any()))
     #print("\nRows with Any Null Values:\n", df[df.isnull().any(axis=1)])
-    print("\nColumns with Any Null Values:\n", df.columns[df.isnull().any()])
+    print("\nColumns with Any Null Values:\n", null_counts.index[null_counts > 0])
 
 
 
 
-def display_unique_values(df, columns):
+@instrument
+def display_unique_values(df, columns, max_values=50):
     """
     Displays the unique values for specified columns in a DataFrame.
     
     Parameters:
     df (pd.DataFrame): The DataFrame to analyze.
     columns (list): The list of columns to get unique values from.
+    max_values (int, optional): The number of values printed per column. None prints all of them.
     """
     for column in columns:
         if column in df.columns:
-            print(f"Unique values in column '{column}':")
-            print(df[column].unique())
+            unique_values = df[column].unique()
+            print(f"Unique values in column '{column}' ({len(unique_values)}):")
+            if max_values is not None and len(unique_values) > max_values:
+                print(unique_values[:max_values])
+                print(f"... and {len(unique_values) - max_values} more")
+            else:
+                print(unique_values)
             print("\n")
         else:
             print(f"Column '{column}' does not exist in the DataFrame.\n")
 
 
 
-def log_issue(logs, table_name, column_name, description):
-    logs.append([table_name, column_name, description])
+############################################### PROFILING ########################################################
+
+# 2**14 one-byte registers per distinct-count sketch, about 0.8% standard error
+HLL_PRECISION = 14
+# Candidates kept by the frequent-values summary, per top value requested
+TOP_K_CAPACITY_FACTOR = 10
+# Error bounds are given at 95% confidence
+CONFIDENCE_Z = 1.96
+
+
+def _mix64(hashes):
+    """
+    Spreads the bits of uint64 hashes (splitmix64 finalizer), as Python hashes of small ints are the ints themselves.
+    """
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def _hash_values(values):
+    """
+    Hashes values (a pandas Index) to uint64. Numbers hash by their float64 value, so 1 and 1.0 read in
+    different chunks are the same value. Other values use Python's hash, which is salted per process.
+    """
+    if pd.api.types.is_bool_dtype(values.dtype):
+        hashes = values.to_numpy(dtype=np.uint64)
+    elif pd.api.types.is_numeric_dtype(values.dtype):
+        hashes = values.to_numpy(dtype=np.float64).view(np.uint64)
+    elif pd.api.types.is_datetime64_any_dtype(values.dtype):
+        hashes = values.as_unit('ns').asi8.view(np.uint64)
+    else:
+        objects = values.to_numpy(dtype=object)
+        hashes = np.fromiter(map(hash, objects), dtype=np.int64, count=len(objects)).view(np.uint64)
+    return _mix64(hashes)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch of the number of distinct values, in 2**precision bytes whatever the number of values.
+    Sketches of chunks of the same column are merged with merge().
+    
+    Parameters:
+    precision (int): log2 of the number of registers. The standard error is 1.04 / sqrt(2**precision).
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+        self.relative_error = 1.04 / math.sqrt(len(self.registers))
+
+    def add_hashes(self, hashes):
+        """
+        Adds uint64 hashes of values to the sketch.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        # Position of the first 1 bit after the index bits, a sentinel bit caps it at 64 - precision + 1
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        high = np.frexp((rest >> np.uint64(32)).astype(np.float64))[1]
+        low = np.frexp((rest & np.uint64(0xFFFFFFFF)).astype(np.float64))[1]
+        bit_length = np.where(high > 0, high + 32, low)
+        np.maximum.at(self.registers, index, (65 - bit_length).astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """
+        Returns the estimated number of distinct values added.
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.exp2(-self.registers.astype(np.float64)).sum()
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+
+class FrequentValues:
+    """
+    Misra-Gries summary of the most frequent values of a column, fed with the value counts of each chunk.
+    
+    With a capacity, at most capacity candidates are kept. A kept count is a lower bound of the true
+    count, which is at most error higher, and every value occurring more than error times is kept.
+    Without a capacity every value is counted exactly.
+    
+    Parameters:
+    capacity (int, optional): The number of candidates kept.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.chunks = []
+        self.error = 0
+
+    def update(self, counts):
+        """
+        Adds the value counts (pd.Series of counts indexed by value) of a chunk.
+        """
+        self.chunks.append(counts)
+        if self.capacity is not None and sum(len(chunk) for chunk in self.chunks) > self.capacity:
+            merged = self.counts
+            if len(merged) > self.capacity:
+                threshold = merged.nlargest(self.capacity + 1).iloc[-1]
+                merged = merged.iloc[merged.to_numpy() > threshold] - threshold
+                self.error += int(threshold)
+            self.chunks = [merged]
+
+    @property
+    def counts(self):
+        """
+        The counts of the kept values, merged across chunks.
+        """
+        if not self.chunks:
+            return pd.Series(dtype=np.int64)
+        if len(self.chunks) > 1:
+            self.chunks = [pd.concat(self.chunks).groupby(level=0, sort=False).sum().astype(np.int64)]
+        return self.chunks[0]
+
+
+class _ColumnStats:
+    """
+    Running statistics of one column, updated chunk by chunk from the value counts of the chunk.
+    """
+
+    def __init__(self, approximate, top_k, precision):
+        self.rows = 0
+        self.nulls = 0
+        self.dtypes = {}
+        self.frequent = FrequentValues(top_k * TOP_K_CAPACITY_FACTOR if approximate else None)
+        self.sketch = HyperLogLog(precision) if approximate else None
+        self.minimum = None
+        self.maximum = None
+        self.total = None
+
+    def update(self, values):
+        # One hashing pass over the column; nulls, distinct values, top values, min, max and mean
+        # are all derived from the (usually much shorter) counts
+        counts = values.value_counts(sort=False, dropna=True)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Unused categories are counted as 0
+            counts = counts.iloc[counts.to_numpy() > 0]
+        self.rows += len(values)
+        self.nulls += len(values) - int(counts.sum())
+        self.dtypes[str(values.dtype)] = True
+        if self.sketch is not None:
+            self.sketch.add_hashes(_hash_values(counts.index))
+        self.frequent.update(counts)
+
+        dtype = values.dtype
+        numeric = pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+        if len(counts) and (numeric or pd.api.types.is_datetime64_any_dtype(dtype)):
+            minimum, maximum = counts.index.min(), counts.index.max()
+            self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+            self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+            if numeric:
+                self.total = (self.total or 0.0) + float(np.dot(counts.index.to_numpy(dtype=np.float64), counts.to_numpy(dtype=np.float64)))
+
+    def result(self, total_rows, top_k):
+        scanned = self.rows
+        scale = total_rows / scanned if scanned else 1.0
+        # Finite population correction of the sampling errors, 0 when every row was scanned
+        correction = (total_rows - scanned) / (total_rows - 1) if total_rows > 1 else 0.0
+
+        null_rate = self.nulls / scanned if scanned else 0.0
+        null_rate_error = 0.0
+        if correction:
+            # Never below the rule of three, so a null rate of 0 in the sample still has a bound
+            null_rate_error = max(CONFIDENCE_Z * math.sqrt(null_rate * (1 - null_rate) * correction / scanned),
+                                  3 * correction / scanned)
+        non_null = scanned - self.nulls
+        max_non_null = total_rows * (1 - max(null_rate - null_rate_error, 0.0))
+
+        counts = self.frequent.counts
+        if correction:
+            # Guaranteed-error estimator (Charikar et al.): values seen once in the sample stand for sqrt(N / n) values
+            seen_once = int((counts == 1).sum())
+            distinct = math.sqrt(scale) * seen_once + len(counts) - seen_once
+            distinct_low = len(counts)
+            distinct_high = max(distinct, min(max_non_null, distinct * math.sqrt(scale)))
+        elif self.sketch is not None:
+            distinct = min(self.sketch.count(), non_null)
+            error = CONFIDENCE_Z * self.sketch.relative_error * distinct
+            distinct_low, distinct_high = max(distinct - error, 0), min(distinct + error, non_null)
+        else:
+            distinct = distinct_low = distinct_high = len(counts)
+
+        top = []
+        for value, count in counts.nlargest(top_k).items():
+            if correction:
+                error = CONFIDENCE_Z * scale * math.sqrt(count * (1 - count / scanned) * correction)
+                top.append((value, count * scale, error))
+            else:
+                # Misra-Gries counts are lower bounds, report the middle of the interval
+                top.append((value, count + self.frequent.error / 2, self.frequent.error / 2))
+
+        return {
+            'dtype': ' / '.join(self.dtypes), 'rows': total_rows,
+            'nulls': round(null_rate * total_rows), 'null_rate': null_rate, 'null_rate_error': null_rate_error,
+            'distinct': round(distinct), 'distinct_low': round(distinct_low), 'distinct_high': round(distinct_high),
+            'min': self.minimum, 'max': self.maximum, 'mean': self.total / non_null if self.total is not None else None,
+            'top': top,
+        }
+
+
+class DataProfile:
+    """
+    Column statistics of a table, returned by profile_df and profile_csv.
+    
+    to_frame() has one row per column with its dtype, null count and rate, distinct count, min, max,
+    mean and most frequent values. Estimates come with 95% bounds: null_rate_error, distinct_low /
+    distinct_high, and the error of each top value count.
+    
+    Parameters:
+    columns (dict): The statistics dict of each column.
+    rows (int): The number of rows of the table.
+    scanned_rows (int): The number of rows read, fewer than rows when the table was sampled.
+    mode (str): 'exact', 'approximate' or 'sampled'.
+    """
+
+    def __init__(self, columns, rows, scanned_rows, mode):
+        self.columns = columns
+        self.rows = rows
+        self.scanned_rows = scanned_rows
+        self.mode = mode
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __repr__(self):
+        return f"DataProfile({self.mode}, {self.rows} rows, {self.scanned_rows} scanned)\n{self.to_frame().to_string()}"
+
+    def to_frame(self):
+        """
+        Returns the statistics as a DataFrame indexed by column name, with the top values as (value, count) lists.
+        """
+        rows = []
+        for column, stats in self.columns.items():
+            row = {key: value for key, value in stats.items() if key != 'top'}
+            row['top'] = [(value, round(count)) for value, count, error in stats['top']]
+            rows.append(row)
+        return pd.DataFrame(rows, index=pd.Index(list(self.columns), name='column'))
+
+    def top_values(self, column):
+        """
+        Returns the most frequent values of a column with their estimated count and its error.
+        """
+        return pd.DataFrame(self.columns[column]['top'], columns=['value', 'count', 'error'])
+
+
+class DataProfiler:
+    """
+    Computes the column statistics of a table in one pass over its chunks.
+    
+    Each column is counted once per chunk (value_counts); nulls, distinct and top values, min, max
+    and mean all come from these counts.
+    
+    Parameters:
+    top_k (int): The number of most frequent values kept per column.
+    approximate (bool): If True, memory stays bounded: distinct values are counted with a HyperLogLog
+        sketch and frequent values with a Misra-Gries summary. Otherwise all distinct values are kept.
+    precision (int): The HyperLogLog precision.
+    """
+
+    def __init__(self, top_k=10, approximate=False, precision=HLL_PRECISION):
+        self.top_k = top_k
+        self.approximate = approximate
+        self.precision = precision
+        self.columns = {}
+
+    def update(self, df):
+        """
+        Adds a chunk of the table.
+        """
+        for column in df.columns:
+            if column not in self.columns:
+                self.columns[column] = _ColumnStats(self.approximate, self.top_k, self.precision)
+            self.columns[column].update(df[column])
+        return self
+
+    def result(self, total_rows=None):
+        """
+        Returns the DataProfile of the chunks added.
+        
+        Parameters:
+        total_rows (int, optional): The number of rows of the table, when the chunks are a sample of it.
+        """
+        scanned = max((stats.rows for stats in self.columns.values()), default=0)
+        total_rows = max(total_rows or scanned, scanned)
+        mode = 'sampled' if total_rows > scanned else 'approximate' if self.approximate else 'exact'
+        columns = {column: stats.result(round(total_rows * stats.rows / scanned) if scanned else 0, self.top_k)
+                   for column, stats in self.columns.items()}
+        return DataProfile(columns, total_rows, scanned, mode)
+
+
+@instrument
+def profile_df(df, columns=None, top_k=10, approximate=False, sample_size=None, seed=0):
+    """
+    Profiles the columns of a DataFrame in one pass.
+    
+    Parameters:
+    df (pd.DataFrame): The DataFrame to profile.
+    columns (list, optional): The columns to profile. Defaults to all columns.
+    top_k (int): The number of most frequent values kept per column.
+    approximate (bool): Whether to use bounded-memory sketches (see DataProfiler).
+    sample_size (int, optional): If the DataFrame has more rows, profile a uniform random sample of
+        this many rows and extrapolate, with error bounds. Distinct counts of a sample are rough.
+    seed (int): The seed of the sample.
+    
+    Returns:
+    DataProfile: The column statistics.
+    """
+    if columns is not None:
+        df = df[columns]
+    total_rows = len(df)
+    if sample_size is not None and total_rows > sample_size:
+        positions = np.sort(np.random.default_rng(seed).choice(total_rows, sample_size, replace=False))
+        # The sample is small, its values are counted exactly
+        return DataProfiler(top_k).update(df.take(positions)).result(total_rows)
+    return DataProfiler(top_k, approximate).update(df).result()
+
+
+@instrument
+def profile_csv(file_path, chunksize=100_000, top_k=10, approximate=True, separator=None):
+    """
+    Profiles a CSV file chunk by chunk, so files larger than memory can be profiled.
+    
+    Parameters:
+    file_path (str): The path to the CSV file.
+    chunksize (int): The number of rows per chunk.
+    top_k (int): The number of most frequent values kept per column.
+    approximate (bool): Whether to use bounded-memory sketches (see DataProfiler).
+    separator (str, optional): The separator used in the CSV file. If not provided, it is detected.
+    
+    Returns:
+    DataProfile: The column statistics.
+    """
+    profiler = DataProfiler(top_k, approximate)
+    for chunk in load_csv_file(file_path, separator, interactive=False, chunksize=chunksize):
+        profiler.update(chunk)
+    return profiler.result()
+
+
+
+############################################### ANOMALY LOG ########################################################
+
+ANOMALY_SAMPLE_SIZE = 5
+# Offending values handed to the reservoir per log call, the first distinct ones
+ANOMALY_SAMPLE_CANDIDATES = 1000
+
+
+class AnomalyLog:
+    """
+    Collects data anomalies aggregated per (table, column, rule), as a drop-in for the logs list.
+    
+    Each rule keeps the number of log calls, the number of affected rows, the time spent and a
+    reservoir sample of offending values, so memory depends on the number of rules, not of rows.
+    Iterating yields [table, column, description] rows like the logs list, so
+    pd.DataFrame(logs, columns=['Table Name', 'Column Name', 'Description']) keeps working.
+    Recording is thread-safe; worker processes fill their own log, merged back with extend().
+    
+    Parameters:
+    sample_size (int): The maximum number of sample values kept per rule.
+    seed (int): The seed of the reservoir sampling.
+    """
+
+    def __init__(self, sample_size=ANOMALY_SAMPLE_SIZE, seed=0):
+        self.sample_size = sample_size
+        self.entries = {}
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for (table_name, column_name, rule), entry in list(self.entries.items()):
+            description = rule if entry['count'] is None else f"{rule}: {entry['count']} values"
+            yield [table_name, column_name, description]
+
+    def _entry(self, key):
+        if key not in self.entries:
+            self.entries[key] = {'events': 0, 'count': None, 'seconds': 0.0, 'samples': [], 'seen': 0}
+        return self.entries[key]
+
+    def _sample(self, entry, values):
+        """
+        Adds values to the reservoir of an entry (algorithm R, with the draws vectorized).
+        """
+        values = list(values)
+        samples = entry['samples']
+        free = max(self.sample_size - len(samples), 0)
+        samples.extend(values[:free])
+        rest = values[free:]
+        if rest:
+            # The value at position p (counting every value seen) takes a random slot with probability sample_size / (p + 1)
+            slots = self.rng.integers(0, entry['seen'] + free + 1 + np.arange(len(rest)))
+            for i in np.flatnonzero(slots < self.sample_size):
+                samples[slots[i]] = rest[i]
+        entry['seen'] += len(values)
+
+    def _merge_samples(self, entry, other):
+        pool = entry['samples'] + other['samples']
+        if len(pool) <= self.sample_size:
+            return pool
+        # Each kept value stands for seen / len(samples) values of its side
+        weights = np.array([entry['seen'] / len(entry['samples'])] * len(entry['samples'])
+                           + [other['seen'] / len(other['samples'])] * len(other['samples']))
+        picked = self.rng.choice(len(pool), self.sample_size, replace=False, p=weights / weights.sum())
+        return [pool[i] for i in sorted(picked)]
+
+    def record(self, table_name, column_name, rule, count=None, samples=None, seconds=0.0):
+        """
+        Records one occurrence of a rule.
+        
+        Parameters:
+        table_name (str): The name of the table.
+        column_name (str): The name of the column.
+        rule (str): The description of the anomaly or action, without counts.
+        count (int, optional): The number of rows affected.
+        samples (array-like, optional): Offending values, only a bounded sample is kept.
+        seconds (float): The time spent applying the rule.
+        """
+        with self.lock:
+            entry = self._entry((table_name, column_name, rule))
+            entry['events'] += 1
+            if count is not None:
+                entry['count'] = (entry['count'] or 0) + int(count)
+            entry['seconds'] += seconds
+            if samples is not None and self.sample_size:
+                self._sample(entry, samples)
+
+    def extend(self, other):
+        """
+        Adds the records of another AnomalyLog (e.g. from a worker process) or of a logs list.
+        """
+        if not isinstance(other, AnomalyLog):
+            for table_name, column_name, description in other:
+                self.record(table_name, column_name, description)
+            return
+        with self.lock:
+            for key, new in other.entries.items():
+                entry = self._entry(key)
+                entry['events'] += new['events']
+                if new['count'] is not None:
+                    entry['count'] = (entry['count'] or 0) + new['count']
+                entry['seconds'] += new['seconds']
+                entry['samples'] = self._merge_samples(entry, new)
+                entry['seen'] += new['seen']
+
+    def to_frame(self):
+        """
+        Returns the log as a DataFrame with one row per (table, column, rule).
+        """
+        rows = [(table_name, column_name, rule, entry['count'], entry['events'], entry['seconds'],
+                 [str(value) for value in entry['samples']])
+                for (table_name, column_name, rule), entry in list(self.entries.items())]
+        df = pd.DataFrame(rows, columns=['table', 'column', 'rule', 'count', 'events', 'seconds', 'samples'])
+        df['count'] = df['count'].astype('Int64')
+        return df
+
+    def save(self, file_path):
+        """
+        Saves the log to a Parquet file, or to a CSV file if file_path does not end with '.parquet'.
+        
+        Parameters:
+        file_path (str): The path where the log will be saved.
+        """
+        df = self.to_frame()
+        if file_path.endswith('.parquet'):
+            df.to_parquet(file_path, index=False)
+        else:
+            df.assign(samples=df['samples'].map(' | '.join)).to_csv(file_path, index=False)
+        print(f"Anomaly log saved to {file_path} successfully.")
+
+
+def _offending_values(values, mask):
+    """
+    Returns the first distinct values of values where mask is True, as sample candidates.
+    """
+    return pd.unique(np.asarray(values)[np.asarray(mask, dtype=bool)])[:ANOMALY_SAMPLE_CANDIDATES]
+
+
+def log_issue(logs, table_name, column_name, description, count=None, samples=None, seconds=0.0):
+    """
+    Logs an anomaly or cleaning action.
+    
+    With an AnomalyLog, the record is aggregated with the others of the same rule. With a plain
+    list, [table_name, column_name, description] is appended, with ': N values' added when count is given.
+    
+    Parameters:
+    logs (list or AnomalyLog): Where to log.
+    table_name (str): The name of the table.
+    column_name (str): The name of the column.
+    description (str): The description of the anomaly or action.
+    count (int, optional): The number of rows affected.
+    samples (array-like, optional): Offending values.
+    seconds (float): The time spent.
+    """
+    if isinstance(logs, AnomalyLog):
+        logs.record(table_name, column_name, description, count, samples, seconds)
+    else:
+        logs.append([table_name, column_name, description if count is None else f'{description}: {count} values'])
 ################################################################# CONVERT TO STUFF #####################################
 
+@instrument
 def convert_columns_to_int(df, columns, table_name, logs):
     """
     Converts specified columns to integer type and logs the action.
@@ -105,8 +790,15 @@ def convert_columns_to_int(df, columns, table_name, logs):
     for column in columns:
         if column in df.columns:
             try:
-                df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0).astype(int)
-                log_issue(logs, table_name, column, 'Should be Converted to integer')
+                started = time.perf_counter()
+                original = df[column]
+                numeric = pd.to_numeric(original, errors='coerce')
+                missing = numeric.isna()
+                df[column] = numeric.fillna(0).astype(int)
+                log_issue(logs, table_name, column, 'Should be Converted to integer', seconds=time.perf_counter() - started)
+                if missing.any():
+                    log_issue(logs, table_name, column, 'Missing or non-integer values replaced with 0', count=int(missing.sum()),
+                              samples=_offending_values(original, missing & original.notna()))
             except Exception as e:
                 log_issue(logs, table_name, column, f'Error converting to integer: {e}')
         else:
@@ -114,6 +806,7 @@ def convert_columns_to_int(df, columns, table_name, logs):
     
     return df
 
+@instrument
 def convert_column_to_float(df, column_name, table_name, logs):
     """
     Converts a column to float and logs the action.
@@ -128,16 +821,21 @@ def convert_column_to_float(df, column_name, table_name, logs):
     pd.DataFrame: The modified DataFrame.
     """
     if column_name in df.columns:
-        df[column_name] = pd.to_numeric(df[column_name], errors='coerce').astype(float)
-        log_issue(logs, table_name, column_name, 'Object type should be Converted to float')
+        started = time.perf_counter()
+        original = df[column_name]
+        df[column_name] = pd.to_numeric(original, errors='coerce').astype(float)
+        log_issue(logs, table_name, column_name, 'Object type should be Converted to float', seconds=time.perf_counter() - started)
+        failed = df[column_name].isna() & original.notna()
+        if failed.any():
+            log_issue(logs, table_name, column_name, 'Values could not be converted to float', count=int(failed.sum()),
+                      samples=_offending_values(original, failed))
     else:
         log_issue(logs, table_name, column_name, 'Column does not exist in the DataFrame')
     return df
 
 ##################### DATE TRANSFORMING STUFF ########################################################################
 
-from datetime import datetime
-
+@instrument
 def convert_to_date(df, column_name, table_name, logs=None):
     """
     Converts a column to datetime format with error handling and logging.
@@ -155,8 +853,14 @@ def convert_to_date(df, column_name, table_name, logs=None):
         logs = []
     
     try:
-        df[column_name] = pd.to_datetime(df[column_name], format='%Y-%m-%d', errors='coerce')
-        log_issue(logs, table_name, column_name, 'should be converted to datetime format.')
+        started = time.perf_counter()
+        original = df[column_name]
+        df[column_name] = pd.to_datetime(original, format='%Y-%m-%d', errors='coerce')
+        log_issue(logs, table_name, column_name, 'should be converted to datetime format.', seconds=time.perf_counter() - started)
+        failed = df[column_name].isna() & original.notna()
+        if failed.any():
+            log_issue(logs, table_name, column_name, 'Values could not be converted to datetime', count=int(failed.sum()),
+                      samples=_offending_values(original, failed))
     except Exception as e:
         log_issue(logs, table_name, column_name, f'Error converting to datetime format: {str(e)}')
     
@@ -164,9 +868,95 @@ def convert_to_date(df, column_name, table_name, logs=None):
 
 
 
+def _factorize_strings(series):
+    """
+    Factorizes a Series and returns (row codes, unique values as strings).
+    Missing values get the code -1, so string work only runs once per distinct value.
+    """
+    codes, uniques = pd.factorize(series)
+    return codes, pd.Series(uniques, dtype=object).astype(str)
+
+
+def _parse_dates(values, date_format, errors='coerce'):
+    """
+    pd.to_datetime with a fast path for formats ending in a literal 'Z' (UTC marker):
+    the marker is stripped so pandas can use its ISO 8601 parser.
+    Values already parsed (a re-run, or a table loaded from Parquet) are returned unchanged, and
+    columns that are not strings (e.g. an all-empty chunk read as float) go to pd.to_datetime as they are.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if (pd.api.types.is_string_dtype(values.dtype) and date_format.endswith('Z')
+            and not date_format.endswith('%Z')):
+        values = values.str.removesuffix('Z')
+        date_format = date_format[:-1]
+    return pd.to_datetime(values, format=date_format, errors=errors)
+
+
+@instrument
+def normalize_date_column(df, column_name, table_name, logs, date_format='%Y-%m-%d', century_prefix=None):
+    """
+    Converts a column of date strings to datetime in bulk, fixing the known malformed variants first.
+    
+    - pipe-delimited dates ('1977|03-19', '2011|02-16T02:45:15Z') have '|' replaced by '-'
+    - with century_prefix set, 3-digit years ('943|03-19') get the prefix ('1943-03-19')
+    
+    Every distinct value is fixed and parsed once. The conversion is logged once per column, with
+    the number of fixed values and of values that could not be parsed (they become NaT) as
+    separate records.
+    
+    Parameters:
+    df (pd.DataFrame): The DataFrame to modify.
+    column_name (str): The name of the column containing date strings.
+    table_name (str): The name of the table being processed.
+    logs (list): The list to log actions.
+    date_format (str): The format of the dates once fixed.
+    century_prefix (str, optional): The digit(s) to put in front of 3-digit years, e.g. '1'.
+    
+    Returns:
+    pd.DataFrame: The modified DataFrame.
+    """
+    if column_name not in df.columns:
+        log_issue(logs, table_name, column_name, 'Column does not exist in the DataFrame')
+        return df
+    if pd.api.types.is_datetime64_any_dtype(df[column_name]):
+        # Already converted, e.g. a re-run or a table loaded from Parquet
+        return df
+
+    started = time.perf_counter()
+    codes, values = _factorize_strings(df[column_name])
+    original = values
+    fixed = values.str.contains('|', regex=False)
+    values = values.str.replace('|', '-', regex=False)
+    if century_prefix:
+        short_year = values.str.match(r'^\d{3}-')
+        values = values.where(~short_year, century_prefix + values)
+        fixed |= short_year
+    parsed = _parse_dates(values, date_format)
+
+    counts = np.bincount(codes[codes >= 0], minlength=len(values))
+    n_fixed = int(counts[fixed.to_numpy()].sum())
+    n_failed = int(counts[parsed.isna().to_numpy()].sum())
+
+    result = parsed.to_numpy()[codes]
+    result[codes == -1] = np.datetime64('NaT')
+    df[column_name] = pd.Series(result, index=df.index)
+    log_issue(logs, table_name, column_name, 'Object type should be Converted to datetime', seconds=time.perf_counter() - started)
+    if n_fixed:
+        log_issue(logs, table_name, column_name, 'Malformed dates fixed', count=n_fixed,
+                  samples=original[fixed.to_numpy()].to_numpy()[:ANOMALY_SAMPLE_CANDIDATES])
+    if n_failed:
+        log_issue(logs, table_name, column_name, 'Values could not be converted to datetime', count=n_failed,
+                  samples=original[parsed.isna().to_numpy()].to_numpy()[:ANOMALY_SAMPLE_CANDIDATES])
+    return df
+
+
+@instrument
 def convert_date_format(df, column_name, table_name, logs=None):
     """
     Converts a column containing custom date strings to 'YYYY-MM-DD' format with error handling and logging.
+    Values such as '1977|03-19' are split on '|' and '-' in bulk; values that do not match become NaT.
+    The number of converted values and of values that failed are logged, with samples of the failures.
     
     Parameters:
     df (pd.DataFrame): The DataFrame to modify.
@@ -179,25 +969,27 @@ def convert_date_format(df, column_name, table_name, logs=None):
     """
     if logs is None:
         logs = []
-    
-    def convert_string_to_date(date_str):
-        try:
-            # Split the string by '|' and '-' to extract year, month, and day
-            parts = date_str.split('|')
-            year = parts[0]
-            month_day = parts[1].split('-')
-            month = month_day[0]
-            day = month_day[1]
-            
-            # Construct the date in 'YYYY-MM-DD' format
-            formatted_date = f'{year}-{month}-{day}'
-            log_issue(logs, table_name, column_name, f'should be converted to datetime format')
-            return formatted_date
-        except Exception as e:
-            log_issue(logs, table_name, column_name, f'Error converting date string {date_str}: {str(e)}')
-            return pd.NaT
-    
-    df[column_name] = df[column_name].apply(convert_string_to_date)
+
+    started = time.perf_counter()
+    codes, values = _factorize_strings(df[column_name])
+    # year|month-day, anything after a second '|' or '-' is ignored
+    parts = values.str.extract(r'^([^|]*)\|([^|\-]*)-([^|\-]*)')
+    formatted = (parts[0] + '-' + parts[1] + '-' + parts[2]).astype(object)
+    formatted = formatted.where(formatted.notna(), pd.NaT)
+
+    counts = np.bincount(codes[codes >= 0], minlength=len(values))
+    failed = formatted.isna().to_numpy()
+    n_failed = int(counts[failed].sum() + (codes == -1).sum())
+    n_converted = len(codes) - n_failed
+
+    result = formatted.to_numpy()[codes]
+    result[codes == -1] = pd.NaT
+    df[column_name] = pd.Series(result, index=df.index, dtype=object)
+    log_issue(logs, table_name, column_name, 'should be converted to datetime format', count=n_converted,
+              seconds=time.perf_counter() - started)
+    if n_failed:
+        log_issue(logs, table_name, column_name, 'Values could not be converted to datetime', count=n_failed,
+                  samples=values[failed].to_numpy()[:ANOMALY_SAMPLE_CANDIDATES])
     return df
 
 
@@ -207,46 +999,99 @@ def convert_string_to_date(date_str):
     return datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%SZ')
 
 # Function to convert a column to datetime
+@instrument
 def convert_column_to_date(df, column_name, table_name, logs):
     if column_name in df.columns:
         try:
-            df[column_name] = pd.to_datetime(df[column_name], format='%Y-%m-%dT%H:%M:%SZ')
-            log_issue(logs, table_name, column_name, 'Object type should be Converted to datetime')
-        except Exception as e:
-            df[column_name] = df[column_name].apply(convert_string_to_date)
-            log_issue(logs, table_name, column_name, 'Object type should be Converted to datetime')
+            started = time.perf_counter()
+            df[column_name] = _parse_dates(df[column_name], '%Y-%m-%dT%H:%M:%SZ', errors='raise')
+            log_issue(logs, table_name, column_name, 'Object type should be Converted to datetime',
+                      seconds=time.perf_counter() - started)
+        except (ValueError, TypeError):
+            # Some values are pipe-delimited, fix and parse them in bulk
+            df = normalize_date_column(df, column_name, table_name, logs, date_format='%Y-%m-%dT%H:%M:%SZ')
     else:
         log_issue(logs, table_name, column_name, 'Column does not exist in the DataFrame')
     return df
 
 ###############################################THE END OF DATE STUFF ########################################################
 
-def preprocess_columns(df, columns):
+# Arrow-backed strings, missing values stay missing
+ARROW_STRING_DTYPE = pd.StringDtype('pyarrow')
+
+
+def as_arrow_strings(values):
+    """
+    Returns a Series of strings as Arrow-backed strings, without a copy when it already is one.
+    Missing values stay missing, where astype(str) on older pandas turns them into 'nan'.
+    
+    Parameters:
+    values (pd.Series): The values to convert.
+    
+    Returns:
+    pd.Series: The Arrow-backed strings.
+    """
+    if isinstance(values.dtype, pd.StringDtype) and values.dtype.storage == 'pyarrow':
+        return values
+    return values.astype(ARROW_STRING_DTYPE)
+
+
+def normalize_strings(values):
+    """
+    Strips whitespace and converts to uppercase with Arrow string kernels, keeping missing values missing.
+    Columns of numbers, dates or booleans have nothing to normalize and are returned unchanged.
+    
+    Parameters:
+    values (pd.Series): The values to normalize.
+    
+    Returns:
+    pd.Series: The normalized values.
+    """
+    if not (pd.api.types.is_object_dtype(values.dtype) or isinstance(values.dtype, pd.StringDtype)):
+        return values
+    return as_arrow_strings(values).str.strip().str.upper()
+
+
+@instrument
+def preprocess_columns(df, columns=None, seen_keys=None, keep_nulls=False):
     """
     Strips whitespace, converts to uppercase for specified columns in a DataFrame, and removes duplicates.
     
     Parameters:
     df (pd.DataFrame): The DataFrame to preprocess.
-    columns (list): The list of columns to preprocess.
+    columns (list, optional): The list of columns to preprocess. Defaults to all columns.
+    seen_keys (HashKeySet, optional): Keys of rows already kept from previous chunks. When given,
+        rows duplicating an earlier chunk are removed too and the set is updated.
+    keep_nulls (bool): If True, normalize string columns as Arrow strings with normalize_strings:
+        missing values stay missing (no 'NAN' strings to replace afterwards), other columns keep
+        their type and no object-string copies are made.
     
     Returns:
     pd.DataFrame: The preprocessed DataFrame.
     """
+    if columns is None:
+        columns = df.columns.tolist()
     for column in columns:
         if column in df.columns:
-            # Strip whitespace and convert to uppercase
-            df[column] = df[column].astype(str).str.strip().str.upper()
+            if keep_nulls:
+                df[column] = normalize_strings(df[column])
+            else:
+                # Strip whitespace and convert to uppercase
+                df[column] = df[column].astype(str).str.strip().str.upper()
         else:
             print(f"Column '{column}' does not exist in the DataFrame.\n")
     
     # Remove duplicates
-    df = df.drop_duplicates(subset=columns)
+    if seen_keys is None:
+        df = df.drop_duplicates(subset=columns)
+    else:
+        subset = [column for column in columns if column in df.columns]
+        df = df[seen_keys.add_new(hash_rows(df, subset))]
     
     return df
 
 
-import numpy as np
-
+@instrument
 def replace_value_with_nan(df, column, value_to_replace):
     """
     Replaces a specific value in a specified column with NaN.
@@ -267,6 +1112,7 @@ def replace_value_with_nan(df, column, value_to_replace):
     return df
 
 
+@instrument
 def replace_nan_with_value(df, columns, table_name, logs, replacement_value="VALUE NOT PROVIDED"):
     """
     Replaces NaN values in specified columns with a given value and logs the action.
@@ -283,14 +1129,18 @@ def replace_nan_with_value(df, columns, table_name, logs, replacement_value="VAL
     """
     for column in columns:
         if column in df.columns:
+            started = time.perf_counter()
+            n_missing = int(df[column].isna().sum())
             df[column] = df[column].fillna(replacement_value)
-            log_issue(logs, table_name, column, f'NaN values should be replaced with "{replacement_value}"')
+            log_issue(logs, table_name, column, f'NaN values should be replaced with "{replacement_value}"', count=n_missing,
+                      seconds=time.perf_counter() - started)
         else:
             log_issue(logs, table_name, column, 'Column does not exist in the DataFrame')
     
     return df
 
 
+@instrument
 def replace_nan_in_numeric_columns(df, table_name, logs):
     """
     Replaces NaN values in all numerical columns of a DataFrame with 0 and logs the action.
@@ -304,16 +1154,18 @@ def replace_nan_in_numeric_columns(df, table_name, logs):
     pd.DataFrame: The DataFrame with NaN values replaced by 0 in numerical columns.
     """
     numeric_columns = df.select_dtypes(include=[np.number]).columns
+    n_missing = df[numeric_columns].isna().sum()
     df[numeric_columns] = df[numeric_columns].fillna(0)
     
     for column in numeric_columns:
-        log_issue(logs, table_name, column, 'NaN values should be replaced with 0')
+        log_issue(logs, table_name, column, 'NaN values should be replaced with 0', count=int(n_missing[column]))
     
     return df
 
 
 
 
+@instrument
 def save_df_to_csv(df, file_path):
     """
     Saves a DataFrame to a CSV file.
@@ -330,3 +1182,901 @@ def save_df_to_csv(df, file_path):
         print(f"DataFrame saved to {file_path} successfully.")
     except Exception as e:
         print(f"An error occurred while saving the DataFrame to CSV: {e}")
+
+
+############################################### PARQUET ########################################################
+
+# Low-cardinality columns stored dictionary-encoded (as pandas categoricals)
+DICTIONARY_COLUMNS = ['ENCOUNTERCLASS', 'RACE', 'ETHNICITY', 'GENDER', 'MARITAL', 'STATE', 'COUNTY', 'CITY',
+                      'PREFIX', 'SUFFIX', 'STATE_HEADQUARTERED']
+ROW_GROUP_SIZE = 100_000
+
+
+@instrument
+def save_df_to_parquet(df, file_path, dictionary_columns=None, sort_by=None, row_group_size=ROW_GROUP_SIZE):
+    """
+    Saves a DataFrame to a Parquet file, keeping the cleaned dtypes (datetimes, floats, ints).
+    Low-cardinality columns are stored dictionary-encoded and read back as categoricals.
+    
+    Parameters:
+    df (pd.DataFrame): The DataFrame to save.
+    file_path (str): The path where the Parquet file will be saved.
+    dictionary_columns (list, optional): Columns to dictionary-encode. Defaults to DICTIONARY_COLUMNS.
+    sort_by (str or list, optional): Columns to sort by before writing, so that row-group
+        statistics on them are tight and filters on them skip most row groups (e.g. 'START').
+    row_group_size (int): The number of rows per row group.
+    
+    Returns:
+    None
+    """
+    dictionary_columns = DICTIONARY_COLUMNS if dictionary_columns is None else dictionary_columns
+    df = df.copy(deep=False)
+    for column in dictionary_columns:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    if sort_by:
+        df = df.sort_values(sort_by, kind='stable')
+    try:
+        df.to_parquet(file_path, index=False, row_group_size=row_group_size)
+        print(f"DataFrame saved to {file_path} successfully.")
+    except Exception as e:
+        print(f"An error occurred while saving the DataFrame to Parquet: {e}")
+
+
+@instrument
+def load_parquet_file(file_path, columns=None, filters=None):
+    """
+    Reads a Parquet file written by save_df_to_parquet.
+    
+    Parameters:
+    file_path (str): The path to the Parquet file.
+    columns (list, optional): Only read these columns.
+    filters (list, optional): Row filters as (column, op, value) tuples, e.g. [('START', '>=', pd.Timestamp('2020-01-01'))].
+        Row groups whose statistics exclude the filter are not read at all.
+    
+    Returns:
+    pd.DataFrame: The DataFrame with its saved dtypes.
+    """
+    return pd.read_parquet(file_path, columns=columns, filters=filters)
+
+
+@instrument
+def load_cleaned_table(file_path, columns=None, filters=None):
+    """
+    Loads a cleaned table, preferring the Parquet file next to a CSV path when it exists.
+    
+    Parameters:
+    file_path (str): The path to the cleaned CSV or Parquet file, e.g. 'encounters_cleaned.csv'.
+    columns (list, optional): Only read these columns.
+    filters (list, optional): Row filters, only applied when reading Parquet.
+    
+    Returns:
+    pd.DataFrame: The cleaned table.
+    """
+    parquet_path = os.path.splitext(file_path)[0] + '.parquet'
+    if os.path.exists(parquet_path):
+        return load_parquet_file(parquet_path, columns=columns, filters=filters)
+    return pd.read_csv(file_path, usecols=columns)
+
+
+############################################### COMPACT TABLES ########################################################
+
+# UUID key columns sharing one key space: the first (table, column) is the primary key
+KEY_DOMAINS = {
+    'patient': [('patients', 'Id'), ('encounters', 'PATIENT'), ('procedures', 'PATIENT')],
+    'payer': [('payers', 'Id'), ('encounters', 'PAYER')],
+    'organization': [('organizations', 'Id'), ('encounters', 'ORGANIZATION')],
+    'encounter': [('encounters', 'Id'), ('procedures', 'ENCOUNTER')],
+}
+CATEGORY_MAX_RATIO = 0.5
+
+
+class KeyLookup:
+    """
+    Maps UUID keys to int32 surrogate keys, one key space per domain of KEY_DOMAINS.
+    
+    Keys of the primary table come first in their row order, so the surrogate key of a
+    patient is also its row position in the patients table. Missing keys are -1.
+    """
+
+    def __init__(self):
+        self.keys = {}
+
+    def domain_of(self, table_name, column):
+        for domain, columns in KEY_DOMAINS.items():
+            if (table_name, column) in columns:
+                return domain
+        return None
+
+    def encode(self, domain, values):
+        return self.keys[domain].get_indexer(values).astype(np.int32)
+
+    def decode(self, domain, codes):
+        codes = np.asarray(codes)
+        decoded = self.keys[domain].to_numpy(dtype=object)[codes].copy() if len(codes) else np.array([], dtype=object)
+        decoded[codes == -1] = np.nan
+        return decoded
+
+    def decode_frame(self, df, table_name):
+        """
+        Returns a copy of df with its surrogate key columns replaced by the original keys, for display.
+        """
+        df = df.copy()
+        for column in df.columns:
+            domain = self.domain_of(table_name, column)
+            if domain in self.keys:
+                df[column] = self.decode(domain, df[column].to_numpy())
+        return df
+
+
+def memory_usage(df):
+    """
+    Returns the memory used by a DataFrame in bytes, including the contents of object columns.
+    """
+    return int(df.memory_usage(deep=True).sum())
+
+
+@instrument
+def compact_tables(tables, max_category_ratio=CATEGORY_MAX_RATIO):
+    """
+    Reduces the memory used by the cleaned tables.
+    
+    - UUID key columns (see KEY_DOMAINS) are replaced by int32 surrogate keys, shared between
+      tables, so relationships such as encounters -> patients are integer arrays.
+    - Other string columns with few distinct values (at most max_category_ratio of the rows)
+      become categoricals.
+    
+    Parameters:
+    tables (dict): Table name -> DataFrame, e.g. {'patients': patients, 'encounters': encounters}.
+    max_category_ratio (float): The maximum ratio of distinct values to rows for a categorical column.
+    
+    Returns:
+    tuple: (dict of compact DataFrames, KeyLookup, pd.DataFrame with the memory per table before and after in bytes).
+    """
+    lookup = KeyLookup()
+    before = {name: memory_usage(df) for name, df in tables.items()}
+    tables = {name: df.copy() for name, df in tables.items()}
+
+    for domain, columns in KEY_DOMAINS.items():
+        present = [(table, column) for table, column in columns if table in tables and column in tables[table].columns]
+        if not present:
+            continue
+        values = np.concatenate([tables[table][column].dropna().to_numpy(dtype=object) for table, column in present])
+        lookup.keys[domain] = pd.Index(pd.unique(values))
+        for table, column in present:
+            tables[table][column] = lookup.encode(domain, tables[table][column])
+
+    for name, df in tables.items():
+        for column in df.columns:
+            if lookup.domain_of(name, column) or not (df[column].dtype == object or pd.api.types.is_string_dtype(df[column])):
+                continue
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                continue
+            if len(df) and df[column].nunique(dropna=False) <= max_category_ratio * len(df):
+                df[column] = df[column].astype('category')
+
+    report = pd.DataFrame({
+        'table': list(tables),
+        'bytes_before': [before[name] for name in tables],
+        'bytes_after': [memory_usage(tables[name]) for name in tables],
+    })
+    return tables, lookup, report
+
+
+############################################### STREAMING ########################################################
+
+class HashKeySet:
+    """
+    A compact set of 64-bit row hashes used to drop duplicates across chunks.
+    
+    Hashes are kept in a few sorted numpy arrays (8 bytes per key) instead of a
+    Python set, and the arrays are merged when there are too many of them.
+    Two different rows colliding on a 64-bit hash is possible but negligible.
+    """
+
+    def __init__(self, max_segments=8):
+        self.segments = []
+        self.max_segments = max_segments
+        # The hashes added by the last add_new call, in row order
+        self.added = np.zeros(0, dtype=np.uint64)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def contains(self, hashes):
+        """
+        Returns a boolean mask of the hashes that are already in the set.
+        """
+        found = np.zeros(len(hashes), dtype=bool)
+        for segment in self.segments:
+            positions = np.searchsorted(segment, hashes)
+            positions[positions == len(segment)] = 0
+            found |= segment[positions] == hashes
+        return found
+
+    def add_new(self, hashes):
+        """
+        Adds hashes to the set.
+        
+        Parameters:
+        hashes (np.ndarray): uint64 row hashes.
+        
+        Returns:
+        np.ndarray: Boolean mask, True for the first occurrence of hashes not seen before.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        new = ~pd.Series(hashes).duplicated().to_numpy()
+        if self.segments:
+            new &= ~self.contains(hashes)
+        self.added = hashes[new]
+        if new.any():
+            self.segments.append(np.sort(self.added))
+        if len(self.segments) > self.max_segments:
+            self.segments = [np.sort(np.concatenate(self.segments))]
+        return new
+
+
+def hash_rows(df, columns):
+    """
+    Hashes the values of the given columns of each row to a uint64.
+    
+    Parameters:
+    df (pd.DataFrame): The DataFrame to hash.
+    columns (list): The columns forming the row key.
+    
+    Returns:
+    np.ndarray: One uint64 hash per row.
+    """
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+@instrument
+def stream_clean_csv(file_path, output_path, steps, chunksize=100_000, separator=None, interactive=False, dtype=object):
+    """
+    Loads a CSV file chunk by chunk, applies the cleaning steps to each chunk and appends it to the output CSV.
+    Peak memory is bounded by the chunk size rather than the file size.
+    
+    Each step is a callable taking and returning a DataFrame, e.g.
+    lambda df: replace_value_with_nan(df, 'REASONCODE', 'NAN'). For duplicate removal across
+    chunks, share one HashKeySet between chunks: lambda df: preprocess_columns(df, seen_keys=seen).
+    
+    Every column is read as text by default, so a value has the same text in every chunk. With
+    inferred dtypes, a numeric column with a missing value in one chunk only is float there ('2186.0')
+    and int in the others ('2186'), and duplicates across chunks would be missed. Type conversions are
+    then explicit steps (convert_column_to_float, ...), as after preprocess_columns on the whole file.
+    
+    Parameters:
+    file_path (str): The path to the input CSV file.
+    output_path (str): The path where the cleaned CSV file will be saved.
+    steps (list): The cleaning steps, applied in order.
+    chunksize (int): The number of rows per chunk.
+    separator (str, optional): The separator used in the input file. If not provided, it is detected.
+    interactive (bool): Whether to prompt for the separator if it cannot be detected.
+    dtype (type or dict, optional): The dtypes of the columns, the same for every chunk. None infers them per chunk.
+    
+    Returns:
+    tuple: (rows read, rows written).
+    """
+    rows_in = rows_out = 0
+    chunks = load_csv_file(file_path, separator, interactive=interactive, chunksize=chunksize, dtype=dtype)
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        header = True
+        for chunk in chunks:
+            rows_in += len(chunk)
+            for step in steps:
+                chunk = step(chunk)
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+            rows_out += len(chunk)
+
+    print(f"Streamed {rows_in} rows from {file_path}, saved {rows_out} rows to {output_path} successfully.")
+    return rows_in, rows_out
+
+
+############################################### CLEANING SPECS ########################################################
+
+NAN_SENTINEL = 'NAN'
+ENCOUNTERS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Declarative cleaning recipe per table, mirroring the steps of project.ipynb.
+# 'preprocess': columns to strip/uppercase and drop duplicates on ('all' for every column).
+# 'columns': per column steps, always applied in this order:
+#     prefix_fixes -> preprocess -> replace_chars -> nan_values -> fill -> type (+ format)
+# 'fill_numeric_nan': replace NaN with 0 in numeric columns once the types are applied.
+# 'keep_nulls': normalize strings as Arrow strings keeping missing values (see null_preserving_specs).
+CLEANING_SPECS = {
+    'encounters': {
+        'preprocess': 'all',
+        'columns': {
+            'START': {'replace_chars': {'|': '-'}, 'type': 'datetime', 'format': ENCOUNTERS_DATETIME_FORMAT},
+            'STOP': {'replace_chars': {'|': '-'}, 'type': 'datetime', 'format': ENCOUNTERS_DATETIME_FORMAT},
+            'CODE': {'type': 'int'},
+            'BASE_ENCOUNTER_COST': {'type': 'float'},
+            'TOTAL_CLAIM_COST': {'type': 'float'},
+            'PAYER_COVERAGE': {'type': 'float'},
+            'REASONCODE': {'nan_values': [NAN_SENTINEL], 'type': 'float'},
+            'REASONDESCRIPTION': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+        },
+        'fill_numeric_nan': True,
+    },
+    'organizations': {
+        'preprocess': 'all',
+        'columns': {},
+        'fill_numeric_nan': False,
+    },
+    'patients': {
+        'preprocess': 'all',
+        'columns': {
+            'BIRTHDATE': {'prefix_fixes': {'943|': '1943|'}, 'type': 'datetime', 'format': '%Y|%m-%d'},
+            'DEATHDATE': {'nan_values': [NAN_SENTINEL], 'type': 'datetime', 'format': '%Y-%m-%d'},
+            'SUFFIX': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+            'MAIDEN': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+            'GENDER': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+            'ZIP': {'nan_values': [NAN_SENTINEL], 'type': 'float'},
+            'LAT': {'type': 'float'},
+            'LON': {'type': 'float'},
+        },
+        'fill_numeric_nan': False,
+    },
+    'payers': {
+        'preprocess': 'all',
+        'columns': {
+            'ADDRESS': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+            'CITY': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+            'STATE_HEADQUARTERED': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+            'PHONE': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+            'ZIP': {'nan_values': [NAN_SENTINEL], 'type': 'float'},
+        },
+        'fill_numeric_nan': True,
+    },
+    'procedures': {
+        'preprocess': 'all',
+        'columns': {
+            'START': {'replace_chars': {'|': '-'}, 'type': 'datetime', 'format': ENCOUNTERS_DATETIME_FORMAT},
+            'STOP': {'replace_chars': {'|': '-'}, 'type': 'datetime', 'format': ENCOUNTERS_DATETIME_FORMAT},
+            'CODE': {'type': 'int'},
+            'BASE_COST': {'type': 'int'},
+            'REASONCODE': {'nan_values': [NAN_SENTINEL], 'type': 'float'},
+            'REASONDESCRIPTION': {'nan_values': [NAN_SENTINEL], 'fill': 'VALUE NOT PROVIDED'},
+        },
+        'fill_numeric_nan': True,
+    },
+}
+
+
+def null_preserving_specs(specs=None):
+    """
+    Returns copies of cleaning specs running in the null-preserving mode ('keep_nulls'). Strings are
+    normalized and gathered as Arrow strings and missing values are never turned into 'NAN', so
+    the NAN_SENTINEL replacement steps are dropped.
+    
+    Parameters:
+    specs (dict, optional): The specs to convert. Defaults to CLEANING_SPECS.
+    
+    Returns:
+    dict: The converted specs.
+    """
+    specs = copy.deepcopy(CLEANING_SPECS if specs is None else specs)
+    for spec in specs.values():
+        spec['keep_nulls'] = True
+        for column_spec in spec.get('columns', {}).values():
+            nan_values = [value for value in column_spec.get('nan_values', []) if value != NAN_SENTINEL]
+            if nan_values:
+                column_spec['nan_values'] = nan_values
+            else:
+                column_spec.pop('nan_values', None)
+    return specs
+
+
+def _cast_values(values, column_spec):
+    """
+    Applies the 'type' step of a column spec to a Series of (unique) values.
+    """
+    column_type = column_spec.get('type')
+    if column_type == 'float':
+        return pd.to_numeric(values, errors='coerce').astype(float)
+    if column_type == 'int':
+        return pd.to_numeric(values, errors='coerce').fillna(0).astype(int)
+    if column_type == 'datetime':
+        if column_spec.get('format') and pd.api.types.is_string_dtype(values):
+            return _parse_dates(values, column_spec['format'])
+        return pd.to_datetime(values, format=column_spec.get('format'), errors='coerce')
+    return values
+
+
+def _preprocess_values(values, keep_nulls=False):
+    """
+    The preprocess step of preprocess_columns on a Series: strip whitespace and convert to uppercase.
+    """
+    if keep_nulls:
+        return normalize_strings(values)
+    return values.astype(str).str.strip().str.upper()
+
+
+def _clean_column_values(values, column_spec, normalize, timings, stages=None, keep_nulls=False):
+    """
+    Runs every value-level step of a column spec on a Series of unique values, timing each step.
+    If stages is given, the values right after the preprocess step are stored in it under 'preprocess'
+    and the mask of the values filled by the 'fill' step under 'fill'.
+    With keep_nulls, strings are handled as Arrow strings and missing values stay missing.
+    """
+    def timed(step, func, values):
+        started = time.perf_counter()
+        result = func(values)
+        timings[step] = timings.get(step, 0.0) + time.perf_counter() - started
+        return result
+
+    prefix_fixes = column_spec.get('prefix_fixes')
+    if prefix_fixes:
+        def fix_prefixes(values):
+            values = as_arrow_strings(values) if keep_nulls else values.astype(str)
+            for old, new in prefix_fixes.items():
+                values = values.where(~values.str.startswith(old, na=False), new + values.str[len(old):])
+            return values
+        values = timed('prefix_fixes', fix_prefixes, values)
+    if normalize:
+        values = timed('preprocess', lambda v: _preprocess_values(v, keep_nulls), values)
+        if stages is not None:
+            stages['preprocess'] = values
+    for old, new in column_spec.get('replace_chars', {}).items():
+        values = timed('replace_chars', lambda v: v.str.replace(old, new, regex=False), values)
+    if column_spec.get('nan_values'):
+        values = timed('nan_values', lambda v: v.where(~v.isin(column_spec['nan_values']), np.nan), values)
+    if 'fill' in column_spec:
+        if stages is not None:
+            stages['fill'] = values.isna().to_numpy()
+        values = timed('fill', lambda v: v.fillna(column_spec['fill']), values)
+    return values
+
+
+def _cast_failures(values, cast, column_type):
+    """
+    Returns the mask of the non-missing values a type step could not convert.
+    """
+    if column_type == 'int':
+        # The int step replaces failures with 0
+        cast = pd.to_numeric(values, errors='coerce')
+    return (cast.isna() & values.notna()).to_numpy()
+
+
+def _clean_column_group(df, column_specs, preprocess, fill_numeric_nan, keep_nulls=False):
+    """
+    Runs the fused per-column steps for every column of df.
+    This is the unit of work shipped to worker processes by run_cleaning_spec.
+    
+    Returns:
+    dict: column -> (row codes, cleaned unique values, [(step, seconds)],
+        [(log description, rows affected or None, sample values or None, timing step)],
+        uint64 hashes of the preprocessed unique values, indexed by the next item,
+        row codes of the preprocessed values (the duplicate keys); both for preprocessed columns only).
+    """
+    results = {}
+    for column in df.columns:
+        column_spec = column_specs.get(column, {})
+        column_timings = {}
+        descriptions = []
+        started = time.perf_counter()
+        column_codes, column_uniques = pd.factorize(df[column], use_na_sentinel=False)
+        column_timings['factorize'] = time.perf_counter() - started
+
+        uniques = pd.Series(column_uniques, dtype=df[column].dtype)
+        stages = {}
+        values = _clean_column_values(uniques, column_spec, column in preprocess, column_timings, stages, keep_nulls)
+
+        # Values that became equal after cleaning share one code
+        started = time.perf_counter()
+        remap, values = pd.factorize(values, use_na_sentinel=False)
+        codes = remap[column_codes]
+
+        # Duplicate rows are rows equal after the preprocess step alone, as in preprocess_columns:
+        # the later steps ('|' -> '-', 'NAN' -> fill value, ...) must not merge rows it keeps apart
+        key_codes = value_hashes = None
+        if column in preprocess:
+            keys = _preprocess_values(uniques, keep_nulls) if column_spec.get('prefix_fixes') else stages['preprocess']
+            key_remap, keys = pd.factorize(keys, use_na_sentinel=False)
+            key_codes = key_remap[column_codes]
+            value_hashes = pd.util.hash_array(np.asarray(keys, dtype=object))
+        column_timings['factorize'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        uncast = pd.Series(values)
+        values = _cast_values(uncast, column_spec)
+        # Rows per cleaned value, to count the rows behind each log record
+        row_counts = np.bincount(codes, minlength=len(values))
+        if column_spec.get('type'):
+            descriptions.append((f"Object type should be Converted to {column_spec['type']}", None, None, 'type'))
+            failed = _cast_failures(uncast, values, column_spec['type'])
+            if failed.any():
+                descriptions.append((f"Values could not be converted to {column_spec['type']}", int(row_counts[failed].sum()),
+                                     uncast[failed].to_numpy()[:ANOMALY_SAMPLE_CANDIDATES], 'type'))
+        if fill_numeric_nan and pd.api.types.is_numeric_dtype(values):
+            nan_values = values.isna().to_numpy()
+            values = values.fillna(0)
+            descriptions.append(('NaN values should be replaced with 0', int(row_counts[nan_values].sum()), None, 'type'))
+        if 'fill' in column_spec:
+            n_filled = int(np.bincount(column_codes, minlength=len(stages['fill']))[stages['fill']].sum())
+            descriptions.append((f'NaN values should be replaced with "{column_spec["fill"]}"', n_filled, None, 'fill'))
+        column_timings['type'] = time.perf_counter() - started
+
+        results[column] = (codes, values, list(column_timings.items()), descriptions, value_hashes, key_codes)
+    return results
+
+
+def _split_columns(columns, n_groups):
+    """
+    Splits columns round-robin into at most n_groups non-empty groups.
+    """
+    groups = [columns[i::n_groups] for i in range(n_groups)]
+    return [group for group in groups if group]
+
+
+def _combine_value_hashes(results, columns):
+    """
+    Combines the hashes of the preprocessed values of the given columns into one uint64 hash per row.
+    """
+    row_hashes = None
+    for column in columns:
+        _, _, _, _, value_hashes, codes = results[column]
+        column_hashes = value_hashes[codes]
+        # uint64 arithmetic wraps around, like the FNV hash
+        row_hashes = column_hashes if row_hashes is None else (row_hashes * np.uint64(0x100000001B3)) ^ column_hashes
+    return row_hashes
+
+
+@instrument
+def run_cleaning_spec(df, spec, table_name, logs, executor=None, n_groups=None, seen_keys=None):
+    """
+    Cleans a DataFrame according to a declarative table spec (see CLEANING_SPECS).
+    
+    Steps touching the same column are fused: each column is factorized once, every
+    step runs on its unique values only, and the cleaned values are gathered back to
+    the rows in a single pass. Duplicate rows are detected on the integer codes of the
+    values right after the preprocess step, before the other value steps, which gives
+    the same result as preprocess_columns.
+    
+    Parameters:
+    df (pd.DataFrame): The DataFrame to clean.
+    spec (dict): The table spec.
+    table_name (str): The name of the table being processed.
+    logs (list): The list to log actions.
+    executor (concurrent.futures.Executor, optional): If given, the per-column work is split
+        into column groups run on the executor. The result and the logs are identical to a serial run.
+    n_groups (int, optional): The number of column groups when an executor is given. Defaults to the number of CPUs.
+    seen_keys (HashKeySet, optional): Keys of rows kept by previous runs (chunks of the same table). When given,
+        rows duplicating them are removed too and the set is updated, like preprocess_columns(seen_keys=...).
+    
+    Returns:
+    tuple: (cleaned pd.DataFrame, pd.DataFrame of timings with columns 'column', 'step', 'seconds').
+    """
+    preprocess = spec.get('preprocess') or []
+    preprocess = df.columns.tolist() if preprocess == 'all' else [c for c in preprocess if c in df.columns]
+    column_specs = spec.get('columns', {})
+    fill_numeric_nan = spec.get('fill_numeric_nan', False)
+    keep_nulls = spec.get('keep_nulls', False)
+    for column in column_specs:
+        if column not in df.columns:
+            log_issue(logs, table_name, column, 'Column does not exist in the DataFrame')
+
+    if executor is None:
+        results = _clean_column_group(df, column_specs, preprocess, fill_numeric_nan, keep_nulls)
+    else:
+        n_groups = n_groups or os.cpu_count() or 1
+        futures = [
+            executor.submit(_clean_column_group, df[group], column_specs, preprocess, fill_numeric_nan, keep_nulls)
+            for group in _split_columns(df.columns.tolist(), n_groups)
+        ]
+        results = {}
+        for future in futures:
+            results.update(future.result())
+
+    timings = []
+    # Merge in column order so logs and timings do not depend on worker scheduling
+    for column in df.columns:
+        column_timings, descriptions = results[column][2:4]
+        timings.extend((column, step, seconds) for step, seconds in column_timings)
+        for description, count, samples, step in descriptions:
+            log_issue(logs, table_name, column, description, count, samples, dict(column_timings).get(step, 0.0))
+
+    started = time.perf_counter()
+    if preprocess and seen_keys is not None:
+        keep = seen_keys.add_new(_combine_value_hashes(results, preprocess))
+    elif preprocess:
+        keep = ~pd.DataFrame({column: results[column][5] for column in preprocess}).duplicated().to_numpy()
+    else:
+        keep = np.ones(len(df), dtype=bool)
+    timings.append(('', 'drop_duplicates', time.perf_counter() - started))
+
+    cleaned = {}
+    for column in df.columns:
+        codes, values = results[column][:2]
+        started = time.perf_counter()
+        gathered = values.take(codes[keep])
+        # Arrow strings are gathered as they are instead of as an array of Python strings
+        cleaned[column] = gathered.array if keep_nulls else gathered.to_numpy()
+        timings.append((column, 'gather', time.perf_counter() - started))
+
+    result = pd.DataFrame(cleaned, index=df.index[keep])
+    timings = pd.DataFrame(timings, columns=['column', 'step', 'seconds'])
+    return result, timings
+
+
+def summarize_timings(timings):
+    """
+    Sums the timings returned by run_cleaning_spec per step, slowest first.
+    
+    Parameters:
+    timings (pd.DataFrame): The timings DataFrame.
+    
+    Returns:
+    pd.Series: Total seconds per step.
+    """
+    return timings.groupby('step')['seconds'].sum().sort_values(ascending=False)
+
+
+@instrument
+def clean_table(file_path, table_name, logs, specs=None, separator=None):
+    """
+    Loads a table and cleans it according to its spec in CLEANING_SPECS.
+    
+    Parameters:
+    file_path (str): The path to the CSV file.
+    table_name (str): The name of the table, used to look up its spec.
+    logs (list): The list to log actions.
+    specs (dict, optional): The specs to use instead of CLEANING_SPECS.
+    separator (str, optional): The separator used in the CSV file. If not provided, it is detected.
+    
+    Returns:
+    tuple: (cleaned pd.DataFrame, timings pd.DataFrame).
+    """
+    specs = specs or CLEANING_SPECS
+    df = load_csv_file(file_path, separator, interactive=False)
+    return run_cleaning_spec(df, specs[table_name], table_name, logs)
+
+
+def _clean_table_worker(file_path, table_name, spec, separator, structured=False):
+    """
+    Cleans one table in a worker process with its own log list (an AnomalyLog if structured).
+    """
+    logs = AnomalyLog() if structured else []
+    df = load_csv_file(file_path, separator, interactive=False)
+    df, timings = run_cleaning_spec(df, spec, table_name, logs)
+    return df, timings, logs
+
+
+@instrument
+def clean_tables(table_files, logs, max_workers=None, specs=None, separators=None):
+    """
+    Cleans several independent tables concurrently, one worker process per table.
+    
+    Each worker keeps its own logs, which are appended to logs in the order of
+    table_files once all tables are done, so the logs and the cleaned tables are
+    the same as cleaning the tables one after another with clean_table.
+    
+    Parameters:
+    table_files (dict): Table name -> CSV file path, e.g. {'patients': 'patients.csv'}.
+    logs (list): The list to log actions.
+    max_workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+    specs (dict, optional): The specs to use instead of CLEANING_SPECS.
+    separators (dict, optional): Table name -> separator, for files whose separator should not be detected.
+    
+    Returns:
+    dict: Table name -> (cleaned pd.DataFrame, timings pd.DataFrame).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    specs = specs or CLEANING_SPECS
+    separators = separators or {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            table_name: executor.submit(_clean_table_worker, file_path, table_name,
+                                        specs[table_name], separators.get(table_name), isinstance(logs, AnomalyLog))
+            for table_name, file_path in table_files.items()
+        }
+        results = {}
+        for table_name, future in futures.items():
+            df, timings, table_logs = future.result()
+            logs.extend(table_logs)
+            results[table_name] = (df, timings)
+    return results
+
+
+############################################### INCREMENTAL ########################################################
+
+# Size of the source blocks whose digests are kept in the state, cut at line ends
+BLOCK_BYTES = 4 * 1024 * 1024
+# Version of the row keys kept in the state, a state with other keys is rebuilt with a full run
+# (2: keys hash the preprocessed values instead of the filled ones, 3: preprocessed columns are read as text)
+STATE_KEYS_VERSION = 3
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _spec_digest(spec):
+    return _digest(json.dumps(spec, sort_keys=True, default=str).encode('utf-8'))
+
+
+def _iter_blocks(f, start, block_bytes):
+    """
+    Yields (start offset, end offset, bytes) of the blocks of an open binary file from start to the end.
+    Blocks end after a newline, except the last one when the file does not end with a newline.
+    """
+    f.seek(start)
+    pending = b''
+    while True:
+        data = f.read(block_bytes)
+        if not data:
+            break
+        data = pending + data
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            pending = data
+            continue
+        yield start, start + cut, data[:cut]
+        start += cut
+        pending = data[cut:]
+    if pending:
+        yield start, start + len(pending), pending
+
+
+def load_incremental_state(state_path):
+    """
+    Loads the incremental cleaning state of a table, or None if there is none.
+    
+    Parameters:
+    state_path (str): The path of the state JSON file.
+    
+    Returns:
+    dict: The state, with the kept row keys under 'keys' (np.ndarray of uint64).
+    """
+    keys_path = state_path + '.keys.npy'
+    if not os.path.exists(state_path) or not os.path.exists(keys_path):
+        return None
+    with open(state_path, encoding='utf-8') as f:
+        state = json.load(f)
+    state['keys'] = np.load(keys_path)
+    return state
+
+
+def save_incremental_state(state, state_path):
+    """
+    Saves the incremental cleaning state of a table. Files are replaced atomically.
+    
+    Parameters:
+    state (dict): The state from clean_table_incremental.
+    state_path (str): The path of the state JSON file.
+    """
+    keys_path = state_path + '.keys.npy'
+    with open(keys_path + '.tmp', 'wb') as f:
+        np.save(f, state['keys'])
+    os.replace(keys_path + '.tmp', keys_path)
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({key: value for key, value in state.items() if key != 'keys'}, f)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def _block_dtypes(spec):
+    """
+    The dtypes to read the blocks of a table with: its preprocessed columns as text. With inferred
+    dtypes, a numeric column with a missing value in one block only is float there ('2186.0') and
+    int in the others ('2186'). Columns with a 'type' step are converted by the spec as usual.
+    """
+    preprocess = spec.get('preprocess') or []
+    if preprocess == 'all':
+        return object
+    return {column: object for column in preprocess} or None
+
+
+@instrument
+def clean_table_incremental(file_path, output_path, table_name, logs, specs=None, separator=None,
+                            state_path=None, verify=True, block_bytes=BLOCK_BYTES):
+    """
+    Cleans only the rows of a table added or changed since the last run and merges them into the cleaned CSV.
+    
+    The source is read in blocks of about block_bytes cut at line ends. The state keeps, per block,
+    its end offset (the watermark), a content digest, and where its cleaned rows end in the output,
+    plus the keys of the kept rows for duplicate removal. On the next run, blocks are compared with
+    their digests: the output is truncated after the last unchanged block, the duplicate keys of
+    the dropped blocks are forgotten, and cleaning resumes from there. For an append-only extract
+    only the new bytes are cleaned. A changed header, spec, separator or key version triggers a full run.
+    
+    Duplicates are removed against every row kept so far, so the output matches clean_table on the
+    whole file. Rows are parsed per block, so like stream_clean_csv, quoted fields must not span lines,
+    and the preprocessed columns are read as text so a value has the same key in every block.
+    
+    Parameters:
+    file_path (str): The path to the source CSV file.
+    output_path (str): The path of the cleaned CSV file, created or updated.
+    table_name (str): The name of the table, used to look up its spec.
+    logs (list): The list to log actions. Each description is logged once per run.
+    specs (dict, optional): The specs to use instead of CLEANING_SPECS.
+    separator (str, optional): The separator used in the CSV file. If not provided, it is detected.
+    state_path (str, optional): The path of the state file. Defaults to output_path + '.state.json'.
+    verify (bool): If True, the digest of every processed block is checked. If False, only the
+        last one is, so unchanged history is not read at all.
+    block_bytes (int): The approximate size of a block.
+    
+    Returns:
+    dict: 'mode' ('full', 'incremental' or 'unchanged'), 'rows_in' and 'rows_out' for the cleaned
+        blocks, 'start' (the source offset cleaning resumed from) and 'seconds'.
+    """
+    started = time.perf_counter()
+    spec = (specs or CLEANING_SPECS)[table_name]
+    dtypes = _block_dtypes(spec)
+    state_path = state_path or output_path + '.state.json'
+    encoding, detected_sep = sniff_csv_format(file_path)
+    sep = separator or detected_sep
+    if sep is None:
+        raise ValueError(f"Could not detect the separator of the file {file_path}.")
+
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        file_size = os.fstat(f.fileno()).st_size
+
+        state = load_incremental_state(state_path) if os.path.exists(output_path) else None
+        if state is not None and (state['header'] != _digest(header) or state['spec'] != _spec_digest(spec)
+                                  or state['separator'] != sep or state.get('keys_version') != STATE_KEYS_VERSION):
+            state = None
+
+        # Keep the leading blocks whose bytes did not change
+        blocks = []
+        if state is not None:
+            checked = state['blocks'] if verify else state['blocks'][-1:]
+            unchanged = len(state['blocks']) - len(checked)
+            for block in checked:
+                start = state['blocks'][unchanged - 1]['end'] if unchanged else len(header)
+                if block['end'] > file_size:
+                    break
+                f.seek(start)
+                if _digest(f.read(block['end'] - start)) != block['digest']:
+                    break
+                unchanged += 1
+            blocks = state['blocks'][:unchanged]
+
+        n_kept = sum(block['rows_out'] for block in blocks)
+        seen_keys = HashKeySet()
+        kept_keys = [state['keys'][:n_kept]] if state is not None else []
+        if n_kept:
+            seen_keys.add_new(kept_keys[0])
+        resume = blocks[-1]['end'] if blocks else len(header)
+        output_end = blocks[-1]['output_end'] if blocks else 0
+        if state is None:
+            mode = 'full'
+        elif resume == file_size and len(blocks) == len(state['blocks']):
+            mode = 'unchanged'
+        else:
+            mode = 'incremental'
+
+        rows_in = rows_out = 0
+        run_logs = AnomalyLog()
+        with open(output_path, 'r+b' if output_end else 'wb') as out:
+            out.truncate(output_end)
+            out.seek(output_end)
+            for start, end, data in _iter_blocks(f, resume, block_bytes):
+                df = pd.read_csv(io.BytesIO(header + data), encoding=encoding, sep=sep, dtype=dtypes)
+                rows_in += len(df)
+                df, _ = run_cleaning_spec(df, spec, table_name, run_logs, seen_keys=seen_keys)
+                kept_keys.append(seen_keys.added)
+                out.write(df.to_csv(index=False, header=out.tell() == 0).encode('utf-8'))
+                rows_out += len(df)
+                blocks.append({'end': end, 'digest': _digest(data), 'rows_out': len(df), 'output_end': out.tell()})
+            if out.tell() == 0:
+                # No rows at all, keep an output with the header only
+                columns = pd.read_csv(io.BytesIO(header), encoding=encoding, sep=sep)
+                out.write(columns.to_csv(index=False).encode('utf-8'))
+
+    # Counts are summed over the blocks, so each rule is logged once per run
+    logs.extend(run_logs)
+
+    state = {
+        'source': os.path.abspath(file_path), 'header': _digest(header), 'spec': _spec_digest(spec),
+        'separator': sep, 'keys_version': STATE_KEYS_VERSION, 'blocks': blocks,
+        'keys': np.concatenate(kept_keys) if kept_keys else np.zeros(0, dtype=np.uint64),
+    }
+    save_incremental_state(state, state_path)
+
+    summary = {'mode': mode, 'rows_in': rows_in, 'rows_out': rows_out, 'start': resume,
+               'seconds': time.perf_counter() - started}
+    print(f"Cleaned {rows_in} new rows of {file_path} ({mode}), saved {rows_out} rows to {output_path} successfully.")
+    return summary
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+# APP_INSTRUMENT=1 records wall time, rows and bytes; APP_INSTRUMENT=memory also records peak memory (slower).
+# When it is not set, instrument() returns functions unchanged, so there is no overhead at all.
+INSTRUMENT_MODE = os.environ.get('APP_INSTRUMENT', '0').lower()
+INSTRUMENTATION_ENABLED = INSTRUMENT_MODE in ('1', 'true', 'memory')
+# Spans kept per process, the oldest are dropped first
+MAX_SPANS = 100_000
+
+
+def _frame_of(value):
+    """
+    Returns the DataFrame in a value (a DataFrame, or the first one in a tuple), or None.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value
+    if isinstance(value, tuple):
+        for item in value:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                return item
+    return None
+
+
+def _shape(value):
+    """
+    Returns (rows, bytes) of the DataFrame in a value. Bytes are the shallow memory usage, which
+    does not scan object columns.
+    """
+    df = _frame_of(value)
+    if df is None:
+        return None, None
+    n_bytes = df.memory_usage(index=True, deep=False)
+    return len(df), int(n_bytes.sum() if isinstance(df, pd.DataFrame) else n_bytes)
+
+
+class Tracer:
+    """
+    Records timed spans (function calls, page renders) of one process.
+    
+    Each span has a name, a category, its start and duration, the rows and bytes of the DataFrame
+    it received and returned, and with memory tracking the peak traced memory above the memory
+    at its start. Nested spans are supported; memory peaks are process-wide, so concurrent
+    threads add to each other's peaks.
+    
+    Parameters:
+    memory (bool): Whether to track peak memory with tracemalloc.
+    """
+
+    def __init__(self, memory=False):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.enabled = INSTRUMENTATION_ENABLED
+        self.memory = False
+        self.origin = time.perf_counter()
+        if memory:
+            self.enable(memory=True)
+
+    def enable(self, memory=False):
+        """
+        Starts recording spans, and peak memory if memory is True.
+        """
+        self.enabled = True
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.memory = memory or self.memory
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name, category='function', rows_in=None, bytes_in=None):
+        """
+        Records the code run inside the with block as one span.
+        The rows and bytes out can be set on the yielded dict ('rows_out', 'bytes_out').
+        """
+        if not self.enabled:
+            yield {}
+            return
+        stack = self._stack()
+        frame = {'rows_out': None, 'bytes_out': None}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['start_memory'] = frame['peak'] = current
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            duration = time.perf_counter() - started
+            stack.pop()
+            peak_delta = None
+            if self.memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                peak_delta = peak - frame['start_memory']
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            record = {
+                'name': name, 'category': category, 'start': started - self.origin, 'seconds': duration,
+                'rows_in': rows_in, 'rows_out': frame['rows_out'], 'bytes_in': bytes_in, 'bytes_out': frame['bytes_out'],
+                'peak_memory_delta': peak_delta, 'depth': len(stack),
+                'pid': os.getpid(), 'tid': threading.get_ident(),
+            }
+            with self.lock:
+                self.spans.append(record)
+                if len(self.spans) > MAX_SPANS:
+                    del self.spans[:len(self.spans) - MAX_SPANS]
+
+    def to_frame(self):
+        """
+        Returns the recorded spans as a DataFrame, in order of completion.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        return pd.DataFrame(spans, columns=['name', 'category', 'start', 'seconds', 'rows_in', 'rows_out', 'bytes_in',
+                                            'bytes_out', 'peak_memory_delta', 'depth', 'pid', 'tid'])
+
+    def summary(self):
+        """
+        Returns the calls, total and mean seconds, rows and largest peak memory per span name, slowest first.
+        """
+        spans = self.to_frame()
+        total = lambda values: values.sum(min_count=1)
+        summary = spans.groupby(['category', 'name']).agg(
+            calls=('seconds', 'size'), seconds=('seconds', 'sum'), mean_seconds=('seconds', 'mean'),
+            rows_in=('rows_in', total), rows_out=('rows_out', total), peak_memory_delta=('peak_memory_delta', 'max'))
+        return summary.sort_values('seconds', ascending=False).reset_index()
+
+    def chrome_trace(self):
+        """
+        Returns the spans in the Chrome trace event format (chrome://tracing, Perfetto).
+        """
+        events = []
+        for span in self.to_frame().to_dict('records'):
+            args = {key: span[key] for key in ['rows_in', 'rows_out', 'bytes_in', 'bytes_out', 'peak_memory_delta']
+                    if pd.notna(span[key])}
+            events.append({
+                'name': span['name'], 'cat': span['category'], 'ph': 'X',
+                'ts': round(span['start'] * 1e6, 3), 'dur': round(span['seconds'] * 1e6, 3),
+                'pid': int(span['pid']), 'tid': int(span['tid']),
+                'args': {key: int(value) for key, value in args.items()},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, file_path):
+        """
+        Writes the spans to a Chrome trace JSON file.
+        
+        Parameters:
+        file_path (str): The path of the JSON file.
+        """
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+        print(f"Trace saved to {file_path}")
+
+
+TRACER = Tracer(memory=INSTRUMENT_MODE == 'memory')
+
+
+def _wrap(func, name, category):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TRACER.enabled:
+            return func(*args, **kwargs)
+        rows_in, bytes_in = _shape(args[0]) if args else (None, None)
+        with TRACER.span(name, category, rows_in, bytes_in) as frame:
+            result = func(*args, **kwargs)
+            frame['rows_out'], frame['bytes_out'] = _shape(result)
+        return result
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def instrument(func=None, name=None, category='data_processing'):
+    """
+    Decorator recording each call of a function as a span of TRACER.
+    
+    Without APP_INSTRUMENT the function is returned as is. Use instrument_module to add
+    instrumentation later in a session (e.g. from a notebook).
+    
+    Parameters:
+    func (callable): The function to instrument.
+    name (str, optional): The span name. Defaults to the function name.
+    category (str): The span category, e.g. 'data_processing' or 'page'.
+    """
+    def decorate(func):
+        if not INSTRUMENTATION_ENABLED:
+            return func
+        return _wrap(func, name or func.__name__, category)
+    return decorate if func is None else decorate(func)
+
+
+def instrument_module(module, names=None, category=None, memory=False):
+    """
+    Instruments the public functions of an already imported module and enables TRACER.
+    Callers that imported the functions directly (from module import name) keep the originals.
+    
+    Parameters:
+    module (module): The module, e.g. data_processing.
+    names (list, optional): The functions to instrument. Defaults to every public function defined in the module,
+        except the helpers listed in its INSTRUMENT_EXCLUDE.
+    category (str, optional): The span category. Defaults to the module name.
+    memory (bool): Whether to also track peak memory.
+    """
+    category = category or module.__name__
+    if names is None:
+        exclude = set(getattr(module, 'INSTRUMENT_EXCLUDE', []))
+        names = [name for name, value in vars(module).items()
+                 if callable(value) and not name.startswith('_') and not isinstance(value, type)
+                 and getattr(value, '__module__', None) == module.__name__ and name not in exclude]
+    for name in names:
+        func = getattr(module, name)
+        if not hasattr(func, '__wrapped__'):
+            setattr(module, name, _wrap(func, name, category))
+    TRACER.enable(memory=memory)
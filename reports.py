@@ -0,0 +1,363 @@
+import os
+import csv
+import glob
+import sqlite3
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from contextlib import closing
+import pandas as pd
+
+# Patient columns shown in a report
+REPORT_COLUMNS = ['FIRST', 'LAST', 'GENDER', 'BIRTHDATE', 'RACE', 'ETHNICITY', 'MARITAL', 'ADDRESS', 'CITY', 'STATE', 'ZIP']
+# Report columns holding dates, shown in REPORT_DATE_FORMAT whatever the storage backend returns for them
+REPORT_DATE_COLUMNS = ['BIRTHDATE']
+REPORT_DATE_FORMAT = '%Y-%m-%d'
+REPORT_CACHE_SIZE = 1024
+# Reports rendered and written per step of a bulk export
+EXPORT_CHUNK_PATIENTS = 10_000
+# Disk caches of other data versions unused for this long are removed when a service opens its cache.
+# A service refreshes the modification time of its cache file at most every REPORT_CACHE_TOUCH_SECONDS
+# while it is used, so the caches of other running processes are never seen as stale.
+REPORT_CACHE_MAX_AGE = 7 * 24 * 3600
+REPORT_CACHE_TOUCH_SECONDS = 3600
+
+
+def prune_report_caches(cache_dir, keep=None, max_age=REPORT_CACHE_MAX_AGE):
+    """
+    Removes the report disk caches of cache_dir that were not used for max_age seconds.
+    
+    Parameters:
+    cache_dir (str): The directory of the caches.
+    keep (str, optional): The path of a cache never removed.
+    max_age (float): The age in seconds of the last use after which a cache is removed. 0 removes every cache.
+    
+    Returns:
+    list: The paths removed.
+    """
+    removed = []
+    cutoff = time.time() - max_age
+    for path in glob.glob(os.path.join(cache_dir, 'reports_*.db')):
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            if os.path.getmtime(path) <= cutoff:
+                os.remove(path)
+                removed.append(path)
+        except OSError:
+            # Removed by another process meanwhile, or still open on a platform that forbids it
+            continue
+    return removed
+
+
+def report_values(patients):
+    """
+    Returns the REPORT_COLUMNS values of patients as arrays, with the dates formatted as REPORT_DATE_FORMAT.
+    
+    The backends return dates differently (datetime64 from Parquet, 'YYYY-MM-DD' strings from CSV,
+    'YYYY-MM-DD HH:MM:SS' strings from the SQL store), formatting them makes the reports identical.
+    Missing dates are empty (not NaT, nan or None depending on the backend), other values that are
+    not dates are kept as they are.
+    
+    Parameters:
+    patients (pd.DataFrame): The patients, with the REPORT_COLUMNS.
+    
+    Returns:
+    dict: The values of each REPORT_COLUMNS column present in patients.
+    """
+    values = {}
+    for column in REPORT_COLUMNS:
+        if column not in patients.columns:
+            continue
+        if column in REPORT_DATE_COLUMNS:
+            parsed = pd.to_datetime(patients[column], errors='coerce')
+            formatted = parsed.dt.strftime(REPORT_DATE_FORMAT).astype(object)
+            original = patients[column].astype(object).where(patients[column].notna(), '')
+            values[column] = formatted.where(parsed.notna(), original).to_numpy(dtype=object)
+        else:
+            values[column] = patients[column].values
+    return values
+
+
+def render_report(patient, n_encounters, n_procedures):
+    """
+    Renders the markdown report of one patient.
+    
+    Parameters:
+    patient (dict): The REPORT_COLUMNS values of the patient, or None if the patient is unknown.
+    n_encounters (int): The number of encounters of the patient.
+    n_procedures (int): The number of procedures of the patient.
+    
+    Returns:
+    str: The report.
+    """
+    report_text = ""
+    if patient is not None:
+        report_text += f"**Personal Information**:\n\n"
+        report_text += f"Name: {patient['FIRST']} {patient['LAST']}\n\n"
+        report_text += f"Gender: {patient['GENDER']}\n\n"
+        report_text += f"Date of Birth: {patient['BIRTHDATE']}\n\n"
+        report_text += f"Race: {patient['RACE']}\n\n"
+        report_text += f"Ethnicity: {patient['ETHNICITY']}\n\n"
+        report_text += f"Marital Status: {patient['MARITAL']}\n\n"
+        report_text += f"Address: {patient['ADDRESS']}, {patient['CITY']}, {patient['STATE']} {patient['ZIP']}\n\n"
+
+    if n_encounters:
+        report_text += f"**Encounters**:\n"
+        report_text += f"Total Encounters: {n_encounters}\n\n"
+
+    if n_procedures:
+        report_text += f"**Procedures**:\n"
+        report_text += f"Total Procedures: {n_procedures}\n\n"
+
+    return report_text
+
+
+class ReportExport:
+    """
+    A bulk export of every report to a CSV file (PATIENT, REPORT), run in a background thread.
+    
+    The reports are rendered and written chunk by chunk to a temporary file, renamed to file_path
+    once complete, so a reader never sees a partial export.
+    
+    Parameters:
+    service (ReportService): The reports to export.
+    file_path (str): The path of the CSV file.
+    chunk_size (int): The number of reports rendered and written at a time.
+    """
+
+    def __init__(self, service, file_path, chunk_size=EXPORT_CHUNK_PATIENTS):
+        self.service = service
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.total = len(service.patient_ids)
+        self.written = 0
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='report-export', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        part_path = self.file_path + '.part'
+        try:
+            with open(part_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['PATIENT', 'REPORT'])
+                for chunk in self.service.render_all(self.chunk_size):
+                    if self.cancelled.is_set():
+                        break
+                    writer.writerows(chunk)
+                    self.service.save_to_disk(chunk)
+                    self.written += len(chunk)
+            if self.cancelled.is_set():
+                os.remove(part_path)
+            else:
+                os.replace(part_path, self.file_path)
+        except Exception as e:
+            self.error = e
+
+    @property
+    def running(self):
+        return self.thread.is_alive()
+
+    @property
+    def done(self):
+        return self.thread.ident is not None and not self.running and self.error is None and not self.cancelled.is_set()
+
+    @property
+    def progress(self):
+        return self.written / self.total if self.total else 1.0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+        return self.done
+
+
+class ReportService:
+    """
+    Serves patient reports from counts computed once, in one grouped pass over the tables.
+    
+    A report only needs the patient's fields and its numbers of encounters and procedures, so
+    the encounters and procedures are counted per patient once and rendering a report is a
+    lookup. Rendered reports are kept in a bounded LRU cache and, with a cache_dir, in an SQLite
+    file named after the data version (a digest of everything the reports show), so a report of
+    older data is never served. start_export writes every report to a file in the background.
+    
+    Parameters:
+    patients (pd.DataFrame): The patients table, with 'Id' and the REPORT_COLUMNS.
+    encounter_counts (pd.Series): The number of encounters per patient Id.
+    procedure_counts (pd.Series): The number of procedures per patient Id.
+    cache_size (int): The number of reports kept in memory.
+    cache_dir (str, optional): The directory of the on-disk cache. None disables it.
+    """
+
+    def __init__(self, patients, encounter_counts, procedure_counts, cache_size=REPORT_CACHE_SIZE, cache_dir=None):
+        # The first row of a duplicated Id is the one the report shows
+        duplicated = patients['Id'].duplicated()
+        if duplicated.any():
+            patients = patients[~duplicated]
+        self.patient_ids = pd.Index(patients['Id'])
+        self.values = report_values(patients)
+        self.encounter_counts = encounter_counts
+        self.procedure_counts = procedure_counts
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.export = None
+        self.version = self._version(patients)
+        self.cache_path = None
+        self.touched = 0.0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.cache_path = os.path.join(cache_dir, f'reports_{self.version}.db')
+            self._open_disk_cache()
+
+    @classmethod
+    def from_tables(cls, patients, encounters, procedures, **kwargs):
+        """
+        Builds the service from the cleaned tables.
+        """
+        return cls(patients, encounters['PATIENT'].value_counts(sort=False),
+                   procedures['PATIENT'].value_counts(sort=False), **kwargs)
+
+    @classmethod
+    def from_store(cls, store, **kwargs):
+        """
+        Builds the service from an SqlStore, counting the rows per patient in SQL.
+        """
+        columns = ['Id'] + [column for column in REPORT_COLUMNS if column in store.columns('patients')]
+        return cls(store.table('patients', columns), store.counts('encounters', 'PATIENT'),
+                   store.counts('procedures', 'PATIENT'), **kwargs)
+
+    def _version(self, patients):
+        digest = hashlib.sha1()
+        for part in [patients[['Id'] + list(self.values)], self.encounter_counts.sort_index(),
+                     self.procedure_counts.sort_index()]:
+            digest.update(pd.util.hash_pandas_object(part, index=isinstance(part, pd.Series)).to_numpy().tobytes())
+        return digest.hexdigest()[:16]
+
+    def _open_disk_cache(self):
+        with closing(sqlite3.connect(self.cache_path)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS reports (patient TEXT PRIMARY KEY, report TEXT NOT NULL)")
+        self._touch()
+        # Other processes sharing the directory may serve other data versions, only long unused caches are removed
+        prune_report_caches(os.path.dirname(self.cache_path), keep=self.cache_path)
+
+    def _touch(self):
+        """
+        Marks the disk cache as in use, at most once every REPORT_CACHE_TOUCH_SECONDS.
+        """
+        now = time.time()
+        if now - self.touched >= REPORT_CACHE_TOUCH_SECONDS:
+            self.touched = now
+            try:
+                os.utime(self.cache_path)
+            except OSError:
+                pass
+
+    def load_from_disk(self, patient_id):
+        if self.cache_path is None:
+            return None
+        self._touch()
+        try:
+            with closing(sqlite3.connect(self.cache_path)) as conn:
+                row = conn.execute("SELECT report FROM reports WHERE patient = ?", (str(patient_id),)).fetchone()
+        except sqlite3.OperationalError:
+            # The cache file was removed by hand, start a new one
+            self._open_disk_cache()
+            return None
+        return None if row is None else row[0]
+
+    def save_to_disk(self, reports):
+        """
+        Writes (patient_id, report) pairs to the on-disk cache, if there is one.
+        """
+        if self.cache_path is None:
+            return
+        self._touch()
+        rows = [(str(patient_id), report) for patient_id, report in reports]
+        try:
+            with closing(sqlite3.connect(self.cache_path)) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO reports VALUES (?, ?)", rows)
+        except sqlite3.OperationalError:
+            # The cache file was removed by hand, start a new one
+            self._open_disk_cache()
+            with closing(sqlite3.connect(self.cache_path)) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO reports VALUES (?, ?)", rows)
+
+    def _render_position(self, patient_id, position):
+        patient = None if position < 0 else {column: values[position] for column, values in self.values.items()}
+        return render_report(patient, int(self.encounter_counts.get(patient_id, 0)),
+                             int(self.procedure_counts.get(patient_id, 0)))
+
+    def render(self, patient_id):
+        """
+        Renders the report of one patient, without the caches.
+        """
+        return self._render_position(patient_id, self.patient_ids.get_indexer([patient_id])[0])
+
+    def render_all(self, chunk_size=EXPORT_CHUNK_PATIENTS):
+        """
+        Renders the reports of every patient, in patient table order.
+        
+        Yields:
+        list: (patient_id, report) pairs, up to chunk_size per list.
+        """
+        encounter_counts = self.encounter_counts.reindex(self.patient_ids, fill_value=0).to_numpy()
+        procedure_counts = self.procedure_counts.reindex(self.patient_ids, fill_value=0).to_numpy()
+        for start in range(0, len(self.patient_ids), chunk_size):
+            stop = min(start + chunk_size, len(self.patient_ids))
+            yield [(self.patient_ids[position],
+                    render_report({column: values[position] for column, values in self.values.items()},
+                                  int(encounter_counts[position]), int(procedure_counts[position])))
+                   for position in range(start, stop)]
+
+    def get(self, patient_id):
+        """
+        Returns the report of a patient, from the memory cache, the disk cache or rendered.
+        """
+        with self.lock:
+            report = self.cache.get(patient_id)
+            if report is not None:
+                self.cache.move_to_end(patient_id)
+                self.hits += 1
+                return report
+            self.misses += 1
+
+        report = self.load_from_disk(patient_id)
+        if report is None:
+            report = self.render(patient_id)
+            self.save_to_disk([(patient_id, report)])
+
+        with self.lock:
+            self.cache[patient_id] = report
+            self.cache.move_to_end(patient_id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return report
+
+    def start_export(self, file_path, chunk_size=EXPORT_CHUNK_PATIENTS):
+        """
+        Starts writing every report to a CSV file in a background thread, unless an export is running.
+        Reports written are also stored in the on-disk cache.
+        
+        Parameters:
+        file_path (str): The path of the CSV file.
+        chunk_size (int): The number of reports rendered and written at a time.
+        
+        Returns:
+        ReportExport: The running export, with its progress.
+        """
+        with self.lock:
+            if self.export is None or not self.export.running:
+                self.export = ReportExport(self, file_path, chunk_size).start()
+            return self.export
@@ -0,0 +1,328 @@
+import math
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Average number of points per grid cell when the cell size is not given; few points per cell keep
+# the candidates of a query few, at the cost of more rings searched for sparse areas
+POINTS_PER_CELL = 4
+MIN_CELL_DEGREES = 1e-3
+# Percentiles of the coordinates used to size the cells, so outliers do not make the cells of the dense areas too large
+CELL_SIZING_PERCENTILES = (5, 95)
+# Largest distance matrix computed at once (queries x candidates)
+MAX_BLOCK_ELEMENTS = 4_000_000
+
+
+def _haversine_term(lat1, lon1, cos_lat1, lat2, lon2, cos_lat2):
+    """
+    The haversine of the central angle between points in radians, which grows with the distance.
+    """
+    return np.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * np.sin((lon2 - lon1) / 2) ** 2
+
+
+def _term_to_km(term):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(term, 0.0, 1.0)))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distances in km between points given in degrees. Arrays broadcast like numpy
+    arrays, e.g. a column of queries against a row of candidates gives a distance matrix.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype=np.float64)) for values in (lat1, lon1, lat2, lon2))
+    return _term_to_km(_haversine_term(lat1, lon1, np.cos(lat1), lat2, lon2, np.cos(lat2)))
+
+
+class SpatialIndex:
+    """
+    Grid index over point coordinates (LAT/LON in degrees) for batch radius and nearest-neighbour queries.
+    
+    Points are bucketed in square cells of cell_degrees and sorted by cell, so the points of a row
+    of adjacent cells are one contiguous slice. Queries are grouped by the cell they fall in; each
+    group is compared, with a vectorized haversine, only to the points of the cells around it.
+    Points without coordinates are left out. Longitudes are not wrapped around the antimeridian.
+    
+    Parameters:
+    lats (array-like): The latitudes of the points.
+    lons (array-like): The longitudes of the points.
+    ids (array-like, optional): The id of each point. Defaults to the point positions.
+    cell_degrees (float, optional): The cell size. Defaults to a size giving about POINTS_PER_CELL points per cell.
+    """
+
+    def __init__(self, lats, lons, ids=None, cell_degrees=None):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        ids = np.arange(len(lats)) if ids is None else np.asarray(ids)
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        lats, lons, ids = lats[valid], lons[valid], ids[valid]
+
+        if len(lats):
+            self.lat0, self.lon0 = lats.min(), lons.min()
+            lat_span, lon_span = lats.max() - self.lat0, lons.max() - self.lon0
+        else:
+            self.lat0 = self.lon0 = lat_span = lon_span = 0.0
+        if cell_degrees is None and len(lats):
+            low, high = CELL_SIZING_PERCENTILES
+            lat_low, lat_high = np.percentile(lats, [low, high])
+            lon_low, lon_high = np.percentile(lons, [low, high])
+            area = max(lat_high - lat_low, MIN_CELL_DEGREES) * max(lon_high - lon_low, MIN_CELL_DEGREES)
+            cell_degrees = math.sqrt(area * POINTS_PER_CELL / (len(lats) * (high - low) / 100))
+        elif cell_degrees is None:
+            cell_degrees = MIN_CELL_DEGREES
+        self.cell_degrees = max(cell_degrees, MIN_CELL_DEGREES)
+        self.n_rows = int(lat_span / self.cell_degrees) + 1
+        self.n_cols = int(lon_span / self.cell_degrees) + 1
+
+        rows, cols = self._cell(lats, lons)
+        cells = rows * self.n_cols + cols
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.ids = ids[order]
+        self.lat_radians = np.radians(self.lats)
+        self.lon_radians = np.radians(self.lons)
+        self.cos_lat = np.cos(self.lat_radians)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, lats, lons):
+        """
+        Returns the (row, column) of the cells of coordinates, outside the grid for points outside its bounds.
+        """
+        rows = np.floor((lats - self.lat0) / self.cell_degrees).astype(np.int64)
+        cols = np.floor((lons - self.lon0) / self.cell_degrees).astype(np.int64)
+        return rows, cols
+
+    def _candidates(self, row, col, row_radius, col_radius):
+        """
+        Returns the positions of the points in the cells at most row_radius rows and col_radius columns away.
+        """
+        first_row, last_row = max(row - row_radius, 0), min(row + row_radius, self.n_rows - 1)
+        first_col, last_col = max(col - col_radius, 0), min(col + col_radius, self.n_cols - 1)
+        if first_row > last_row or first_col > last_col:
+            return np.zeros(0, dtype=np.int64)
+        row_starts = np.arange(first_row, last_row + 1) * self.n_cols
+        starts = np.searchsorted(self.cells, row_starts + first_col, side='left')
+        stops = np.searchsorted(self.cells, row_starts + last_col, side='right')
+        return np.concatenate([np.arange(start, stop) for start, stop in zip(starts, stops)])
+
+    def _terms(self, lats, lons, candidates):
+        """
+        Returns the haversine terms between query points in radians (columns) and candidate points (a row).
+        """
+        return _haversine_term(lats[:, None], lons[:, None], np.cos(lats)[:, None], self.lat_radians[candidates],
+                               self.lon_radians[candidates], self.cos_lat[candidates])
+
+    def _column_radius(self, row, row_radius, km):
+        """
+        Returns the number of columns covering km east and west of any point of a band of rows.
+        """
+        lat_edge = self.lat0 + np.array([row - row_radius, row + row_radius + 1]) * self.cell_degrees
+        cos_lat = max(np.cos(np.radians(min(np.abs(lat_edge).max(), 90.0))), 1e-9)
+        return int(min(math.ceil(km / (KM_PER_DEGREE * cos_lat) / self.cell_degrees), self.n_cols))
+
+    def _query_groups(self, lats, lons):
+        """
+        Yields (row, column, query positions) for the queries falling in each grid cell.
+        """
+        valid = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+        rows, cols = self._cell(lats[valid], lons[valid])
+        groups = pd.DataFrame({'row': rows, 'col': cols}).groupby(['row', 'col'], sort=False).indices
+        for (row, col), members in groups.items():
+            yield row, col, valid[members]
+
+    def within(self, lats, lons, radius_km):
+        """
+        Finds the points within radius_km of each query point.
+        
+        Parameters:
+        lats (array-like): The latitudes of the query points.
+        lons (array-like): The longitudes of the query points.
+        radius_km (float): The radius in km.
+        
+        Returns:
+        pd.DataFrame: One row per (query, point) pair, with the 'query' position, the point 'ID' and 'DISTANCE_KM'.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        lat_radians, lon_radians = np.radians(lats), np.radians(lons)
+        max_term = np.sin(min(radius_km / (2 * EARTH_RADIUS_KM), math.pi / 2)) ** 2
+        row_radius = int(math.ceil(radius_km / KM_PER_DEGREE / self.cell_degrees))
+        queries, points, distances = [], [], []
+        for row, col, members in self._query_groups(lats, lons):
+            candidates = self._candidates(row, col, row_radius, self._column_radius(row, row_radius, radius_km))
+            if not len(candidates):
+                continue
+            block = max(MAX_BLOCK_ELEMENTS // len(candidates), 1)
+            for start in range(0, len(members), block):
+                query_block = members[start:start + block]
+                terms = self._terms(lat_radians[query_block], lon_radians[query_block], candidates)
+                query_index, candidate_index = np.nonzero(terms <= max_term)
+                queries.append(query_block[query_index])
+                points.append(candidates[candidate_index])
+                distances.append(_term_to_km(terms[query_index, candidate_index]))
+        if not queries:
+            return pd.DataFrame({'query': np.zeros(0, dtype=np.int64), 'ID': self.ids[:0], 'DISTANCE_KM': np.zeros(0)})
+        points = np.concatenate(points)
+        return pd.DataFrame({'query': np.concatenate(queries), 'ID': self.ids[points], 'DISTANCE_KM': np.concatenate(distances)})
+
+    def count_within(self, lats, lons, radius_km):
+        """
+        Returns the number of points within radius_km of each query point.
+        """
+        pairs = self.within(lats, lons, radius_km)
+        return np.bincount(pairs['query'].to_numpy(), minlength=len(np.asarray(lats)))
+
+    def nearest(self, lats, lons):
+        """
+        Finds the nearest point of each query point.
+        
+        The search starts with the cells next to the query's cell and widens the ring until the
+        nearest point found is closer than any point outside the ring can be.
+        
+        Parameters:
+        lats (array-like): The latitudes of the query points.
+        lons (array-like): The longitudes of the query points.
+        
+        Returns:
+        pd.DataFrame: One row per query point, with the nearest point 'ID' and 'DISTANCE_KM'
+            (missing for queries without coordinates or when the index is empty).
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        lat_radians, lon_radians = np.radians(lats), np.radians(lons)
+        positions = np.full(len(lats), -1, dtype=np.int64)
+        best = np.full(len(lats), np.inf)
+        max_radius = max(self.n_rows, self.n_cols)
+        for row, col, members in self._query_groups(lats, lons) if len(self) else []:
+            # Rings already covered by a query outside the grid are empty, start from the grid edge
+            radius = max(1, row - (self.n_rows - 1), -row, col - (self.n_cols - 1), -col)
+            pending = members
+            while len(pending):
+                covers_grid = radius >= max_radius + max(abs(row), abs(col))
+                candidates = self._candidates(row, col, radius, radius)
+                if len(candidates):
+                    block = max(MAX_BLOCK_ELEMENTS // len(candidates), 1)
+                    for start in range(0, len(pending), block):
+                        query_block = pending[start:start + block]
+                        terms = self._terms(lat_radians[query_block], lon_radians[query_block], candidates)
+                        closest = terms.argmin(axis=1)
+                        positions[query_block] = candidates[closest]
+                        best[query_block] = _term_to_km(terms[np.arange(len(query_block)), closest])
+                if covers_grid:
+                    break
+                # No point outside the ring is closer than the ring width, north-south or east-west
+                lat_km = (radius * self.cell_degrees) * KM_PER_DEGREE
+                lat_edge = min(abs(self.lat0) + (abs(row) + radius + 1) * self.cell_degrees, 90.0)
+                lon_km = haversine_km(lat_edge, 0.0, lat_edge, radius * self.cell_degrees)
+                pending = pending[best[pending] > min(lat_km, lon_km)]
+                radius *= 2
+
+        found = positions >= 0
+        ids = pd.Series(self.ids[np.where(found, positions, 0)] if len(self) else np.full(len(lats), None)).where(found)
+        return pd.DataFrame({'ID': ids.to_numpy(), 'DISTANCE_KM': np.where(found, best, np.nan)})
+
+    def density(self, cell_km):
+        """
+        Counts the points per square grid cell of about cell_km, for maps of many points.
+        
+        Parameters:
+        cell_km (float): The cell size in km (north-south; east-west cells are the same size in degrees).
+        
+        Returns:
+        pd.DataFrame: One row per non-empty cell with the 'LAT' and 'LON' of its center and its 'COUNT'.
+        """
+        return density_grid(self.lats, self.lons, cell_km)
+
+
+def density_grid(lats, lons, cell_km):
+    """
+    Counts points per square grid cell of about cell_km.
+    
+    Parameters:
+    lats (array-like): The latitudes of the points.
+    lons (array-like): The longitudes of the points.
+    cell_km (float): The cell size in km.
+    
+    Returns:
+    pd.DataFrame: One row per non-empty cell with the 'LAT' and 'LON' of its center and its 'COUNT'.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    cell_degrees = cell_km / KM_PER_DEGREE
+    rows = np.floor(lats[valid] / cell_degrees).astype(np.int64)
+    cols = np.floor(lons[valid] / cell_degrees).astype(np.int64)
+    counts = pd.DataFrame({'row': rows, 'col': cols}).value_counts(sort=False).reset_index(name='COUNT')
+    return pd.DataFrame({
+        'LAT': (counts['row'].to_numpy() + 0.5) * cell_degrees,
+        'LON': (counts['col'].to_numpy() + 0.5) * cell_degrees,
+        'COUNT': counts['COUNT'].to_numpy(),
+    })
+
+
+class FacilityIndex:
+    """
+    Spatial indexes of the patients and organizations for proximity queries and the Map page.
+    
+    - patients within a radius of an organization (radius query on the patient index)
+    - the nearest organization of every patient and the resulting catchment per organization
+    - patient density per grid cell, cached per cell size
+    
+    Parameters:
+    patients (pd.DataFrame): The patients table, with 'Id', 'LAT' and 'LON'.
+    organizations (pd.DataFrame): The organizations table, with 'Id', 'LAT' and 'LON'.
+    """
+
+    def __init__(self, patients, organizations):
+        self.patients = SpatialIndex(patients['LAT'], patients['LON'], patients['Id'])
+        self.organizations = SpatialIndex(organizations['LAT'], organizations['LON'], organizations['Id'])
+        self.organization_rows = organizations.reset_index(drop=True)
+        self._densities = {}
+        self._assignment = None
+        self._catchments = None
+
+    def patients_within(self, organization_id, radius_km):
+        """
+        Returns the patients within radius_km of an organization, nearest first, with 'PATIENT' and 'DISTANCE_KM'.
+        """
+        organization = self.organization_rows[self.organization_rows['Id'] == organization_id]
+        pairs = self.patients.within(organization['LAT'].to_numpy()[:1], organization['LON'].to_numpy()[:1], radius_km)
+        return (pairs[['ID', 'DISTANCE_KM']].rename(columns={'ID': 'PATIENT'})
+                .sort_values('DISTANCE_KM', kind='stable').reset_index(drop=True))
+
+    def nearest_organizations(self):
+        """
+        Returns the nearest organization of every patient with coordinates, with 'PATIENT', 'ORGANIZATION' and 'DISTANCE_KM'.
+        """
+        if self._assignment is None:
+            nearest = self.organizations.nearest(self.patients.lats, self.patients.lons)
+            self._assignment = pd.DataFrame({'PATIENT': self.patients.ids, 'ORGANIZATION': nearest['ID'].to_numpy(),
+                                             'DISTANCE_KM': nearest['DISTANCE_KM'].to_numpy()})
+        return self._assignment
+
+    def catchments(self):
+        """
+        Returns, per organization, the number of patients for which it is the nearest one and their distances.
+        """
+        if self._catchments is not None:
+            return self._catchments.copy()
+        assignment = self.nearest_organizations().dropna(subset=['ORGANIZATION'])
+        catchments = assignment.groupby('ORGANIZATION', sort=False)['DISTANCE_KM'].agg(
+            PATIENTS='size', MEAN_DISTANCE_KM='mean', MAX_DISTANCE_KM='max')
+        columns = [column for column in ['Id', 'NAME', 'CITY'] if column in self.organization_rows.columns]
+        catchments = self.organization_rows[columns].merge(catchments, left_on='Id', right_index=True, how='left')
+        catchments['PATIENTS'] = catchments['PATIENTS'].fillna(0).astype(int)
+        self._catchments = catchments.sort_values('PATIENTS', ascending=False, kind='stable').reset_index(drop=True)
+        return self._catchments.copy()
+
+    def density(self, cell_km):
+        """
+        Returns the patients per grid cell of about cell_km (see density_grid).
+        """
+        if cell_km not in self._densities:
+            self._densities[cell_km] = self.patients.density(cell_km)
+        return self._densities[cell_km]
@@ -0,0 +1,334 @@
+import os
+import argparse
+import queue
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+import pandas as pd
+import data_processing as dp
+
+STORE_TABLES = ['encounters', 'payers', 'organizations', 'patients', 'procedures']
+
+# Indexed columns per table: the per-patient pages, the sidebar filters and the joins between tables
+STORE_INDEXES = {
+    'patients': ['Id', 'CITY', 'STATE', 'RACE'],
+    'encounters': ['Id', 'PATIENT', 'PAYER', 'ORGANIZATION', 'START', 'ENCOUNTERCLASS'],
+    'procedures': ['PATIENT', 'ENCOUNTER', 'CODE'],
+    'payers': ['Id', 'NAME'],
+    'organizations': ['Id'],
+}
+
+# (parent table, key column, child table, foreign key column), parents listed before their children
+STORE_JOINS = [
+    ('payers', 'Id', 'encounters', 'PAYER'),
+    ('organizations', 'Id', 'encounters', 'ORGANIZATION'),
+    ('patients', 'Id', 'encounters', 'PATIENT'),
+    ('patients', 'Id', 'procedures', 'PATIENT'),
+    ('encounters', 'Id', 'procedures', 'ENCOUNTER'),
+]
+STORE_TABLE_ORDER = ['payers', 'organizations', 'patients', 'encounters', 'procedures']
+
+COST_COLUMNS = ['BASE_ENCOUNTER_COST', 'TOTAL_CLAIM_COST', 'PAYER_COVERAGE']
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_store(tables, db_path, chunksize=50_000):
+    """
+    Writes the cleaned tables to an SQLite database file with indexes on the join and filter columns.
+    
+    The database is written next to db_path and renamed over it at the end, so app workers
+    reading the previous file are not disturbed.
+    
+    Parameters:
+    tables (dict): Table name -> cleaned DataFrame.
+    db_path (str): The path of the database file.
+    chunksize (int): The number of rows inserted per batch.
+    """
+    directory = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            for table_name, df in tables.items():
+                df.to_sql(table_name, conn, index=False, chunksize=chunksize)
+                for column in STORE_INDEXES.get(table_name, []):
+                    if column in df.columns:
+                        conn.execute(f"CREATE INDEX {_quote(f'idx_{table_name}_{column}')} "
+                                     f"ON {_quote(table_name)} ({_quote(column)})")
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    print(f"Store saved to {db_path}")
+
+
+def build_store_from_cleaned(db_path, directory='.'):
+    """
+    Loads the cleaned tables (Parquet when present, else CSV) from a directory and writes the store.
+    
+    Parameters:
+    db_path (str): The path of the database file.
+    directory (str): The directory holding the <table>_cleaned files.
+    """
+    tables = {table_name: dp.load_cleaned_table(os.path.join(directory, f'{table_name}_cleaned.csv'))
+              for table_name in STORE_TABLES}
+    build_store(tables, db_path)
+
+
+class SqlStore:
+    """
+    Read-only access to a store written by build_store, shared by the app pages.
+    
+    Connections are opened read-only and kept in a small pool, so concurrent sessions of a
+    worker reuse them and every worker process reads the same file instead of holding its
+    own copy of the tables. Filters, sorting, paging and the per-patient aggregates are
+    pushed down to SQL; only the rows a page shows are returned.
+    
+    The per-patient methods match TableIndexes (rows, patient_slices) and AggregateCube
+    (gender_distribution, patient_monthly_encounters, ...), so the pages accept a store in
+    their place.
+    
+    Parameters:
+    db_path (str): The path of the database file.
+    pool_size (int): The maximum number of idle connections kept open.
+    """
+
+    def __init__(self, db_path, pool_size=4):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Store not found: {db_path}")
+        self.db_path = os.path.abspath(db_path)
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self._columns = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection from the pool, opening one when none is idle.
+        """
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self.pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def query(self, sql, params=()):
+        """
+        Runs a query and returns its rows as a DataFrame.
+        """
+        with self.connection() as conn:
+            return pd.read_sql_query(sql, conn, params=list(params))
+
+    def scalar(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, list(params)).fetchone()[0]
+
+    def columns(self, table_name):
+        """
+        Returns the column names of a table, in table order.
+        """
+        if table_name not in self._columns:
+            with self.connection() as conn:
+                rows = conn.execute(f"PRAGMA table_info({_quote(table_name)})").fetchall()
+            self._columns[table_name] = [row[1] for row in rows]
+        return self._columns[table_name]
+
+    def _check_columns(self, table_name, columns):
+        unknown = [column for column in columns if column not in self.columns(table_name)]
+        if unknown:
+            raise KeyError(f"Unknown columns in {table_name}: {unknown}")
+
+    def distinct(self, table_name, column):
+        """
+        Returns the distinct values of a column, in order of first appearance.
+        """
+        self._check_columns(table_name, [column])
+        sql = (f"SELECT {_quote(column)} FROM {_quote(table_name)} WHERE {_quote(column)} IS NOT NULL "
+               f"GROUP BY {_quote(column)} ORDER BY MIN(rowid)")
+        return self.query(sql)[column].tolist()
+
+    def where(self, predicates):
+        """
+        Translates equality predicates to a WHERE clause per table.
+        
+        Like FilterEngine.run, the predicates of a parent table also restrict its children
+        through STORE_JOINS, as nested IN (SELECT ...) subqueries.
+        
+        Parameters:
+        predicates (dict): Table name -> {column: value or list of values}.
+        
+        Returns:
+        dict: Table name -> (sql, params), or None when no predicate restricts the table.
+        """
+        clauses = {}
+        for table_name in STORE_TABLE_ORDER:
+            conditions, params = [], []
+            for column, value in predicates.get(table_name, {}).items():
+                self._check_columns(table_name, [column])
+                if isinstance(value, (list, tuple, set)):
+                    value = list(value)
+                    conditions.append(f"{_quote(column)} IN ({', '.join('?' * len(value))})" if value else "0")
+                    params.extend(value)
+                else:
+                    conditions.append(f"{_quote(column)} = ?")
+                    params.append(value)
+            for parent, key_column, child, foreign_key in STORE_JOINS:
+                if child != table_name or clauses.get(parent) is None:
+                    continue
+                parent_sql, parent_params = clauses[parent]
+                conditions.append(f"{_quote(foreign_key)} IN (SELECT {_quote(key_column)} FROM {_quote(parent)} "
+                                  f"WHERE {parent_sql})")
+                params.extend(parent_params)
+            clauses[table_name] = (" AND ".join(conditions), params) if conditions else None
+        return clauses
+
+    def _select(self, table_name, where=None, columns=None, order_by=None, ascending=True):
+        columns = self.columns(table_name) if columns is None else list(columns)
+        self._check_columns(table_name, columns + ([order_by] if order_by else []))
+        sql = f"SELECT {', '.join(_quote(column) for column in columns)} FROM {_quote(table_name)}"
+        params = []
+        if where is not None:
+            sql += f" WHERE {where[0]}"
+            params.extend(where[1])
+        direction = "ASC" if ascending else "DESC"
+        # rowid keeps the order stable for equal values, like a stable sort
+        sql += f" ORDER BY {_quote(order_by)} {direction} NULLS LAST, rowid" if order_by else " ORDER BY rowid"
+        return sql, params
+
+    def count(self, table_name, where=None):
+        """
+        Counts the rows of a table matching a clause from where(), without fetching them.
+        """
+        sql = f"SELECT COUNT(*) FROM {_quote(table_name)}"
+        if where is None:
+            return self.scalar(sql)
+        return self.scalar(f"{sql} WHERE {where[0]}", where[1])
+
+    def page(self, table_name, where=None, columns=None, order_by=None, ascending=True, limit=25, offset=0):
+        """
+        Returns one page of rows of a table.
+        
+        Parameters:
+        table_name (str): The table to read.
+        where (tuple, optional): A clause from where().
+        columns (list, optional): The columns to return (all by default).
+        order_by (str, optional): The column to sort on.
+        ascending (bool): The sort direction.
+        limit (int): The number of rows of the page.
+        offset (int): The number of rows before the page.
+        
+        Returns:
+        pd.DataFrame: The rows of the page.
+        """
+        sql, params = self._select(table_name, where, columns, order_by, ascending)
+        return self.query(f"{sql} LIMIT ? OFFSET ?", params + [int(limit), int(offset)])
+
+    def iter_rows(self, table_name, where=None, columns=None, order_by=None, ascending=True, chunksize=100_000):
+        """
+        Yields the matching rows of a table as DataFrames of up to chunksize rows.
+        """
+        sql, params = self._select(table_name, where, columns, order_by, ascending)
+        with self.connection() as conn:
+            yield from pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+
+    def counts(self, table_name, column):
+        """
+        Returns the number of rows per value of a column, as a Series indexed by value.
+        """
+        self._check_columns(table_name, [column])
+        counts = self.query(f"SELECT {_quote(column)}, COUNT(*) AS n FROM {_quote(table_name)} "
+                            f"WHERE {_quote(column)} IS NOT NULL GROUP BY {_quote(column)}")
+        return counts.set_index(column)['n']
+
+    def table(self, table_name, columns=None):
+        return self.query(self._select(table_name, columns=columns)[0])
+
+    def rows(self, table_name, column, key):
+        """
+        Returns the rows of a table where column equals key.
+        """
+        return self.query(*self._select(table_name, where=(f"{_quote(column)} = ?", [key])))
+
+    def patient_slices(self, patient_id):
+        """
+        Returns the patient row, encounters and procedures of one patient.
+        """
+        return (self.rows('patients', 'Id', patient_id),
+                self.rows('encounters', 'PATIENT', patient_id),
+                self.rows('procedures', 'PATIENT', patient_id))
+
+    def gender_distribution(self):
+        return self.query('SELECT "GENDER" AS "Gender", COUNT(*) AS "Count" FROM "patients" '
+                          'GROUP BY "GENDER" ORDER BY "GENDER"')
+
+    def race_distribution(self):
+        return self.query('SELECT "RACE" AS "Race", COUNT(*) AS "Count" FROM "patients" '
+                          'GROUP BY "RACE" ORDER BY "RACE"')
+
+    def patient_monthly_encounters(self, patient_id):
+        """
+        Returns the encounters per month of a patient, with months as 'YYYY-MM' strings.
+        """
+        return self.query('SELECT substr("START", 1, 7) AS "START", COUNT(*) AS "count" FROM "encounters" '
+                          'WHERE "PATIENT" = ? GROUP BY 1 ORDER BY 1', [patient_id])
+
+    def patient_encounter_classes(self, patient_id):
+        return self.query('SELECT "ENCOUNTERCLASS" AS "Encounter Class", COUNT(*) AS "Count" FROM "encounters" '
+                          'WHERE "PATIENT" = ? GROUP BY "ENCOUNTERCLASS" ORDER BY "Count" DESC, "ENCOUNTERCLASS"',
+                          [patient_id])
+
+    def patient_procedure_types(self, patient_id):
+        return self.query('SELECT "DESCRIPTION" AS "Procedure Type", COUNT(*) AS "Count" FROM "procedures" '
+                          'WHERE "PATIENT" = ? GROUP BY "DESCRIPTION" ORDER BY "Count" DESC, "DESCRIPTION"',
+                          [patient_id])
+
+    def patient_costs(self, patient_id):
+        """
+        Returns the encounter count and cost totals of a patient as a Series (empty if unknown).
+        """
+        cost_columns = [column for column in COST_COLUMNS if column in self.columns('encounters')]
+        sums = ", ".join(f"SUM({_quote(column)}) AS {_quote(column)}" for column in cost_columns)
+        costs = self.query(f'SELECT {sums + ", " if sums else ""}COUNT(*) AS "ENCOUNTERS" FROM "encounters" '
+                           f'WHERE "PATIENT" = ?', [patient_id])
+        if costs['ENCOUNTERS'].iloc[0] == 0:
+            return pd.Series(dtype=float)
+        return costs.iloc[0].rename(patient_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the SQLite store used by app.py")
+    parser.add_argument('--db', default='app_store.db', help="Path of the database file")
+    parser.add_argument('--cleaned-dir', default='.', help="Directory of the <table>_cleaned files")
+    args = parser.parse_args()
+    build_store_from_cleaned(args.db, args.cleaned_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import pandas as pd
+
+import data_processing as dp
+
+
+def make_encounters():
+    # Rows 0/1 differ only by the '|' of START, rows 2/3 only by 'NAN' vs 'VALUE NOT PROVIDED',
+    # rows 4/5 only by case and whitespace (a real duplicate)
+    return pd.DataFrame({
+        'Id': ['E1', 'E1', 'E2', 'E2', 'E3', ' e3 '],
+        'START': ['2011|02-16T10:00:00Z', '2011-02-16T10:00:00Z', '2012-03-01T08:00:00Z', '2012-03-01T08:00:00Z',
+                  '2013-01-01T00:00:00Z', '2013-01-01T00:00:00Z'],
+        'STOP': ['2011-02-16T11:00:00Z'] * 2 + ['2012-03-01T09:00:00Z'] * 2 + ['2013-01-01T01:00:00Z'] * 2,
+        'CODE': ['185345009'] * 6,
+        'BASE_ENCOUNTER_COST': ['129.16'] * 6,
+        'TOTAL_CLAIM_COST': ['129.16'] * 6,
+        'PAYER_COVERAGE': ['0.0'] * 6,
+        'REASONCODE': ['NAN'] * 6,
+        'REASONDESCRIPTION': ['ACUTE BRONCHITIS', 'ACUTE BRONCHITIS', 'NAN', 'VALUE NOT PROVIDED', 'Nan', 'NAN'],
+    })
+
+
+def notebook_encounters(df):
+    """
+    The cleaning sequence of project.ipynb for the encounters table.
+    """
+    logs = []
+    df = dp.preprocess_columns(df)
+    for column in ['START', 'STOP']:
+        df = dp.convert_column_to_date(df, column, 'encounters', logs)
+    df = dp.convert_columns_to_int(df, ['CODE'], 'encounters', logs)
+    for column in ['BASE_ENCOUNTER_COST', 'TOTAL_CLAIM_COST', 'PAYER_COVERAGE']:
+        df = dp.convert_column_to_float(df, column, 'encounters', logs)
+    df = dp.replace_value_with_nan(df, 'REASONCODE', dp.NAN_SENTINEL)
+    df = dp.convert_column_to_float(df, 'REASONCODE', 'encounters', logs)
+    df = dp.replace_value_with_nan(df, 'REASONDESCRIPTION', dp.NAN_SENTINEL)
+    df = dp.replace_nan_with_value(df, ['REASONDESCRIPTION'], 'encounters', logs)
+    return dp.replace_nan_in_numeric_columns(df, 'encounters', logs)
+
+
+def test_spec_keeps_rows_that_differ_before_the_value_steps():
+    expected = notebook_encounters(make_encounters())
+    cleaned, _ = dp.run_cleaning_spec(make_encounters(), dp.CLEANING_SPECS['encounters'], 'encounters', [])
+
+    assert cleaned.index.tolist() == expected.index.tolist() == [0, 1, 2, 3, 4]
+    pd.testing.assert_frame_equal(cleaned, expected[cleaned.columns], check_dtype=False)
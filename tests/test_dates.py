@@ -0,0 +1,36 @@
+import pandas as pd
+
+import data_processing as dp
+
+
+def test_convert_column_to_date_keeps_parsed_dates():
+    df = pd.DataFrame({'START': pd.to_datetime(['2011-02-16 10:00:00', '2012-03-01 08:00:00'])})
+    logs = []
+    result = dp.convert_column_to_date(df.copy(), 'START', 'encounters', logs)
+
+    pd.testing.assert_series_equal(result['START'], df['START'])
+    assert not any('could not be converted' in str(log) for log in logs)
+
+
+def test_normalize_date_column_keeps_parsed_dates():
+    df = pd.DataFrame({'BIRTHDATE': pd.to_datetime(['1943-03-19', '1977-03-19'])})
+    result = dp.normalize_date_column(df.copy(), 'BIRTHDATE', 'patients', [], date_format='%Y|%m-%d', century_prefix='1')
+
+    pd.testing.assert_series_equal(result['BIRTHDATE'], df['BIRTHDATE'])
+
+
+def test_convert_column_to_date_handles_all_empty_float_column():
+    # A streamed chunk where STOP is entirely empty is read as float64
+    df = pd.DataFrame({'STOP': [float('nan'), float('nan')]})
+    logs = []
+    result = dp.convert_column_to_date(df, 'STOP', 'encounters', logs)
+
+    assert pd.api.types.is_datetime64_any_dtype(result['STOP'])
+    assert result['STOP'].isna().all()
+
+
+def test_convert_column_to_date_fixes_pipe_delimited_dates():
+    df = pd.DataFrame({'START': ['2011|02-16T10:00:00Z', '2012-03-01T08:00:00Z']})
+    result = dp.convert_column_to_date(df, 'START', 'encounters', [])
+
+    assert result['START'].tolist() == [pd.Timestamp('2011-02-16 10:00:00'), pd.Timestamp('2012-03-01 08:00:00')]
@@ -0,0 +1,35 @@
+import pandas as pd
+
+import data_processing as dp
+from test_cleaning_specs import make_encounters, notebook_encounters
+
+
+def test_incremental_keeps_rows_that_differ_before_the_value_steps(tmp_path):
+    source = tmp_path / 'encounters.csv'
+    output = tmp_path / 'encounters_cleaned.csv'
+    rows = make_encounters()
+    rows.iloc[:3].to_csv(source, index=False)
+    dp.clean_table_incremental(str(source), str(output), 'encounters', [])
+
+    # Append the other rows, they duplicate rows of the first run only after the value steps
+    rows.to_csv(source, index=False)
+    summary = dp.clean_table_incremental(str(source), str(output), 'encounters', [])
+
+    expected = notebook_encounters(pd.read_csv(source))
+    assert summary['mode'] == 'incremental'
+    assert len(pd.read_csv(output)) == len(expected) == 5
+
+
+def test_incremental_removes_duplicates_across_blocks_with_missing_values(tmp_path):
+    source = tmp_path / 'procedures.csv'
+    output = tmp_path / 'procedures_cleaned.csv'
+    specs = {'procedures': {'preprocess': 'all', 'columns': {}}}
+    # CODE is missing in the first block only, the last row duplicates the first one
+    source.write_text('PATIENT,CODE\nP1,2186\nP2,\nP3,3001\nP4,3002\nP1,2186\n')
+
+    summary = dp.clean_table_incremental(str(source), str(output), 'procedures', [], specs=specs, block_bytes=16)
+
+    cleaned = pd.read_csv(output, dtype=str, keep_default_na=False)
+    assert summary['rows_in'] == 5
+    assert cleaned['PATIENT'].tolist() == ['P1', 'P2', 'P3', 'P4']
+    assert cleaned['CODE'].tolist() == ['2186', '', '3001', '3002']
@@ -0,0 +1,59 @@
+import os
+import time
+
+import pandas as pd
+
+import data_processing as dp
+from reports import ReportService
+from sql_store import SqlStore, build_store
+
+
+def make_patients():
+    return pd.DataFrame({'Id': ['A', 'B'], 'FIRST': ['ANA', 'BEN'], 'LAST': ['LEE', 'LI'], 'GENDER': ['F', 'M'],
+                         'BIRTHDATE': ['1980-01-01', '1990-01-01'], 'RACE': ['WHITE', 'ASIAN'],
+                         'ETHNICITY': ['NONHISPANIC'] * 2, 'MARITAL': ['M', 'S'], 'ADDRESS': ['1 MAIN ST'] * 2,
+                         'CITY': ['BOSTON'] * 2, 'STATE': ['MASSACHUSETTS'] * 2, 'ZIP': ['02108'] * 2})
+
+
+def test_services_of_other_data_versions_keep_their_disk_caches(tmp_path):
+    patients = make_patients()
+    procedures = pd.DataFrame({'PATIENT': ['A']})
+    first = ReportService.from_tables(patients, pd.DataFrame({'PATIENT': ['A', 'B']}), procedures, cache_dir=str(tmp_path))
+    first.get('A')
+    second = ReportService.from_tables(patients, pd.DataFrame({'PATIENT': ['A']}), procedures, cache_dir=str(tmp_path))
+
+    assert first.cache_path != second.cache_path
+    assert os.path.exists(first.cache_path)
+    assert first.load_from_disk('A') == first.render('A')
+
+
+def test_long_unused_disk_caches_are_removed(tmp_path):
+    patients = make_patients()
+    procedures = pd.DataFrame({'PATIENT': ['A']})
+    stale = ReportService.from_tables(patients, pd.DataFrame({'PATIENT': ['A', 'B']}), procedures, cache_dir=str(tmp_path))
+    last_used = time.time() - 30 * 24 * 3600
+    os.utime(stale.cache_path, (last_used, last_used))
+    ReportService.from_tables(patients, pd.DataFrame({'PATIENT': ['A']}), procedures, cache_dir=str(tmp_path))
+
+    assert not os.path.exists(stale.cache_path)
+
+
+def test_reports_are_the_same_for_every_storage_backend(tmp_path):
+    patients = make_patients()
+    patients['BIRTHDATE'] = pd.to_datetime(['2014-12-24', None])
+    encounters = pd.DataFrame({'PATIENT': ['A', 'A', 'B']})
+    procedures = pd.DataFrame({'PATIENT': ['A']})
+    patients.to_csv(tmp_path / 'patients_cleaned.csv', index=False)
+    dp.save_df_to_parquet(patients, str(tmp_path / 'patients_cleaned.parquet'))
+    build_store({'patients': patients, 'encounters': encounters, 'procedures': procedures}, str(tmp_path / 'store.db'))
+
+    from_csv = pd.read_csv(tmp_path / 'patients_cleaned.csv', dtype={'ZIP': str})
+    from_parquet = dp.load_cleaned_table(str(tmp_path / 'patients_cleaned.csv'))
+    services = [ReportService.from_tables(from_csv, encounters, procedures),
+                ReportService.from_tables(from_parquet, encounters, procedures),
+                ReportService.from_store(SqlStore(str(tmp_path / 'store.db')))]
+
+    for patient_id in ['A', 'B']:
+        reports = {service.render(patient_id) for service in services}
+        assert len(reports) == 1
+    assert 'Date of Birth: 2014-12-24\n' in services[0].render('A')
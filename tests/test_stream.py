@@ -0,0 +1,32 @@
+import pandas as pd
+
+import data_processing as dp
+
+
+def test_stream_removes_duplicates_across_chunks_with_missing_values(tmp_path):
+    source = tmp_path / 'procedures.csv'
+    output = tmp_path / 'procedures_cleaned.csv'
+    # CODE is missing in the first chunk only, row 3 duplicates row 0
+    source.write_text('PATIENT,CODE\nP1,2186\nP2,\nP3,3001\nP1,2186\n')
+
+    seen = dp.HashKeySet()
+    rows_in, rows_out = dp.stream_clean_csv(str(source), str(output), [lambda df: dp.preprocess_columns(df, seen_keys=seen)],
+                                            chunksize=2, separator=',')
+
+    cleaned = pd.read_csv(output, dtype=str, keep_default_na=False)
+    assert (rows_in, rows_out) == (4, 3)
+    assert cleaned['CODE'].tolist() == ['2186', '', '3001']
+
+
+def test_stream_reads_non_utf8_bytes_past_the_sampled_prefix(tmp_path):
+    source = tmp_path / 'patients.csv'
+    output = tmp_path / 'patients_cleaned.csv'
+    rows = [f'P{i},BOSTON' for i in range(20_000)] + ['P20000,S\xe3O PAULO']
+    source.write_bytes(('Id,CITY\n' + '\n'.join(rows) + '\n').encode('latin1'))
+
+    rows_in, rows_out = dp.stream_clean_csv(str(source), str(output), [dp.preprocess_columns], chunksize=1000)
+
+    cleaned = pd.read_csv(output)
+    assert rows_in == rows_out == 20_001
+    assert cleaned['Id'].is_unique
+    assert cleaned['CITY'].iloc[-1] == 'S\xc3O PAULO'